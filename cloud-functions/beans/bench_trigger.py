@@ -0,0 +1,223 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Import time, per-request latency and batch throughput of the trigger.
+
+The Google SDK, kfp and functions_framework are replaced by in-process fakes
+that sleep for the configured latencies, so the numbers show what the
+function itself adds, what the client and template caches save and how
+many submissions per second the batch route sustains.
+
+    python cloud-functions/beans/bench_trigger.py --requests 200
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import itertools
+import statistics
+import sys
+import time
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+CONFIG_VALUES = {
+    "project_id": "bench-project",
+    "location": "us-central1",
+    "service_account": "bench@bench-project.iam.gserviceaccount.com",
+    "staging_bucket": "bench-staging",
+    "pipeline_repo": "mlops",
+    "pipeline_name": "beans-pipeline",
+    "pipeline_tag": "latest",
+    "pipeline_display_name": "beans-pipeline-bench",
+}
+
+
+class FakeRequest:
+    def __init__(self, body=None, path="/", args=None):
+        self.body = body
+        self.path = path
+        self.args = args or {}
+        self.form = types.SimpleNamespace(to_dict=dict)
+
+    def get_json(self, silent=False):
+        return self.body
+
+
+def trigger_request(index):
+    return FakeRequest(
+        {
+            "config_values": dict(CONFIG_VALUES),
+            "parameter_values": {
+                "bq_source": f"bq://bench-project.beans.beans{index}",
+                "dataset_name": f"beans-{index}",
+                "email_addresses": [],
+            },
+        },
+    )
+
+
+def install_fakes(latency):
+    """Registers stand-ins for every SDK module main.py imports."""
+    job_ids = itertools.count()
+
+    class NotFound(Exception):
+        pass
+
+    def load_yaml(path, project=None, credentials=None):
+        time.sleep(latency["template"])
+        return {"pipelineSpec": {}}
+
+    class FakePipelineJob:
+        def __init__(self, display_name, template_path, **kwargs):
+            self.display_name = display_name
+            self.template_path = template_path
+            self.pipeline_spec = yaml_utils.load_yaml(template_path)
+            self.resource_name = (
+                "projects/bench-project/locations/us-central1/pipelineJobs/"
+                f"job-{next(job_ids)}"
+            )
+            self.state = types.SimpleNamespace(name="PIPELINE_STATE_PENDING")
+
+        def submit(self, service_account=None):
+            time.sleep(latency["submit"])
+
+    def init(**kwargs):
+        time.sleep(latency["init"])
+
+    def default(**kwargs):
+        time.sleep(latency["auth"])
+        return object(), "bench-project"
+
+    def module(name, **attrs):
+        fake = types.ModuleType(name)
+        fake.__dict__.update(attrs)
+        sys.modules[name] = fake
+        return fake
+
+    yaml_utils = module("google.cloud.aiplatform.utils.yaml_utils", load_yaml=load_yaml)
+    utils = module("google.cloud.aiplatform.utils", yaml_utils=yaml_utils)
+    aiplatform = module(
+        "google.cloud.aiplatform",
+        init=init,
+        PipelineJob=FakePipelineJob,
+        utils=utils,
+    )
+    auth = module("google.auth", default=default)
+    exceptions = module("google.api_core.exceptions", NotFound=NotFound)
+    module("google.api_core", exceptions=exceptions)
+    module("google.cloud", aiplatform=aiplatform)
+    module("google", cloud=sys.modules["google.cloud"], auth=auth)
+    module("functions_framework", http=lambda function: function)
+
+
+def import_main():
+    sys.modules.pop("main", None)
+    start = time.perf_counter()
+    main = importlib.import_module("main")
+    return main, time.perf_counter() - start
+
+
+def batch_throughput(main, batch_size, duplicates):
+    # Items past the first `unique` ones repeat earlier items.
+    unique = max(1, round(batch_size * (1 - duplicates)))
+    items = [trigger_request(index % unique).body for index in range(batch_size)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for item in items:
+            main.submit_pipeline(dict(item))
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = main.run_beans_pipeline(
+            FakeRequest({"requests": items}, path="/batch"),
+        )
+    batched = time.perf_counter() - start
+    assert response["statusCode"] == 200, response["message"]
+    return unique, batch_size / sequential, batch_size / batched
+
+
+def request_latencies(main, requests, reuse):
+    latencies = []
+    for index in range(requests):
+        if not reuse:
+            # What the function did before: init and template resolution on
+            # every request.
+            main.CLIENTS = main.ClientCache()
+            main.TEMPLATES.ttl = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = main.run_beans_pipeline(trigger_request(index))
+        latencies.append(time.perf_counter() - start)
+        assert response["statusCode"] == 202, response
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--imports", type=int, default=20)
+    parser.add_argument("--init-ms", type=float, default=5.0)
+    parser.add_argument("--auth-ms", type=float, default=50.0)
+    parser.add_argument("--template-ms", type=float, default=150.0)
+    parser.add_argument("--submit-ms", type=float, default=100.0)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument(
+        "--duplicates",
+        type=float,
+        default=0.2,
+        help="Fraction of batch items that repeat another item.",
+    )
+    args = parser.parse_args()
+
+    install_fakes(
+        {
+            "init": args.init_ms / 1000,
+            "auth": args.auth_ms / 1000,
+            "template": args.template_ms / 1000,
+            "submit": args.submit_ms / 1000,
+        },
+    )
+
+    import_seconds = [import_main()[1] for _ in range(args.imports)]
+    print(f"import main: median {statistics.median(import_seconds) * 1000:.2f} ms")
+
+    print(f"{'mode':<10} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, reuse in (("no reuse", False), ("reuse", True)):
+        main_module, _ = import_main()
+        latencies = request_latencies(main_module, args.requests, reuse)
+        warm = sorted(latencies[1:])
+        print(
+            f"{mode:<10} {latencies[0] * 1000:>9.1f}"
+            f" {statistics.median(warm) * 1000:>8.1f}"
+            f" {warm[int(len(warm) * 0.95)] * 1000:>8.1f}",
+        )
+
+    print(f"{'batch':>6} {'unique':>7} {'one by one/s':>13} {'batch/s':>9}")
+    for batch_size in args.batch_sizes:
+        unique, sequential, batched = batch_throughput(
+            main_module,
+            batch_size,
+            args.duplicates,
+        )
+        print(f"{batch_size:>6} {unique:>7} {sequential:>13.1f} {batched:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
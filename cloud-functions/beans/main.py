@@ -12,40 +12,252 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import functions_framework
+import contextlib
+import copy
+import json
+import threading
 import time
-from google.cloud import aiplatform
-from google.api_core.exceptions import NotFound
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import functions_framework
 
-MAX_ATTEMPS_STATUS = 6  # Wait for approximately 2 min
-WAIT_INTERVAL_SECONDS = 20  # 20 seconds between attempts
-RUNNING = aiplatform.gapic.PipelineState.PIPELINE_STATE_RUNNING
-FAILED = aiplatform.gapic.PipelineState.PIPELINE_STATE_FAILED
+# Polling only happens when a caller asks to wait for the job to start.
+INITIAL_POLL_SECONDS = 1
+MAX_POLL_SECONDS = 16
+WAIT_DEADLINE_SECONDS = 120  # Hard limit, below the function timeout
+# A tag such as "latest" is re-resolved from the registry after this long.
+TEMPLATE_TTL_SECONDS = 300
+BATCH_MAX_ITEMS = 100
+BATCH_MAX_WORKERS = 8
 
+# States are compared by name so that google.cloud.aiplatform is only
+# imported when a request needs it, not at cold start.
+RUNNING = "PIPELINE_STATE_RUNNING"
+FAILED = "PIPELINE_STATE_FAILED"
+TERMINAL_STATES = [
+    "PIPELINE_STATE_SUCCEEDED",
+    FAILED,
+    "PIPELINE_STATE_CANCELLED",
+]
 
-@functions_framework.http
-def run_beans_pipeline(request):
-    """HTTP Cloud Function.
-    Args:
-        request (flask.Request): The request object.
-        <https://flask.palletsprojects.com/en/1.1.x/api/#incoming-request-data>
-    Returns:
-        The response text, or any set of values that can be turned into a
-        Response object using `make_response`
-        <https://flask.palletsprojects.com/en/1.1.x/api/#flask.make_response>.
+
+def get_aiplatform():
+    from google.cloud import aiplatform
+    from google.cloud.aiplatform.utils import yaml_utils
+
+    TEMPLATES.install(yaml_utils)
+    return aiplatform
+
+
+class ClientCache:
+    """Per-process SDK state, keyed by project and location.
+
+    Credentials are resolved once per project, and `aiplatform.init` only
+    runs again when a request targets a different project, location or
+    staging bucket than the previous one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._current = None
+
+    def credentials(self, project):
+        with self._lock:
+            return self._get_credentials(project)
+
+    def _get_credentials(self, project):
+        if project not in self._credentials:
+            import google.auth
+
+            self._credentials[project], _ = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/cloud-platform"],
+                quota_project_id=project,
+            )
+        return self._credentials[project]
+
+    @contextlib.contextmanager
+    def session(self, project, location, staging_bucket):
+        # aiplatform.init sets process-wide defaults that PipelineJob reads
+        # when it is constructed, so construction happens under the lock.
+        # Callers load the template first (TemplateCache.prefetch), so the
+        # lock is never held for a registry download.
+        with self._lock:
+            credentials = self._get_credentials(project)
+            key = (project, location, staging_bucket)
+            if self._current != key:
+                get_aiplatform().init(
+                    project=project,
+                    location=location,
+                    staging_bucket=staging_bucket,
+                    credentials=credentials,
+                )
+                self._current = key
+            yield credentials
+
+
+class TemplateCache:
+    """Compiled pipeline templates loaded from the registry, kept for a TTL.
+
+    PipelineJob is still given the registry URI, so every job records the
+    template it came from; only the SDK's loading of that URI goes through
+    the cache. Concurrent requests for the same template wait for a single
+    download.
     """
+
+    def __init__(self, ttl=TEMPLATE_TTL_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+        self._load_yaml = None
+
+    def _load(self, uri, load):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(uri, threading.Lock())
+        with key_lock:
+            entry = self._entries.get(uri)
+            if entry is None or entry[0] <= self.clock():
+                entry = (self.clock() + self.ttl, load(uri))
+                self._entries[uri] = entry
+        return entry[1]
+
+    def get(self, uri, load):
+        # PipelineJob fills in the dict it is given, so each job gets a copy.
+        return copy.deepcopy(self._load(uri, load))
+
+    def prefetch(self, uri, project, credentials):
+        """Loads a registry template now, so that PipelineJob finds it here."""
+        if self._load_yaml is None or not uri.startswith("https://"):
+            return
+        load_yaml = self._load_yaml
+        self._load(uri, lambda uri: load_yaml(uri, project, credentials))
+
+    def install(self, yaml_utils):
+        """Routes the SDK's template loading of registry URIs through here."""
+        with self._lock:
+            load_yaml = yaml_utils.load_yaml
+            if getattr(load_yaml, "template_cache", None) is self:
+                return
+            self._load_yaml = load_yaml
+
+            def cached_load_yaml(path, project=None, credentials=None):
+                if not path.startswith("https://"):
+                    return load_yaml(path, project, credentials)
+                return self.get(
+                    path,
+                    lambda uri: load_yaml(uri, project, credentials),
+                )
+
+            cached_load_yaml.template_cache = self
+            yaml_utils.load_yaml = cached_load_yaml
+
+
+CLIENTS = ClientCache()
+TEMPLATES = TemplateCache()
+
+
+def state_name(state):
+    return getattr(state, "name", str(state)).replace("PIPELINE_STATE_", "")
+
+
+def wait_for_state(job, states, deadline, sleep=time.sleep, clock=time.monotonic):
+    """Polls job.state with exponential backoff until it reaches one of
+    `states` or `deadline` seconds have passed. Returns the last state seen.
+    """
+    give_up = clock() + deadline
+    interval = INITIAL_POLL_SECONDS
+    state = job.state
+    while state.name not in states:
+        remaining = give_up - clock()
+        if remaining <= 0:
+            break
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, MAX_POLL_SECONDS)
+        state = job.state
+    return state
+
+
+def get_status(request, pipeline_job=None):
+    """Reports the state of a job submitted by `run_beans_pipeline`.
+
+    The job is given by its resource name in the `job` query parameter or
+    JSON field, as returned in `jobResourceName`.
+    """
+    from google.api_core.exceptions import NotFound
+
+    pipeline_job = pipeline_job or get_aiplatform().PipelineJob
     res_message = {
         "statusCode": 400,
-        "pipelineStatus": "FAILED",
+        "pipelineStatus": "UNKNOWN",
         "message": "",
         "jobName": None,
     }
 
+    request_json = request.get_json(silent=True) or {}
+    resource_name = request.args.get("job") or request_json.get("job")
+    if not resource_name:
+        res_message["message"] = "Missing required parameter: job"
+        return res_message
+
+    # projects/{project}/locations/{location}/pipelineJobs/{id}
+    parts = resource_name.split("/")
+    if len(parts) != 6 or parts[0] != "projects" or parts[2] != "locations":
+        res_message["message"] = f"Invalid job resource name: {resource_name}"
+        return res_message
+
+    try:
+        job = pipeline_job.get(
+            resource_name=resource_name,
+            project=parts[1],
+            location=parts[3],
+            credentials=CLIENTS.credentials(parts[1]),
+        )
+    except NotFound:
+        res_message["statusCode"] = 404
+        res_message["message"] = f"Pipeline job {resource_name} not found."
+        return res_message
+
+    status = state_name(job.state)
+    res_message["statusCode"] = 200
+    res_message["pipelineStatus"] = status
+    res_message["message"] = f"Pipeline job {job.display_name} is {status}."
+    res_message["jobName"] = job.display_name
+    res_message["jobResourceName"] = resource_name
+    return res_message
+
+
+def trigger_pipeline(request, **kwargs):
+    """Submits the pipeline job described by the request body."""
     # Get the input parameters from the request
     request_json = request.get_json(silent=True)
     if request_json is None:
         request_json = request.form.to_dict()
+    return submit_pipeline(request_json, **kwargs)
+
+
+def submit_pipeline(
+    request_json,
+    pipeline_job=None,
+    sleep=time.sleep,
+    clock=time.monotonic,
+):
+    """Submits one pipeline job from its config and parameter values.
+
+    By default the job handle is returned right after submission. With
+    `"wait": true` in `config_values` the call blocks until the job is
+    running or failed, for at most WAIT_DEADLINE_SECONDS.
+    """
+    from google.api_core.exceptions import NotFound
+
+    pipeline_job = pipeline_job or get_aiplatform().PipelineJob
+    res_message = {
+        "statusCode": 400,
+        "pipelineStatus": "FAILED",
+        "message": "",
+        "jobName": None,
+    }
 
     # Validate required parameters
     required_params = ["config_values", "parameter_values"]
@@ -70,10 +282,10 @@ def run_beans_pipeline(request):
     except KeyError as e:
         # Handle the missing parameter error
         res_message["message"] = f"Missing required parameter: {e}"
+        return res_message
 
-    pipeline_root = (
-        f"https://{location}-kfp.pkg.dev/{project_id}/{pipeline_repo}/{pipeline_name}"
-    )
+    pipeline_host = f"https://{location}-kfp.pkg.dev/{project_id}/{pipeline_repo}"
+    pipeline_root = f"{pipeline_host}/{pipeline_name}"
 
     # Get pipeline definition from Registry
     general_values = {key: config_values[key] for key in ["project_id", "location"]}
@@ -81,22 +293,27 @@ def run_beans_pipeline(request):
         parameter_values["email_addresses"] = ["dummy@example.com"]
     parameter_values = parameter_values | general_values
 
+    template_path = f"{pipeline_root}/{pipeline_tag}"
     try:
-        aiplatform.init(
-            project=project_id,
-            location=location,
-            staging_bucket=staging_bucket,
-        )
-        job = aiplatform.PipelineJob(
-            display_name=pipeline_display_name,
-            template_path=f"{pipeline_root}/{pipeline_tag}",
-            parameter_values=parameter_values,
+        # Downloaded outside the session, whose lock every request shares.
+        TEMPLATES.prefetch(
+            template_path,
+            project_id,
+            CLIENTS.credentials(project_id),
         )
-        # If the pipeline job is created successfully, you can start it here
-        print(
-            job.submit(
-                service_account=service_account,
-            ),
+        with CLIENTS.session(project_id, location, staging_bucket) as credentials:
+            job = pipeline_job(
+                display_name=pipeline_display_name,
+                template_path=template_path,
+                parameter_values=parameter_values,
+                project=project_id,
+                location=location,
+                credentials=credentials,
+            )
+        # submit() returns once the job is created; it does not wait for it
+        # to be scheduled.
+        job.submit(
+            service_account=service_account,
         )
         print(f"Pipeline job {job.display_name} submitted successfully.")
 
@@ -114,23 +331,145 @@ def run_beans_pipeline(request):
         )
         return res_message
 
+    res_message["jobName"] = job.display_name
+    res_message["jobResourceName"] = job.resource_name
+
+    if not config_values.get("wait", False):
+        res_message["statusCode"] = 202
+        res_message["pipelineStatus"] = "SUBMITTED"
+        res_message["message"] = (
+            f"Pipeline job {job.display_name} submitted. "
+            "Query the status endpoint with jobResourceName for its state."
+        )
+        return res_message
+
     # Wait for Running or Failed status before finalizing
-    attempt = 0
-    while job.state not in [RUNNING, FAILED]:
-        attempt += 1
-        if attempt > MAX_ATTEMPS_STATUS:
-            res_message["message"] = (
-                f"Pipeline with '{job.state}' did not run within the time limit."
-            )
-        time.sleep(WAIT_INTERVAL_SECONDS)
+    state = wait_for_state(
+        job,
+        [RUNNING] + TERMINAL_STATES,
+        WAIT_DEADLINE_SECONDS,
+        sleep=sleep,
+        clock=clock,
+    )
 
-    if job.state == RUNNING:
+    status = state_name(state)
+    res_message["pipelineStatus"] = status
+    if state.name == RUNNING:
         res_message["statusCode"] = 200
-        res_message["pipelineStatus"] = "RUNNING"
         res_message["message"] = f"Pipeline job {job.display_name} is running."
-    elif job.state == FAILED:
+    elif state.name == FAILED:
         res_message["statusCode"] = 400
-        res_message["pipelineStatus"] = "FAILED"
         res_message["message"] = f"Pipeline job {job.display_name} failed."
-    res_message["jobName"] = job.display_name
+    elif state.name in TERMINAL_STATES:
+        res_message["statusCode"] = 200
+        res_message["message"] = f"Pipeline job {job.display_name} is {status}."
+    else:
+        res_message["statusCode"] = 202
+        res_message["message"] = (
+            f"Pipeline with '{status}' did not run within the time limit."
+        )
     return res_message
+
+
+class InFlight:
+    """Runs at most one call per key at a time; concurrent callers with the
+    same key wait for, and share, the result of the call in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def run(self, key, function):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+        if not owner:
+            return future.result(), True
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+
+IN_FLIGHT = InFlight()
+
+
+def batch_trigger(request, pipeline_job=None, max_workers=BATCH_MAX_WORKERS):
+    """Submits a list of `{"config_values", "parameter_values"}` items.
+
+    Identical items, in this batch or in flight from another request, are
+    submitted once and share the result. Distinct items are submitted
+    concurrently by a bounded pool, and templates are resolved once per
+    repo, name and tag through TEMPLATES. Results keep the request order.
+    """
+    res_message = {
+        "statusCode": 400,
+        "message": "",
+        "results": [],
+    }
+
+    request_json = request.get_json(silent=True) or {}
+    items = request_json.get("requests")
+    if not isinstance(items, list) or not items:
+        res_message["message"] = "Missing required parameter: requests"
+        return res_message
+    if not all(isinstance(item, dict) for item in items):
+        res_message["message"] = "Every request must be a JSON object"
+        return res_message
+    if len(items) > BATCH_MAX_ITEMS:
+        res_message["message"] = f"At most {BATCH_MAX_ITEMS} requests per batch"
+        return res_message
+
+    # Keys are taken before submit_pipeline fills in defaults.
+    keys = [json.dumps(item, sort_keys=True, default=str) for item in items]
+    unique = dict(zip(keys, items))
+
+    def submit(key):
+        item = copy.deepcopy(unique[key])
+        return IN_FLIGHT.run(
+            key,
+            lambda: submit_pipeline(item, pipeline_job=pipeline_job),
+        )
+
+    workers = max(1, min(max_workers, len(unique)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = dict(zip(unique, pool.map(submit, unique)))
+
+    results = []
+    seen = set()
+    for key in keys:
+        result, shared = outcomes[key]
+        results.append({**result, "deduplicated": shared or key in seen})
+        seen.add(key)
+    submitted = sum(result["statusCode"] < 400 for result in results)
+
+    res_message["statusCode"] = 200 if submitted == len(results) else 207
+    res_message["message"] = f"{submitted} of {len(results)} requests submitted."
+    res_message["results"] = results
+    return res_message
+
+
+@functions_framework.http
+def run_beans_pipeline(request):
+    """HTTP Cloud Function.
+    Args:
+        request (flask.Request): The request object.
+        <https://flask.palletsprojects.com/en/1.1.x/api/#incoming-request-data>
+    Returns:
+        The response text, or any set of values that can be turned into a
+        Response object using `make_response`
+        <https://flask.palletsprojects.com/en/1.1.x/api/#flask.make_response>.
+    """
+    path = request.path.rstrip("/")
+    if path.endswith("/status"):
+        return get_status(request)
+    if path.endswith("/batch"):
+        return batch_trigger(request)
+    return trigger_pipeline(request)
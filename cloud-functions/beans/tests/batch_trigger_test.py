@@ -0,0 +1,93 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The /batch route: deduplication in a batch and across requests in flight."""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import main
+from conftest import call, trigger_body
+
+
+def test_duplicates_in_a_batch(vertex):
+    items = [trigger_body("a"), trigger_body("b"), trigger_body("a")]
+
+    response = call("/batch", {"requests": items})
+
+    assert response["statusCode"] == 200
+    results = response["results"]
+    assert [result["deduplicated"] for result in results] == [False, False, True]
+    assert results[0]["jobResourceName"] == results[2]["jobResourceName"]
+    assert results[0]["jobResourceName"] != results[1]["jobResourceName"]
+    assert len(vertex.jobs) == 2
+    # Both jobs came from one download of the template.
+    assert len(vertex.downloads) == 1
+
+
+def test_duplicates_across_requests_in_flight(vertex, monkeypatch):
+    waiting = threading.Semaphore(0)
+
+    class WatchedFuture(Future):
+        # The caller that submits only reads its result once it is set; any
+        # other caller blocks here, on the call in flight.
+        def result(self, timeout=None):
+            if not self.done():
+                waiting.release()
+            return super().result(timeout)
+
+    monkeypatch.setattr(main, "Future", WatchedFuture)
+    vertex.gate = threading.Event()
+    body = {"requests": [trigger_body("a")]}
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(call, "/batch", body)
+        assert vertex.submitting.wait(timeout=10)
+        second = pool.submit(call, "/batch", body)
+        assert waiting.acquire(timeout=10)
+        vertex.gate.set()
+        first, second = first.result(), second.result()
+
+    assert len(vertex.jobs) == 1
+    assert first["results"][0]["deduplicated"] is False
+    assert second["results"][0]["deduplicated"] is True
+    assert first["results"][0]["jobResourceName"] == (
+        second["results"][0]["jobResourceName"]
+    )
+
+
+def test_partial_failure(vertex):
+    broken = trigger_body("b")
+    del broken["config_values"]["location"]
+
+    response = call("/batch", {"requests": [trigger_body("a"), broken]})
+
+    assert response["statusCode"] == 207
+    assert [result["statusCode"] for result in response["results"]] == [202, 400]
+
+
+def test_template_download_outside_the_client_lock(vertex):
+    held = []
+    load_yaml = vertex.load_yaml
+
+    def watched_load_yaml(path, project=None, credentials=None):
+        held.append(main.CLIENTS._lock.locked())
+        return load_yaml(path, project, credentials)
+
+    vertex.yaml_utils.load_yaml = watched_load_yaml
+
+    call("/batch", {"requests": [trigger_body("a"), trigger_body("b")]})
+
+    assert held == [False]
+    assert len(vertex.jobs) == 2
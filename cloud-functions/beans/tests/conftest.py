@@ -0,0 +1,146 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A fake Vertex AI behind main.get_aiplatform, and the function's routes."""
+
+import itertools
+import sys
+import threading
+import types
+from pathlib import Path
+
+import flask
+import google.auth
+import pytest
+from google.api_core.exceptions import NotFound
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+PROJECT_ID = "beans-project"
+LOCATION = "us-central1"
+
+APP = flask.Flask(__name__)
+
+
+def state(name):
+    return types.SimpleNamespace(name=f"PIPELINE_STATE_{name}")
+
+
+class FakeVertex:
+    """The parts of google.cloud.aiplatform main.py uses.
+
+    Jobs load their template through ``yaml_utils.load_yaml`` when they are
+    constructed, as the SDK does, and are registered when submitted.
+    ``gate``, when set, holds every submit() until it is set.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.inits = []
+        self.downloads = []
+        self.gate = None
+        self.submitting = threading.Event()
+        self.yaml_utils = types.SimpleNamespace(load_yaml=self.load_yaml)
+        job_ids = itertools.count()
+        vertex = self
+
+        class PipelineJob:
+            def __init__(
+                self,
+                display_name,
+                template_path,
+                parameter_values,
+                project,
+                location,
+                credentials,
+            ):
+                self.display_name = display_name
+                self.parameter_values = parameter_values
+                self.pipeline_spec = vertex.yaml_utils.load_yaml(
+                    template_path,
+                    project,
+                    credentials,
+                )
+                self.resource_name = (
+                    f"projects/{project}/locations/{location}/pipelineJobs/"
+                    f"job-{next(job_ids)}"
+                )
+                self.state = state("PENDING")
+
+            def submit(self, service_account=None):
+                vertex.submitting.set()
+                if vertex.gate is not None:
+                    vertex.gate.wait(timeout=10)
+                vertex.jobs[self.resource_name] = self
+
+            @staticmethod
+            def get(resource_name, project, location, credentials):
+                if resource_name not in vertex.jobs:
+                    raise NotFound(f"{resource_name} not found")
+                return vertex.jobs[resource_name]
+
+        self.PipelineJob = PipelineJob
+
+    def init(self, **kwargs):
+        self.inits.append(kwargs)
+
+    def load_yaml(self, path, project=None, credentials=None):
+        self.downloads.append(path)
+        return {"pipelineSpec": {}}
+
+
+@pytest.fixture
+def vertex(monkeypatch):
+    fake = FakeVertex()
+    monkeypatch.setattr(google.auth, "default", lambda **kwargs: (object(), None))
+    monkeypatch.setattr(main, "CLIENTS", main.ClientCache())
+    monkeypatch.setattr(main, "TEMPLATES", main.TemplateCache())
+    monkeypatch.setattr(main, "IN_FLIGHT", main.InFlight())
+
+    def get_aiplatform():
+        main.TEMPLATES.install(fake.yaml_utils)
+        return fake
+
+    monkeypatch.setattr(main, "get_aiplatform", get_aiplatform)
+    return fake
+
+
+def call(path, body=None, **query):
+    """Sends one request through the function's entry point."""
+    method = "GET" if body is None else "POST"
+    with APP.test_request_context(path, method=method, json=body, query_string=query):
+        return main.run_beans_pipeline(flask.request)
+
+
+def trigger_body(dataset_name="beans", **config):
+    return {
+        "config_values": {
+            "project_id": PROJECT_ID,
+            "location": LOCATION,
+            "service_account": f"pipelines@{PROJECT_ID}.iam.gserviceaccount.com",
+            "staging_bucket": "beans-staging",
+            "pipeline_repo": "mlops",
+            "pipeline_name": "beans-pipeline",
+            "pipeline_tag": "latest",
+            "pipeline_display_name": f"{dataset_name}-run",
+            **config,
+        },
+        "parameter_values": {
+            "bq_source": f"bq://{PROJECT_ID}.beans.{dataset_name}",
+            "dataset_name": dataset_name,
+            "email_addresses": [],
+        },
+    }
@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The trigger and /status routes against a fake PipelineJob."""
+
+import pytest
+from conftest import LOCATION, PROJECT_ID, call, state, trigger_body
+
+
+def test_submit_then_status(vertex):
+    response = call("/", trigger_body())
+
+    assert response["statusCode"] == 202
+    assert response["pipelineStatus"] == "SUBMITTED"
+    job_name = response["jobResourceName"]
+    job = vertex.jobs[job_name]
+    assert job.parameter_values["project_id"] == PROJECT_ID
+    # An empty recipient list is replaced so that the exit handler can run.
+    assert job.parameter_values["email_addresses"] == ["dummy@example.com"]
+
+    status = call("/status", job=job_name)
+    assert status["statusCode"] == 200
+    assert status["pipelineStatus"] == "PENDING"
+    assert status["jobName"] == "beans-run"
+
+
+@pytest.mark.parametrize("final", ["SUCCEEDED", "FAILED"])
+def test_status_follows_the_job(vertex, final):
+    job_name = call("/", trigger_body())["jobResourceName"]
+
+    vertex.jobs[job_name].state = state("RUNNING")
+    assert call("/status", job=job_name)["pipelineStatus"] == "RUNNING"
+    vertex.jobs[job_name].state = state(final)
+    status = call("/status/", {"job": job_name})
+    assert status["statusCode"] == 200
+    assert status["pipelineStatus"] == final
+
+
+def test_status_of_an_unknown_job(vertex):
+    job_name = f"projects/{PROJECT_ID}/locations/{LOCATION}/pipelineJobs/missing"
+
+    status = call("/status", job=job_name)
+
+    assert status["statusCode"] == 404
+    assert status["pipelineStatus"] == "UNKNOWN"
+
+
+@pytest.mark.parametrize("query", [{}, {"job": "pipelineJobs/job-0"}])
+def test_status_needs_a_job_resource_name(vertex, query):
+    assert call("/status", **query)["statusCode"] == 400
+
+
+def test_missing_config_value(vertex):
+    body = trigger_body()
+    del body["config_values"]["pipeline_tag"]
+
+    response = call("/", body)
+
+    assert response["statusCode"] == 400
+    assert "pipeline_tag" in response["message"]
+    assert not vertex.jobs
@@ -0,0 +1,102 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per step and phase summary of the trace files the components write.
+
+Every profiled step run with a trace_uri leaves one JSON-lines file there;
+this reads all of them (a local directory or a gcsfuse mount of the bucket)
+and reports each phase's wall time, CPU time, I/O and peak RSS over runs.
+
+    python vertex-pipelines/benchmarks/aggregate_traces.py /gcs/bucket/dev/traces
+"""
+
+import argparse
+import json
+import statistics
+from collections import defaultdict
+from pathlib import Path
+
+
+def read_traces(directory):
+    for path in sorted(Path(directory).rglob("*.jsonl")):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def summarize(records):
+    # A run is one trace file's artifact URI; phases entered several times
+    # in a run (per chunk, per shard) are summed first.
+    runs = defaultdict(lambda: defaultdict(float))
+    peaks = defaultdict(int)
+    for record in records:
+        key = (record["step"], record["phase"])
+        run = runs[key, record.get("uri", "")]
+        for field in ("wall_seconds", "cpu_seconds", "read_bytes", "written_bytes"):
+            run[field] += record[field]
+        peaks[key] = max(peaks[key], record["peak_rss_bytes"])
+
+    phases = defaultdict(list)
+    for (key, _), run in runs.items():
+        phases[key].append(run)
+
+    def median(samples, field, scale=1):
+        return statistics.median(sample[field] for sample in samples) / scale
+
+    summary = []
+    for (step, phase), samples in sorted(phases.items()):
+        walls = sorted(sample["wall_seconds"] for sample in samples)
+        summary.append(
+            {
+                "step": step,
+                "phase": phase,
+                "runs": len(samples),
+                "wall_p50": statistics.median(walls),
+                "wall_p95": walls[min(len(walls) - 1, int(len(walls) * 0.95))],
+                "cpu_p50": median(samples, "cpu_seconds"),
+                "read_mb_p50": median(samples, "read_bytes", 2**20),
+                "written_mb_p50": median(samples, "written_bytes", 2**20),
+                "peak_rss_mb": peaks[step, phase] / 2**20,
+            },
+        )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    summary = summarize(read_traces(args.directory))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(
+        f"{'step':<28} {'phase':<13} {'runs':>5} {'wall p50':>9} {'wall p95':>9}"
+        f" {'cpu p50':>8} {'read MB':>9} {'write MB':>9} {'rss MB':>8}",
+    )
+    for row in summary:
+        print(
+            f"{row['step']:<28} {row['phase']:<13} {row['runs']:>5}"
+            f" {row['wall_p50']:>9.2f} {row['wall_p95']:>9.2f}"
+            f" {row['cpu_p50']:>8.2f} {row['read_mb_p50']:>9.1f}"
+            f" {row['written_mb_p50']:>9.1f} {row['peak_rss_mb']:>8.0f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rows/sec of the vectorized engine versus predict_proba per batch size.
+
+    python vertex-pipelines/benchmarks/bench_inference.py --estimator xgboost
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np  # noqa: E402
+
+from benchmarks import fakes  # noqa: E402
+from benchmarks.bench_model_format import build_model  # noqa: E402
+from serving.inference import compile_model  # noqa: E402
+
+
+def throughput(predict_proba, X, batch_size, min_seconds):
+    rows, elapsed = 0, 0.0
+    start = time.perf_counter()
+    while elapsed < min_seconds:
+        for i in range(0, len(X), batch_size):
+            predict_proba(X[i : i + batch_size])
+            rows += min(batch_size, len(X) - i)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--train-rows", type=int, default=100_000)
+    parser.add_argument(
+        "--estimator",
+        default="random_forest",
+        choices=["random_forest", "decision_tree", "xgboost", "logistic_regression"],
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 100_000])
+    parser.add_argument("--min-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    model = build_model(args.estimator, fakes.make_beans_frame(args.train_rows))
+    if hasattr(model, "n_jobs"):
+        # Single-threaded on both sides, and the forest then accumulates its
+        # trees in a fixed order that the engine reproduces bit for bit.
+        model.set_params(n_jobs=1)
+    engine = compile_model(model)
+
+    frame = fakes.make_beans_frame(max(args.batch_sizes), seed=1)
+    X = frame[fakes.BEAN_FEATURES].to_numpy(dtype=np.float32)
+
+    expected = model.predict_proba(X)
+    actual = engine.predict_proba(X)
+    print(f"max |engine - predict_proba| = {np.abs(expected - actual).max():.3g}")
+    print(f"identical: {np.array_equal(expected, actual)}")
+    print(f"within tolerance: {np.allclose(expected, actual, rtol=1e-5, atol=1e-6)}")
+
+    print(f"{'batch':>8} {'sklearn rows/s':>16} {'engine rows/s':>16} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        baseline = throughput(model.predict_proba, X, batch_size, args.min_seconds)
+        compiled = throughput(engine.predict_proba, X, batch_size, args.min_seconds)
+        print(
+            f"{batch_size:>8} {baseline:>16,.0f} {compiled:>16,.0f}"
+            f" {compiled / baseline:>7.1f}x",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""File size and load time of joblib versus the compact model format.
+
+    python vertex-pipelines/benchmarks/bench_model_format.py --rows 200000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import joblib  # noqa: E402
+
+from benchmarks import fakes  # noqa: E402
+from serving import compact_model  # noqa: E402
+
+
+def build_model(estimator, frame):
+    X = frame[fakes.BEAN_FEATURES].to_numpy(dtype="float32")
+    y = frame["Class"].astype("category").cat.codes.to_numpy()
+    if estimator == "random_forest":
+        from sklearn.ensemble import RandomForestClassifier
+
+        model = RandomForestClassifier(n_estimators=200, n_jobs=-1)
+    elif estimator == "decision_tree":
+        from sklearn.tree import DecisionTreeClassifier
+
+        model = DecisionTreeClassifier()
+    elif estimator == "xgboost":
+        from xgboost import XGBClassifier
+
+        model = XGBClassifier(n_estimators=200, tree_method="hist")
+    else:
+        from sklearn.linear_model import LogisticRegression
+
+        model = LogisticRegression(max_iter=500)
+    return model.fit(X, y)
+
+
+def timed(load, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument(
+        "--estimator",
+        default="random_forest",
+        choices=["random_forest", "decision_tree", "xgboost", "logistic_regression"],
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model = build_model(args.estimator, fakes.make_beans_frame(args.rows))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {
+            "joblib": os.path.join(workdir, "model.joblib"),
+            "joblib compress=3": os.path.join(workdir, "model-3.joblib"),
+            "compact": os.path.join(workdir, "model.bmdl"),
+        }
+        joblib.dump(model, paths["joblib"])
+        joblib.dump(model, paths["joblib compress=3"], compress=3)
+        compact_model.save(model, paths["compact"])
+
+        loaders = {
+            "joblib": lambda: joblib.load(paths["joblib"]),
+            "joblib mmap_mode=r": lambda: joblib.load(paths["joblib"], mmap_mode="r"),
+            "joblib compress=3": lambda: joblib.load(paths["joblib compress=3"]),
+            "compact": lambda: compact_model.load(paths["compact"], mmap=False),
+            "compact mmap": lambda: compact_model.load(paths["compact"]),
+        }
+
+        print(f"{'format':<22} {'bytes':>14} {'load ms':>10}")
+        for name, load in loaders.items():
+            path = paths[name.split(" mmap")[0]]
+            seconds = timed(load, args.repeats)
+            print(f"{name:<22} {os.path.getsize(path):>14,} {seconds * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
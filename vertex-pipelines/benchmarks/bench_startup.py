@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time from container start to the first line of component code.
+
+Without --docker, the two phases a component pays before its code runs are
+timed on this machine: the pip install of its packages into an empty target
+(--install) and a fresh interpreter importing them. With --docker, both
+images are run the way Vertex runs a step, and the time to the first line
+printed after the imports is reported; --cold removes the image first so
+that the pull is included.
+
+    python vertex-pipelines/benchmarks/bench_startup.py --install
+    python vertex-pipelines/benchmarks/bench_startup.py --docker \
+        --image us-docker.pkg.dev/my-project/mlops/components:latest --cold
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# The image the components ran on before the component image, installing
+# their packages at every start.
+LEGACY_IMAGE = "gcr.io/deeplearning-platform-release/tf2-cpu.2-6:latest"
+
+REQUIREMENTS = (
+    Path(__file__).resolve().parents[1] / "images" / "components" / "requirements.txt"
+)
+# What KFP installs when train_models starts on the legacy image.
+LEGACY_PACKAGES = [
+    "kfp==2.7.0",
+    "xgboost==1.6.2",
+    "pandas==1.3.5",
+    "joblib==1.1.0",
+    "pyarrow==6.0.1",
+]
+
+# The imports train_models and split_data do before their first line of work.
+IMPORTS = (
+    "import joblib, numpy, pandas, pyarrow.parquet, sklearn.ensemble, "
+    "sklearn.linear_model, sklearn.tree, xgboost; "
+    "from google.cloud import bigquery; "
+    "print('first line', flush=True)"
+)
+
+
+def requirements():
+    lines = REQUIREMENTS.read_text().splitlines()
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def time_command(command):
+    """Seconds until the command prints its first line, then waits for it."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    first_line = None
+    for line in process.stdout:
+        if line.startswith("first line"):
+            first_line = time.perf_counter() - start
+            break
+    process.stdout.read()
+    if process.wait() != 0 or first_line is None:
+        raise RuntimeError(f"{command[0]} exited with {process.returncode}")
+    return first_line
+
+
+def time_install():
+    """Installs the image requirements the way a step installs its packages."""
+    with tempfile.TemporaryDirectory() as target:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "pip", "install", "--quiet", "--no-cache-dir"]
+            + ["--target", target]
+            + requirements(),
+            check=True,
+        )
+        return time.perf_counter() - start
+
+
+def docker_command(image, install):
+    script = f'python3 -c "{IMPORTS}"'
+    if install:
+        packages = " ".join(f"'{package}'" for package in LEGACY_PACKAGES)
+        script = f"pip install --quiet --no-warn-script-location {packages} && {script}"
+    return ["docker", "run", "--rm", "--entrypoint", "sh", image, "-c", script]
+
+
+def report(name, seconds):
+    print(
+        f"{name:<28} {min(seconds):>8.2f} {statistics.median(seconds):>8.2f}"
+        f" {max(seconds):>8.2f}",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--install", action="store_true")
+    parser.add_argument("--docker", action="store_true")
+    parser.add_argument("--image", help="The image built from images/components.")
+    parser.add_argument("--legacy-image", default=LEGACY_IMAGE)
+    parser.add_argument("--cold", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'phase':<28} {'min s':>8} {'p50 s':>8} {'max s':>8}")
+    if not args.docker:
+        command = [sys.executable, "-c", IMPORTS]
+        report("import", [time_command(command) for _ in range(args.runs)])
+        if args.install:
+            report("pip install", [time_install()])
+        return
+
+    images = [("legacy + pip install", args.legacy_image, True)]
+    if args.image:
+        images.append(("component image", args.image, False))
+    for name, image, install in images:
+        seconds = []
+        for _ in range(args.runs):
+            if args.cold:
+                subprocess.run(
+                    ["docker", "image", "rm", "--force", image],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            seconds.append(time_command(docker_command(image, install)))
+        report(name, seconds)
+
+
+if __name__ == "__main__":
+    main()
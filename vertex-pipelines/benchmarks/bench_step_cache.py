@@ -0,0 +1,91 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cold versus warm runs of split_data and train_models on a local cache.
+
+    python vertex-pipelines/benchmarks/bench_step_cache.py --rows 200000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.models.multi_model import train_models  # noqa: E402
+from components.utils.custom_split import split_data  # noqa: E402
+
+ESTIMATORS = ["logistic_regression", "decision_tree", "random_forest", "xgboost"]
+
+
+def run(workdir, cache_uri):
+    outputs = Path(workdir) / f"run-{time.monotonic_ns()}"
+    train = fakes.output_artifact(outputs, "train")
+    test = fakes.output_artifact(outputs, "test")
+
+    start = time.perf_counter()
+    split_data.python_func(
+        project_id=fakes.PROJECT_ID,
+        location="local",
+        dataset=fakes.dataset_artifact(),
+        train_dataset=train,
+        test_dataset=test,
+        label_mapping=fakes.output_artifact(outputs, "label_mapping"),
+        metrics=fakes.output_artifact(outputs, "split_metrics"),
+        dataset_format="parquet",
+        cache_uri=cache_uri,
+    )
+    split_seconds = time.perf_counter() - start
+
+    model_outputs = {}
+    for name in ESTIMATORS:
+        model_outputs[f"{name}_model"] = fakes.output_artifact(outputs, f"{name}_model")
+        model_outputs[f"{name}_metrics"] = fakes.output_artifact(
+            outputs,
+            f"{name}_metrics",
+        )
+
+    start = time.perf_counter()
+    train_models.python_func(
+        train_dataset=train,
+        cache_uri=cache_uri,
+        **model_outputs,
+    )
+    train_seconds = time.perf_counter() - start
+    hit = model_outputs["xgboost_metrics"].metadata["cache_hit"]
+    return split_seconds, train_seconds, hit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    fakes.install_google_cloud(fakes.make_beans_frame(args.rows))
+
+    print(f"{'run':>4} {'cache hit':>10} {'split s':>9} {'train s':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        cache_uri = os.path.join(workdir, "step_cache")
+        for index in range(args.runs):
+            split_seconds, train_seconds, hit = run(workdir, cache_uri)
+            print(f"{index:>4} {hit!s:>10} {split_seconds:>9.2f} {train_seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rows/sec of split_data's Storage Read API path versus stream count.
+
+    python vertex-pipelines/benchmarks/bench_storage_read.py --rows 1000000
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.utils.custom_split import split_data  # noqa: E402
+
+
+def run(streams, workdir, dataset_format):
+    outputs = Path(workdir) / f"streams-{streams}"
+    train = fakes.output_artifact(outputs, "train")
+    test = fakes.output_artifact(outputs, "test")
+    label_mapping = fakes.output_artifact(outputs, "label_mapping")
+    metrics = fakes.output_artifact(outputs, "metrics")
+
+    start = time.perf_counter()
+    split_data.python_func(
+        project_id=fakes.PROJECT_ID,
+        location="local",
+        dataset=fakes.dataset_artifact(),
+        train_dataset=train,
+        test_dataset=test,
+        label_mapping=label_mapping,
+        metrics=metrics,
+        dataset_format=dataset_format,
+        ingestion_mode="storage",
+        read_streams=streams,
+    )
+    elapsed = time.perf_counter() - start
+    return train.metadata["num_rows"] + test.metadata["num_rows"], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    parser.add_argument(
+        "--page-latency-ms",
+        type=float,
+        default=20.0,
+        help="Simulated network latency per Arrow page.",
+    )
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--format", default="parquet")
+    args = parser.parse_args()
+
+    fakes.install_google_cloud(
+        fakes.make_beans_frame(args.rows),
+        batch_rows=args.batch_rows,
+        page_latency=args.page_latency_ms / 1000,
+    )
+
+    print(f"{'streams':>8} {'rows':>10} {'seconds':>9} {'rows/sec':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for streams in args.streams:
+            rows, elapsed = run(streams, workdir, args.format)
+            print(f"{streams:>8} {rows:>10} {elapsed:>9.2f} {rows / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end offline benchmark of the beans components.
+
+For every dataset size, split_data, the four trainers, custom_evaluation and
+the model load path run locally against Dry-Bean-shaped synthetic data, with
+BigQuery and Vertex replaced by the fakes. train_models, which fits the four
+in one step, runs both from scratch and warm started from a previous model,
+as it does on an incremental split. Each stage runs in a fresh
+interpreter, so its peak RSS is its own; stages hand their artifacts to the
+next one through the work directory.
+
+Wall time, peak RSS and throughput per stage go into a JSON report. With a
+baseline report, stages that got slower or bigger than the tolerance allows
+are flagged and the exit status is 1.
+
+    python vertex-pipelines/benchmarks/bench_suite.py --sizes 10k 1m \
+        --baseline baseline.json --update-baseline
+    python vertex-pipelines/benchmarks/bench_suite.py --sizes 10k 1m \
+        --output report.json --baseline baseline.json
+
+Baselines depend on the machine, so none is kept in the repository: record
+one with --update-baseline on the machine that runs the comparisons.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+TRAINERS = ["logistic_regression", "decision_tree", "random_forest", "xgboost"]
+STAGES = (
+    ["split"]
+    + TRAINERS
+    + ["train_models", "train_models_warm", "evaluation", "model_load"]
+)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def save_artifact(artifact, workdir, name):
+    with open(os.path.join(workdir, f"{name}.json"), "w") as f:
+        json.dump({"path": artifact.path, "metadata": artifact.metadata}, f)
+
+
+def load_artifact(workdir, name):
+    from benchmarks import fakes
+
+    with open(os.path.join(workdir, f"{name}.json")) as f:
+        saved = json.load(f)
+    return fakes.FakeArtifact(saved["path"], saved["metadata"])
+
+
+def run_split(workdir, rows):
+    from benchmarks import fakes
+    from components.utils.custom_split import split_data
+
+    fakes.install_google_cloud(fakes.make_beans_frame(rows))
+    outputs = {
+        name: fakes.output_artifact(workdir, name)
+        for name in ["train_dataset", "test_dataset", "label_mapping", "split_metrics"]
+    }
+
+    start = time.perf_counter()
+    split_data.python_func(
+        project_id=fakes.PROJECT_ID,
+        location="local",
+        dataset=fakes.dataset_artifact(),
+        train_dataset=outputs["train_dataset"],
+        test_dataset=outputs["test_dataset"],
+        label_mapping=outputs["label_mapping"],
+        metrics=outputs["split_metrics"],
+        dataset_format="parquet",
+    )
+    seconds = time.perf_counter() - start
+
+    for name, artifact in outputs.items():
+        save_artifact(artifact, workdir, name)
+    return seconds, rows, "rows/s"
+
+
+def run_trainer(workdir, name):
+    from benchmarks import fakes
+    from components.models.decision_tree import decision_tree
+    from components.models.logistic_regression import logistic_regression
+    from components.models.random_forest import random_forest
+    from components.models.xgboost_classifier import xgboost
+
+    trainers = {
+        "logistic_regression": logistic_regression,
+        "decision_tree": decision_tree,
+        "random_forest": random_forest,
+        "xgboost": xgboost,
+    }
+    train = load_artifact(workdir, "train_dataset")
+    model = fakes.output_artifact(workdir, f"{name}_model")
+    model.metadata["estimator"] = name
+
+    start = time.perf_counter()
+    trainers[name].python_func(
+        train_dataset=train,
+        metrics=fakes.output_artifact(workdir, f"{name}_metrics"),
+        output_model=model,
+    )
+    seconds = time.perf_counter() - start
+
+    save_artifact(model, workdir, f"{name}_model")
+    return seconds, train.metadata["num_rows"], "rows/s"
+
+
+def train_models_outputs(workdir, stage):
+    from benchmarks import fakes
+
+    outputs = {}
+    for name in TRAINERS:
+        for kind in ("model", "metrics"):
+            artifact = fakes.output_artifact(workdir, f"{stage}_{name}_{kind}")
+            outputs[f"{name}_{kind}"] = artifact
+    return outputs
+
+
+def run_train_models(workdir, warm_start):
+    import shutil
+
+    import pandas as pd
+
+    from benchmarks import fakes
+    from components.models.multi_model import train_models
+
+    train = load_artifact(workdir, "train_dataset")
+    options = {}
+    if warm_start:
+        # An incremental split: the previous model was fit on the first 80% of
+        # the rows, and the timed run continues it from the other 20%. The
+        # previous model is rebuilt for every repeat, so that each one starts
+        # from the same state.
+        frame = pd.read_parquet(train.path)
+        cut = len(frame) * 4 // 5
+        incremental = os.path.join(workdir, "train_models_warm")
+        shutil.rmtree(incremental, ignore_errors=True)
+        splits = os.path.join(incremental, "train")
+        os.makedirs(splits)
+        options["warm_start_uri"] = os.path.join(incremental, "state")
+
+        frame.iloc[:cut].to_parquet(
+            os.path.join(splits, "part-00000.parquet"),
+            index=False,
+        )
+        metadata = dict(train.metadata, delta_files=["part-00000.parquet"])
+        train_models.python_func(
+            train_dataset=fakes.FakeArtifact(splits, metadata),
+            **train_models_outputs(incremental, "previous"),
+            **options,
+        )
+        frame.iloc[cut:].to_parquet(
+            os.path.join(splits, "part-00001.parquet"),
+            index=False,
+        )
+        metadata = dict(train.metadata, delta_files=["part-00001.parquet"])
+        train = fakes.FakeArtifact(splits, metadata)
+
+    stage = "train_models_warm" if warm_start else "train_models"
+    start = time.perf_counter()
+    train_models.python_func(
+        train_dataset=train,
+        **train_models_outputs(workdir, stage),
+        **options,
+    )
+    seconds = time.perf_counter() - start
+    return seconds, train.metadata["num_rows"], "rows/s"
+
+
+def run_evaluation(workdir):
+    from benchmarks import fakes
+    from components.evaluators.custom_evaluation import custom_evaluation
+
+    test = load_artifact(workdir, "test_dataset")
+    models = {name: load_artifact(workdir, f"{name}_model") for name in TRAINERS}
+
+    start = time.perf_counter()
+    custom_evaluation.python_func(
+        test_dataset=test,
+        metrics=fakes.output_artifact(workdir, "evaluation_metrics"),
+        output_model=fakes.output_artifact(workdir, "best_model"),
+        candidate_models=list(models.values()),
+    )
+    seconds = time.perf_counter() - start
+    # Every candidate scores every test row.
+    return seconds, test.metadata["num_rows"] * len(models), "rows/s"
+
+
+def run_model_load(workdir):
+    import joblib
+
+    paths = [load_artifact(workdir, f"{name}_model").path for name in TRAINERS]
+    start = time.perf_counter()
+    for path in paths:
+        joblib.load(path)
+    seconds = time.perf_counter() - start
+    return seconds, sum(os.path.getsize(path) for path in paths), "bytes/s"
+
+
+def run_stage(stage, workdir, rows):
+    """Runs one stage in this process and prints its measurements as JSON."""
+    if stage == "split":
+        seconds, units, unit = run_split(workdir, rows)
+    elif stage in TRAINERS:
+        seconds, units, unit = run_trainer(workdir, stage)
+    elif stage in ("train_models", "train_models_warm"):
+        seconds, units, unit = run_train_models(
+            workdir,
+            warm_start=stage == "train_models_warm",
+        )
+    elif stage == "evaluation":
+        seconds, units, unit = run_evaluation(workdir)
+    else:
+        seconds, units, unit = run_model_load(workdir)
+
+    result = {
+        "wall_seconds": seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "throughput": units / seconds if seconds else 0.0,
+        "unit": unit,
+    }
+    # The components print progress, so the result is the last line.
+    print(json.dumps(result))
+
+
+def measure(stage, workdir, rows, repeats):
+    samples = []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--run-stage",
+                stage,
+                "--workdir",
+                workdir,
+                "--rows",
+                str(rows),
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        "wall_seconds": statistics.median(s["wall_seconds"] for s in samples),
+        "peak_rss_bytes": max(s["peak_rss_bytes"] for s in samples),
+        "throughput": statistics.median(s["throughput"] for s in samples),
+        "unit": samples[0]["unit"],
+        "repeats": repeats,
+    }
+
+
+def compare(report, baseline, time_tolerance, rss_tolerance):
+    """Returns the results that regressed against the baseline report."""
+    previous = {(r["size"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["size"], result["stage"]))
+        if before is None:
+            continue
+        flags = []
+        if result["wall_seconds"] > before["wall_seconds"] * (1 + time_tolerance):
+            flags.append("wall_seconds")
+        if result["peak_rss_bytes"] > before["peak_rss_bytes"] * (1 + rss_tolerance):
+            flags.append("peak_rss_bytes")
+        result["baseline_wall_seconds"] = before["wall_seconds"]
+        result["baseline_peak_rss_bytes"] = before["peak_rss_bytes"]
+        result["regressions"] = flags
+        if flags:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=SIZES)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--baseline", help="A previous report to compare against.")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Write the report to --baseline instead of comparing.",
+    )
+    parser.add_argument("--time-tolerance", type=float, default=0.15)
+    parser.add_argument("--rss-tolerance", type=float, default=0.10)
+    parser.add_argument(
+        "--workdir",
+        help="Keep the stage artifacts here instead of in a temporary directory.",
+    )
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline to write to")
+
+    if args.run_stage:
+        run_stage(args.run_stage, args.workdir, args.rows)
+        return
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": [],
+    }
+    print(
+        f"{'size':>5} {'stage':<20} {'wall s':>9} {'peak MiB':>9} "
+        f"{'throughput':>14} {'unit':<7}",
+    )
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        workspace = contextlib.nullcontext(args.workdir)
+    else:
+        workspace = tempfile.TemporaryDirectory()
+    with workspace as workdir:
+        for size in args.sizes:
+            size_dir = os.path.join(workdir, size)
+            os.makedirs(size_dir, exist_ok=True)
+            for stage in args.stages:
+                result = measure(stage, size_dir, SIZES[size], args.repeats)
+                result.update(size=size, rows=SIZES[size], stage=stage)
+                report["results"].append(result)
+                print(
+                    f"{size:>5} {stage:<20} {result['wall_seconds']:>9.2f}"
+                    f" {result['peak_rss_bytes'] / 2**20:>9.0f}"
+                    f" {result['throughput']:>14,.0f} {result['unit']:<7}",
+                )
+
+    regressions = []
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            report,
+            baseline,
+            args.time_tolerance,
+            args.rss_tolerance,
+        )
+        report["regressions"] = len(regressions)
+        for result in regressions:
+            print(
+                f"REGRESSION {result['size']} {result['stage']}: "
+                + ", ".join(result["regressions"]),
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
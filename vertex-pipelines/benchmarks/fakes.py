@@ -0,0 +1,381 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-ins for Vertex artifacts and the Google Cloud clients.
+
+Components import their cloud dependencies inside the function body, so the
+fakes are installed into ``sys.modules`` and the component's ``python_func``
+is called directly with :class:`FakeArtifact` objects.
+"""
+
+import itertools
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+BEAN_CLASSES = [
+    "DERMASON",
+    "SIRA",
+    "SEKER",
+    "HOROZ",
+    "CALI",
+    "BARBUNYA",
+    "BOMBAY",
+]
+
+BEAN_FEATURES = [
+    "Area",
+    "Perimeter",
+    "MajorAxisLength",
+    "MinorAxisLength",
+    "AspectRation",
+    "Eccentricity",
+    "ConvexArea",
+    "EquivDiameter",
+    "Extent",
+    "Solidity",
+    "roundness",
+    "Compactness",
+    "ShapeFactor1",
+    "ShapeFactor2",
+    "ShapeFactor3",
+    "ShapeFactor4",
+]
+
+# Components called through their python_func run in this process and never
+# pull their image, but components/images.py still needs one to be named.
+os.environ.setdefault("_COMPONENT_IMAGE", "local")
+
+PROJECT_ID = "local-project"
+DATASET_ID = "beans"
+TABLE_ID = "beans1"
+
+
+def make_beans_frame(num_rows, seed=0):
+    """Returns a synthetic DataFrame shaped like the Dry Bean table."""
+    rng = np.random.default_rng(seed)
+    # Skew the class frequencies the way the real dataset is skewed.
+    weights = np.array([0.26, 0.19, 0.15, 0.14, 0.12, 0.10, 0.04])
+    labels = rng.choice(len(BEAN_CLASSES), size=num_rows, p=weights)
+    centers = rng.normal(size=(len(BEAN_CLASSES), len(BEAN_FEATURES)))
+    values = centers[labels] + rng.normal(scale=0.8, size=(num_rows, 16))
+
+    frame = pd.DataFrame(np.abs(values), columns=BEAN_FEATURES)
+    frame["Area"] = (frame["Area"] * 30_000 + 20_000).astype("int64")
+    frame["ConvexArea"] = (frame["ConvexArea"] * 30_000 + 20_000).astype("int64")
+    frame["Class"] = np.array(BEAN_CLASSES, dtype=object)[labels]
+    return frame
+
+
+class FakeArtifact:
+    """Mimics the ``path``/``uri``/``metadata`` surface of a KFP artifact."""
+
+    def __init__(self, path, metadata=None):
+        self.path = str(path)
+        self.uri = self.path
+        self.metadata = dict(metadata or {})
+
+    def log_metric(self, metric, value):
+        self.metadata[metric] = value
+
+    def __repr__(self):
+        return f"FakeArtifact({self.path!r})"
+
+
+def output_artifact(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    return FakeArtifact(os.path.join(directory, name))
+
+
+def dataset_artifact():
+    """The input artifact produced by the tabular dataset create op."""
+    return FakeArtifact(
+        "",
+        {"resourceName": f"projects/{PROJECT_ID}/datasets/{TABLE_ID}"},
+    )
+
+
+class _Page:
+    def __init__(self, batch):
+        self._batch = batch
+
+    def to_arrow(self):
+        return self._batch
+
+    def to_dataframe(self):
+        return self._batch.to_pandas()
+
+
+class _ReadRowsStream:
+    def __init__(self, batches, page_latency):
+        self._batches = batches
+        self._page_latency = page_latency
+
+    def rows(self, session=None):
+        return self
+
+    @property
+    def pages(self):
+        for batch in self._batches:
+            if self._page_latency:
+                # Stands in for the network round trip of each ReadRows page.
+                time.sleep(self._page_latency)
+            yield _Page(batch)
+
+
+class FakeBigQueryReadClient:
+    """Serves a synthetic table as Arrow record batches over N streams."""
+
+    def __init__(self, frame, batch_rows=10_000, page_latency=0.0):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        self._batches = table.to_batches(max_chunksize=batch_rows)
+        self._page_latency = page_latency
+        self._streams = {}
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def create_read_session(self, parent, read_session, max_stream_count=1):
+        count = max(1, min(max_stream_count, len(self._batches)))
+        self._streams = {
+            f"{read_session.table}/streams/{i}": self._batches[i::count]
+            for i in range(count)
+        }
+        streams = [types.SimpleNamespace(name=name) for name in self._streams]
+        return types.SimpleNamespace(streams=streams, table=read_session.table)
+
+    def read_rows(self, name, offset=0):
+        return _ReadRowsStream(self._streams[name], self._page_latency)
+
+
+class FakeBigQueryClient:
+    """Serves a synthetic table through ``list_rows`` pagination."""
+
+    def __init__(self, frame, page_rows=10_000):
+        self._frame = frame
+        self._page_rows = page_rows
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def list_rows(self, table, **kwargs):
+        return self._rows(self._frame)
+
+    def _rows(self, frame):
+        page_rows = self._page_rows
+
+        def pages():
+            for start in range(0, len(frame), page_rows):
+                yield frame.iloc[start : start + page_rows].reset_index(drop=True)
+
+        return types.SimpleNamespace(
+            to_dataframe_iterable=pages,
+            to_dataframe=lambda: frame.copy(),
+        )
+
+    def get_table(self, table):
+        kinds = {"i": "INTEGER", "u": "INTEGER", "f": "FLOAT"}
+        schema = [
+            types.SimpleNamespace(name=name, field_type=kinds.get(dtype.kind, "STRING"))
+            for name, dtype in self._frame.dtypes.items()
+        ]
+        return types.SimpleNamespace(
+            schema=schema,
+            num_rows=len(self._frame),
+            num_bytes=int(self._frame.memory_usage(index=False).sum()),
+            modified=None,
+        )
+
+    def query(self, query, job_config=None, **kwargs):
+        if query.startswith("SELECT * "):
+            # split_data's incremental read: the rows past the high-water
+            # mark of its WHERE clause, or all of them on the first run.
+            frame = self._frame
+            if job_config is not None:
+                column = query.partition("WHERE `")[2].partition("`")[0]
+                (mark,) = job_config.query_parameters
+                value = pd.Series([mark.value]).astype(frame[column].dtype).iloc[0]
+                frame = frame[frame[column] > value].reset_index(drop=True)
+            rows = self._rows(frame)
+            return types.SimpleNamespace(result=lambda: rows)
+
+        # Otherwise split_data's profiling aggregate: the class counts plus
+        # MIN/MAX of every integer column.
+        counts = self._frame["Class"].value_counts()
+        profile = {
+            "classes": [
+                {"label": label, "count": int(count)} for label, count in counts.items()
+            ],
+        }
+        for name, values in self._frame.select_dtypes("integer").items():
+            profile[f"min_{name}"] = values.min()
+            profile[f"max_{name}"] = values.max()
+        return types.SimpleNamespace(result=lambda: [profile])
+
+
+class _TabularDataset:
+    def __init__(self, dataset_name):
+        self.dataset_name = dataset_name
+
+    def to_dict(self):
+        uri = f"bq://{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
+        return {"metadata": {"inputConfig": {"bigquerySource": {"uri": uri}}}}
+
+
+class FakeEndpoint:
+    """An endpoint that enforces Vertex's traffic split rules in memory."""
+
+    endpoints = []
+
+    def __init__(self, display_name):
+        self.display_name = display_name
+        self.resource_name = (
+            f"projects/{PROJECT_ID}/locations/local/endpoints/"
+            f"{len(FakeEndpoint.endpoints)}"
+        )
+        self.deployed_models = {}
+        self.traffic_split = {}
+        self.history = []
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def create(cls, display_name, **kwargs):
+        endpoint = cls(display_name)
+        cls.endpoints.append(endpoint)
+        return endpoint
+
+    @classmethod
+    def list(cls, filter="", order_by="", **kwargs):
+        name = filter.partition('display_name="')[2].rstrip('"')
+        matches = [e for e in cls.endpoints if not name or e.display_name == name]
+        return matches[::-1] if order_by.endswith("desc") else matches
+
+    def list_models(self):
+        return list(self.deployed_models.values())
+
+    def _set_traffic(self, traffic_split):
+        unknown = set(traffic_split) - set(self.deployed_models)
+        if unknown or sum(traffic_split.values()) != 100:
+            raise ValueError(f"Invalid traffic split {traffic_split}")
+        self.traffic_split = dict(traffic_split)
+        self.history.append(dict(traffic_split))
+
+    def _deploy(self, display_name, traffic_split, **kwargs):
+        deployed_id = str(next(self._ids))
+        self.deployed_models[deployed_id] = types.SimpleNamespace(
+            id=deployed_id,
+            display_name=display_name,
+            **kwargs,
+        )
+        split = {k: v for k, v in traffic_split.items() if k != "0"}
+        split[deployed_id] = traffic_split.get("0", 0)
+        self._set_traffic(split)
+
+    def update(self, traffic_split=None, **kwargs):
+        if traffic_split is not None:
+            self._set_traffic(traffic_split)
+        return self
+
+    def undeploy(self, deployed_model_id, **kwargs):
+        if self.traffic_split.get(deployed_model_id):
+            raise ValueError(f"{deployed_model_id} still receives traffic")
+        del self.deployed_models[deployed_model_id]
+        self.traffic_split.pop(deployed_model_id, None)
+
+
+class FakeModel:
+    def __init__(self, path, display_name):
+        self.path = path
+        self.display_name = display_name
+
+    @classmethod
+    def upload_scikit_learn_model_file(cls, model_file_path, display_name, **kwargs):
+        return cls(model_file_path, display_name)
+
+    def deploy(
+        self,
+        endpoint,
+        deployed_model_display_name,
+        traffic_split=None,
+        **kwargs,
+    ):
+        endpoint._deploy(
+            deployed_model_display_name,
+            traffic_split or {"0": 100},
+            **kwargs,
+        )
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install_google_cloud(frame, batch_rows=10_000, page_latency=0.0):
+    """Replaces aiplatform, bigquery and bigquery_storage with local fakes."""
+    try:
+        import google.cloud as google_cloud
+    except ImportError:
+        google_cloud = _module("google.cloud")
+        sys.modules["google"] = _module("google", cloud=google_cloud)
+        sys.modules["google.cloud"] = google_cloud
+
+    aiplatform = _module(
+        "google.cloud.aiplatform",
+        init=lambda **kwargs: None,
+        TabularDataset=_TabularDataset,
+        Endpoint=FakeEndpoint,
+        Model=FakeModel,
+    )
+    bigquery = _module(
+        "google.cloud.bigquery",
+        Client=FakeBigQueryClient(frame, page_rows=batch_rows),
+        DatasetReference=lambda project, dataset: types.SimpleNamespace(
+            table=lambda table: f"{project}.{dataset}.{table}",
+        ),
+        Table=lambda ref: ref,
+        QueryJobConfig=lambda query_parameters=(): types.SimpleNamespace(
+            query_parameters=query_parameters,
+        ),
+        ScalarQueryParameter=lambda name, type_, value: types.SimpleNamespace(
+            name=name,
+            type_=type_,
+            value=value,
+        ),
+    )
+    bigquery_storage = _module(
+        "google.cloud.bigquery_storage",
+        BigQueryReadClient=FakeBigQueryReadClient(
+            frame,
+            batch_rows=batch_rows,
+            page_latency=page_latency,
+        ),
+        types=types.SimpleNamespace(
+            ReadSession=types.SimpleNamespace,
+            DataFormat=types.SimpleNamespace(ARROW="ARROW"),
+        ),
+    )
+    for name, module in [
+        ("aiplatform", aiplatform),
+        ("bigquery", bigquery),
+        ("bigquery_storage", bigquery_storage),
+    ]:
+        sys.modules[f"google.cloud.{name}"] = module
+        setattr(google_cloud, name, module)
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import List
+
 from kfp.dsl import component
 from kfp.dsl import Dataset
 from kfp.dsl import Input
@@ -19,51 +21,270 @@ from kfp.dsl import Metrics
 from kfp.dsl import Model
 from kfp.dsl import Output
 
+from components.images import BASE_IMAGE
+
 
 @component(
-    base_image="gcr.io/deeplearning-platform-release/tf2-cpu.2-6:latest",
-    packages_to_install=[
-        "xgboost==1.6.2",
-        "pandas==1.3.5",
-        "joblib==1.1.0",
-    ],
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
 )
 def custom_evaluation(
     test_dataset: Input[Dataset],
-    logistic_trained_model: Input[Model],
-    xgboost_trained_model: Input[Model],
-    random_forest_trained_model: Input[Model],
-    decision_tree_trained_model: Input[Model],
+    candidate_models: Input[List[Model]],
     metrics: Output[Metrics],
     output_model: Output[Model],
+    prediction_cache_uri: str = "",
+    n_jobs: int = 0,
+    evaluation_mode: str = "batch",
+    chunk_size: int = 100_000,
+    auc_bins: int = 1000,
+    profile: bool = False,
+    trace_uri: str = "",
 ):
+    import hashlib
+    import json
+    import os
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
 
     import joblib
+    import numpy as np
     import pandas as pd
+    import pyarrow.dataset as ds
     from sklearn.metrics import roc_auc_score
 
-    test = pd.read_csv(test_dataset.path)
+    from components.runtime import StepProfiler, read_dataset
 
-    models = {
-        "logistic_regression": logistic_trained_model.path,
-        "xgboost": xgboost_trained_model.path,
-        "random_forest": random_forest_trained_model.path,
-        "decision_tree": decision_tree_trained_model.path,
-    }
+    def artifact_key(artifact):
+        # The URI, size and mtime of the artifact's files: cheap to compute
+        # and enough, since artifacts are written once under their own URI.
+        paths = [artifact.path]
+        if os.path.isdir(artifact.path):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(artifact.path)
+                for name in names
+            )
+        stats = [os.stat(path) for path in paths]
+        payload = json.dumps(
+            [artifact.uri, [(stat.st_size, stat.st_mtime_ns) for stat in stats]],
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
 
-    best_model_name, best_auc_roc = "", 0.0
-    for model_name, model_path in models.items():
-        model = joblib.load(model_path)
-        y_pred = model.predict_proba(test.drop("Class", axis=1))
-        auc_roc = roc_auc_score(test["Class"], y_pred, multi_class="ovr")
+    profiler = StepProfiler("custom_evaluation", profile, trace_uri)
+
+    # Candidates are named after the estimator train_models records in their
+    # metadata, so any number of them can be compared.
+    models = {}
+    for i, artifact in enumerate(candidate_models):
+        name = artifact.metadata.get("estimator") or f"model_{i}"
+        models[name if name not in models else f"{name}_{i}"] = artifact
+    if not models:
+        raise ValueError("custom_evaluation needs at least one candidate model")
+    if evaluation_mode not in ("batch", "streaming"):
+        raise ValueError(f"Unsupported evaluation mode: {evaluation_mode}")
+
+    def evaluate_batch():
+        # The feature matrix is built once and shared by every candidate.
+        with profiler.phase("load"):
+            test = read_dataset(test_dataset)
+        with profiler.phase("preprocess"):
+            feature_names = list(test.columns.drop("Class"))
+            features = pd.DataFrame(
+                np.ascontiguousarray(test[feature_names].to_numpy(dtype=np.float32)),
+                columns=feature_names,
+                copy=False,
+            )
+            labels = test["Class"].to_numpy()
+            del test
+
+            data_key = artifact_key(test_dataset)
+
+        cache_dir = prediction_cache_uri.replace("gs://", "/gcs/", 1)
+
+        def predict_proba(model):
+            # Predictions are cached by (model, dataset) key, so an unchanged
+            # model is not re-scored on an unchanged test set.
+            if not cache_dir:
+                return joblib.load(model.path).predict_proba(features), False
+            cache_path = os.path.join(
+                cache_dir,
+                artifact_key(model),
+                f"{data_key}.npy",
+            )
+            if os.path.exists(cache_path):
+                return np.load(cache_path), True
+
+            y_pred = joblib.load(model.path).predict_proba(features)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(cache_path),
+                suffix=".npy",
+                delete=False,
+            ) as f:
+                np.save(f, y_pred)
+            os.replace(f.name, cache_path)
+            return y_pred, False
+
+        def score(item):
+            model_name, model = item
+            y_pred, cached = predict_proba(model)
+            auc_roc = roc_auc_score(labels, y_pred, multi_class="ovr")
+            return model_name, auc_roc, {"cached": cached}
+
+        with profiler.phase("predict"):
+            with ThreadPoolExecutor(max_workers=n_jobs or len(models)) as pool:
+                return list(pool.map(score, models.items()))
+
+    def iter_chunks(artifact):
+        dataset_format = artifact.metadata.get("format", "csv")
+        if dataset_format == "csv":
+            yield from pd.read_csv(artifact.path, chunksize=chunk_size)
+            return
+        dataset = ds.dataset(
+            artifact.path,
+            format="parquet" if dataset_format == "parquet" else "ipc",
+        )
+        for batch in dataset.to_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+    class StreamingMetrics:
+        """Accuracy, confusion counts and one-vs-rest score histograms."""
 
+        def __init__(self, n_classes):
+            self.n_classes = n_classes
+            self.correct = 0
+            self.total = 0
+            self.confusion = np.zeros((n_classes, n_classes), dtype=np.int64)
+            self.positives = np.zeros((n_classes, auc_bins), dtype=np.int64)
+            self.negatives = np.zeros((n_classes, auc_bins), dtype=np.int64)
+
+        def update(self, y_true, y_score, classes):
+            y_pred = classes[y_score.argmax(axis=1)]
+            self.correct += int((y_pred == y_true).sum())
+            self.total += len(y_true)
+            self.confusion += np.bincount(
+                y_true * self.n_classes + y_pred,
+                minlength=self.n_classes**2,
+            ).reshape(self.n_classes, self.n_classes)
+
+            bins = np.clip((y_score * auc_bins).astype(np.int64), 0, auc_bins - 1)
+            for column, label in enumerate(classes):
+                is_positive = y_true == label
+                self.positives[label] += np.bincount(
+                    bins[is_positive, column],
+                    minlength=auc_bins,
+                )
+                self.negatives[label] += np.bincount(
+                    bins[~is_positive, column],
+                    minlength=auc_bins,
+                )
+
+        def auc_roc(self):
+            # Macro one-vs-rest AUC from the score histograms: a negative in
+            # bin b is ranked below every positive in a higher bin and ties
+            # with half of the positives in its own bin.
+            aucs = []
+            for positives, negatives in zip(self.positives, self.negatives):
+                n_pos, n_neg = positives.sum(), negatives.sum()
+                if n_pos == 0 or n_neg == 0:
+                    continue
+                above = np.cumsum(positives[::-1])[::-1] - positives
+                wins = ((above + 0.5 * positives) * negatives).sum()
+                aucs.append(wins / n_pos / n_neg)
+            return float(np.mean(aucs))
+
+        def accuracy(self):
+            return self.correct / max(self.total, 1)
+
+    def evaluate_streaming():
+        # The test set is scored chunk by chunk through a generator, so
+        # memory stays flat no matter how many rows it has.
+        with profiler.phase("load"):
+            loaded = {name: joblib.load(model.path) for name, model in models.items()}
+        n_classes = max(
+            len(test_dataset.metadata.get("classes", [])),
+            *(int(np.max(model.classes_)) + 1 for model in loaded.values()),
+        )
+        accumulators = {name: StreamingMetrics(n_classes) for name in loaded}
+
+        def update(item, features, labels):
+            name, model = item
+            accumulators[name].update(
+                labels,
+                model.predict_proba(features),
+                np.asarray(model.classes_, dtype=np.int64),
+            )
+
+        def read_next(chunks):
+            chunk = next(chunks, None)
+            if chunk is None:
+                return None
+            feature_names = list(chunk.columns.drop("Class"))
+            features = pd.DataFrame(
+                np.ascontiguousarray(chunk[feature_names].to_numpy(dtype=np.float32)),
+                columns=feature_names,
+                copy=False,
+            )
+            return features, chunk["Class"].to_numpy(dtype=np.int64)
+
+        # The next chunk is read on a thread of its own while the models score
+        # the current one, so reading and scoring both count as predict.
+        with profiler.phase("predict"):
+            chunks = iter_chunks(test_dataset)
+            workers = n_jobs or len(loaded)
+            with ThreadPoolExecutor(max_workers=1) as reader:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    pending = reader.submit(read_next, chunks)
+                    while True:
+                        prepared = pending.result()
+                        if prepared is None:
+                            break
+                        pending = reader.submit(read_next, chunks)
+                        features, labels = prepared
+                        list(
+                            pool.map(
+                                lambda item: update(item, features, labels),
+                                loaded.items(),
+                            ),
+                        )
+
+        return [
+            (
+                name,
+                accumulator.auc_roc(),
+                {
+                    "accuracy": accumulator.accuracy(),
+                    "confusion": json.dumps(accumulator.confusion.tolist()),
+                },
+            )
+            for name, accumulator in accumulators.items()
+        ]
+
+    if evaluation_mode == "streaming":
+        results = evaluate_streaming()
+    else:
+        results = evaluate_batch()
+
+    best_model_name, best_auc_roc = "", 0.0
+    for model_name, auc_roc, extras in results:
         metrics.log_metric(f"{model_name} (AUC ROC)", (auc_roc))
+        for key in ("accuracy", "confusion"):
+            if key in extras:
+                metrics.log_metric(f"{model_name} ({key})", extras[key])
 
         if auc_roc > best_auc_roc:
             best_auc_roc = auc_roc
             best_model_name = model_name
 
-    output_model.path = models[best_model_name]
+    output_model.path = models[best_model_name].path
 
     metrics.log_metric("best_model_name", (best_model_name))
     metrics.log_metric("best_auc_roc", (best_auc_roc))
+    metrics.log_metric("evaluation_mode", evaluation_mode)
+    metrics.log_metric(
+        "cached_predictions",
+        sum(bool(extras.get("cached")) for _, _, extras in results),
+    )
+
+    profiler.close(metrics)
@@ -0,0 +1,66 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Container image the components run on.
+
+Every component runs on the image built from images/components/Dockerfile,
+which holds the pinned dependencies and components/runtime.py, the helpers
+the components import. The tag is a digest of those files, so a compiled
+pipeline names an image with exactly the helpers it was compiled against;
+cloud-build/vertex-pipeline.yaml builds the tag when it does not exist yet.
+The repository comes from _COMPONENT_IMAGE_REPO; _COMPONENT_IMAGE, when set,
+names the image to use instead. With neither set, importing a component fails.
+
+    python vertex-pipelines/components/images.py   # prints the image
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# Keep in sync with the tag computed in cloud-build/vertex-pipeline.yaml.
+IMAGE_INPUTS = [
+    ROOT / "images" / "components" / "Dockerfile",
+    ROOT / "images" / "components" / "requirements.txt",
+    ROOT / "components" / "runtime.py",
+]
+COMPONENT_IMAGE_REPO = os.getenv("_COMPONENT_IMAGE_REPO")
+
+
+def image_tag():
+    digest = hashlib.sha256()
+    for path in IMAGE_INPUTS:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def base_image():
+    image = os.getenv("_COMPONENT_IMAGE")
+    if image:
+        return image
+    if not COMPONENT_IMAGE_REPO:
+        # A bare name would compile, then fail every step on an image pull.
+        raise RuntimeError(
+            "Set _COMPONENT_IMAGE_REPO to the component image repository, "
+            "or _COMPONENT_IMAGE to the image itself",
+        )
+    return f"{COMPONENT_IMAGE_REPO}:{image_tag()}"
+
+
+BASE_IMAGE = base_image()
+
+
+if __name__ == "__main__":
+    print(BASE_IMAGE)
@@ -0,0 +1,261 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from kfp.dsl import component
+from kfp.dsl import Dataset
+from kfp.dsl import Input
+from kfp.dsl import Metrics
+from kfp.dsl import Model
+from kfp.dsl import Output
+
+from components.images import BASE_IMAGE
+
+
+@component(
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
+)
+def hyperparameter_search(
+    train_dataset: Input[Dataset],
+    metrics: Output[Metrics],
+    output_model: Output[Model],
+    trials: Output[Dataset],
+    estimators: list = [
+        "logistic_regression",
+        "decision_tree",
+        "random_forest",
+        "xgboost",
+    ],
+    search_space: dict = {},
+    n_candidates: int = 27,
+    eta: int = 3,
+    min_resource: float = 0.1,
+    early_stopping_rounds: int = 10,
+    seed: int = 42,
+    n_jobs: int = 0,
+    profile: bool = False,
+    trace_uri: str = "",
+):
+    import json
+    import math
+
+    import joblib
+    import numpy as np
+    import pandas as pd
+    from sklearn.metrics import roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from threadpoolctl import threadpool_limits
+
+    from components.runtime import (
+        StepProfiler,
+        available_cpus,
+        build_estimator,
+        read_dataset,
+    )
+
+    # min_resource is the fraction of the rows the first rung fits on, and the
+    # number of rungs is log_eta(1 / min_resource) + 1.
+    if not 0 < min_resource <= 1:
+        raise ValueError(f"min_resource must be in (0, 1], got {min_resource}")
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2, got {eta}")
+
+    profiler = StepProfiler("hyperparameter_search", profile, trace_uri)
+
+    # Each hyperparameter is either a list of choices or a
+    # {"low": ..., "high": ..., "log": bool, "int": bool} range.
+    default_space = {
+        "logistic_regression": {
+            "C": {"low": 1e-3, "high": 1e2, "log": True},
+            "max_iter": [200, 500],
+        },
+        "decision_tree": {
+            "max_depth": [4, 8, 12, 16, None],
+            "min_samples_leaf": {"low": 1, "high": 50, "log": True, "int": True},
+            "criterion": ["gini", "entropy"],
+        },
+        "random_forest": {
+            "n_estimators": [100, 200, 400],
+            "max_depth": [8, 16, None],
+            "min_samples_leaf": {"low": 1, "high": 20, "log": True, "int": True},
+            "max_features": ["sqrt", "log2", 0.5],
+        },
+        "xgboost": {
+            "n_estimators": [200, 400, 800],
+            "max_depth": [3, 4, 6, 8],
+            "learning_rate": {"low": 0.01, "high": 0.3, "log": True},
+            "subsample": {"low": 0.6, "high": 1.0},
+            "colsample_bytree": {"low": 0.6, "high": 1.0},
+        },
+    }
+    space = {name: search_space.get(name, default_space[name]) for name in estimators}
+
+    rng = np.random.RandomState(seed)
+
+    def sample(spec):
+        if isinstance(spec, list):
+            return spec[rng.randint(len(spec))]
+        low, high = spec["low"], spec["high"]
+        if spec.get("log"):
+            value = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            value = rng.uniform(low, high)
+        return int(round(value)) if spec.get("int") else float(value)
+
+    candidates = [
+        (name, {key: sample(spec) for key, spec in space[name].items()})
+        for name in (estimators[i % len(estimators)] for i in range(n_candidates))
+    ]
+
+    def build_candidate(name, params, threads, num_rows):
+        # The trainers' estimator with the sampled hyperparameters on top;
+        # xgboost always grows hist trees here, as the search fits them often.
+        model = build_estimator(name, threads, num_rows, hist_min_rows=0)
+        if name != "logistic_regression":
+            model.set_params(random_state=seed)
+        if name == "xgboost":
+            # Trees stop being added once the holdout loss stops improving.
+            model.set_params(early_stopping_rounds=early_stopping_rounds)
+        return model.set_params(**params)
+
+    with profiler.phase("load"):
+        train = read_dataset(train_dataset)
+        feature_names = list(train.columns.drop("Class"))
+
+    with profiler.phase("preprocess"):
+        X_train, X_test, y_train, y_test = train_test_split(
+            np.ascontiguousarray(train[feature_names].to_numpy(dtype=np.float32)),
+            train["Class"].to_numpy(),
+            test_size=0.2,
+            random_state=42,
+            stratify=train["Class"],
+        )
+        del train
+
+        # Spread every class evenly over one fixed ordering of the rows, so any
+        # prefix is a stratified subsample and a bigger budget only adds rows.
+        order_rng = np.random.RandomState(seed)
+        keys = np.empty(len(y_train))
+        for label in np.unique(y_train):
+            rows = np.flatnonzero(y_train == label)
+            keys[rows] = (
+                order_rng.permutation(len(rows)) + order_rng.uniform(size=len(rows))
+            ) / len(rows)
+        order = np.argsort(keys, kind="stable")
+        X_train, y_train = X_train[order], y_train[order]
+
+    def fit_and_score(
+        trial_id,
+        candidate,
+        threads,
+        num_rows,
+        keep,
+        X,
+        y,
+        X_hold,
+        y_hold,
+    ):
+        name, params = candidate
+        X = pd.DataFrame(X[:num_rows], columns=feature_names, copy=False)
+        X_hold = pd.DataFrame(X_hold, columns=feature_names, copy=False)
+        model = build_candidate(name, params, threads, num_rows)
+
+        fit_params = {}
+        if name == "xgboost":
+            fit_params = {"eval_set": [(X_hold, y_hold)], "verbose": False}
+        with threadpool_limits(limits=threads):
+            model.fit(X, y[:num_rows], **fit_params)
+
+        aucRoc = roc_auc_score(
+            y_hold,
+            model.predict_proba(X_hold),
+            multi_class="ovr",
+        )
+        best_iteration = getattr(model, "best_iteration", None)
+        # Only the last rung ships its models back to the parent process.
+        return trial_id, aucRoc, best_iteration, model if keep else None
+
+    # Successive halving: every candidate starts on min_resource of the
+    # rows; after each rung only the best 1/eta go on with eta times more.
+    cpus = n_jobs or available_cpus()
+    rungs = max(1, int(math.floor(math.log(1 / min_resource, eta))) + 1)
+    alive = list(range(len(candidates)))
+    records = []
+    best = None
+
+    parallel = joblib.Parallel(
+        n_jobs=min(cpus, len(alive)),
+        backend="loky",
+        max_nbytes="1M",
+        mmap_mode="r",
+    )
+    # The fits run in the loky workers, so the phase's CPU seconds and I/O
+    # only cover this process's share of the work.
+    with profiler.phase("fit"):
+        for rung in range(rungs):
+            # The surviving candidates of the last rung always see every row.
+            final = rung == rungs - 1 or len(alive) == 1
+            fraction = 1.0 if final else min(1.0, min_resource * eta**rung)
+            num_rows = max(1, int(len(X_train) * fraction))
+            threads = max(1, cpus // min(cpus, len(alive)))
+            results = parallel(
+                joblib.delayed(fit_and_score)(
+                    trial_id,
+                    candidates[trial_id],
+                    threads,
+                    num_rows,
+                    final,
+                    X_train,
+                    y_train,
+                    X_test,
+                    y_test,
+                )
+                for trial_id in alive
+            )
+            results.sort(key=lambda result: result[1], reverse=True)
+
+            for trial_id, aucRoc, best_iteration, model in results:
+                name, params = candidates[trial_id]
+                records.append(
+                    {
+                        "trial_id": trial_id,
+                        "rung": rung,
+                        "estimator": name,
+                        "params": json.dumps(params, sort_keys=True),
+                        "num_rows": num_rows,
+                        "aucRoc": aucRoc,
+                        "best_iteration": best_iteration,
+                    },
+                )
+            if final:
+                best = results[0]
+                break
+            alive = [result[0] for result in results[: max(1, len(results) // eta)]]
+
+    trial_id, best_auc_roc, _, best_model = best
+    best_name, best_params = candidates[trial_id]
+
+    with profiler.phase("dump"):
+        pd.DataFrame.from_records(records).to_csv(trials.path, index=False)
+        trials.metadata["format"] = "csv"
+        joblib.dump(best_model, output_model.path)
+    output_model.metadata["estimator"] = best_name
+    output_model.metadata["params"] = best_params
+
+    metrics.log_metric("trials", len(records))
+    metrics.log_metric("best_estimator", best_name)
+    metrics.log_metric("best_params", json.dumps(best_params, sort_keys=True))
+    metrics.log_metric("aucRoc", (best_auc_roc))
+
+    profiler.close(metrics)
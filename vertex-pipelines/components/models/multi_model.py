@@ -0,0 +1,347 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import NamedTuple
+
+from kfp.dsl import component
+from kfp.dsl import Dataset
+from kfp.dsl import Input
+from kfp.dsl import Metrics
+from kfp.dsl import Model
+from kfp.dsl import Output
+
+from components.images import BASE_IMAGE
+
+
+@component(
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
+)
+def train_models(
+    train_dataset: Input[Dataset],
+    logistic_regression_metrics: Output[Metrics],
+    logistic_regression_model: Output[Model],
+    decision_tree_metrics: Output[Metrics],
+    decision_tree_model: Output[Model],
+    random_forest_metrics: Output[Metrics],
+    random_forest_model: Output[Model],
+    xgboost_metrics: Output[Metrics],
+    xgboost_model: Output[Model],
+    estimators: list = [
+        "logistic_regression",
+        "decision_tree",
+        "random_forest",
+        "xgboost",
+    ],
+    n_jobs: int = 0,
+    hist_min_rows: int = 100_000,
+    cache_uri: str = "",
+    cache_max_gb: float = 50.0,
+    cache_max_age_days: int = 30,
+    warm_start_uri: str = "",
+    warm_start_trees: int = 50,
+    warm_start_max_trees: int = 500,
+    profile: bool = False,
+    trace_uri: str = "",
+) -> NamedTuple("Outputs", [("candidates", list)]):
+    import hashlib
+    import json
+    import os
+    import shutil
+    import time
+    from collections import namedtuple
+
+    import joblib
+    import numpy as np
+    import pandas as pd
+    import pyarrow.dataset as ds
+    from sklearn.metrics import accuracy_score, roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from threadpoolctl import threadpool_limits
+
+    from components.runtime import (
+        StepCache,
+        StepProfiler,
+        available_cpus,
+        build_estimator,
+        cache_key,
+        read_dataset,
+    )
+
+    outputs = {
+        "logistic_regression": (logistic_regression_model, logistic_regression_metrics),
+        "decision_tree": (decision_tree_model, decision_tree_metrics),
+        "random_forest": (random_forest_model, random_forest_metrics),
+        "xgboost": (xgboost_model, xgboost_metrics),
+    }
+    unknown = sorted(set(estimators) - set(outputs))
+    if unknown:
+        raise ValueError(f"Unsupported estimators: {unknown}")
+
+    # Previous models and their metrics are kept at warm_start_uri. When
+    # split_data ran in incremental mode, the ensembles continue training
+    # from the delta rows only; the decision tree and the logistic
+    # regression, which cannot, are refit on all the rows.
+    warm_dir = warm_start_uri.replace("gs://", "/gcs/", 1)
+    delta_files = train_dataset.metadata.get("delta_files")
+    profiler = StepProfiler("train_models", profile, trace_uri)
+
+    def candidates():
+        # KFP cannot gather the named outputs of one task into a list, so the
+        # pipeline imports these URIs back as the models custom_evaluation
+        # compares. Built on return, once the step cache has set their paths.
+        return namedtuple("Outputs", ["candidates"])(
+            [{"estimator": name, "uri": outputs[name][0].uri} for name in estimators],
+        )
+
+    saved = {
+        name: (
+            os.path.join(warm_dir, f"{name}.joblib"),
+            os.path.join(warm_dir, f"{name}.json"),
+        )
+        for name in estimators
+    }
+    if (
+        warm_dir
+        and delta_files == []
+        and all(
+            os.path.exists(model_path) and os.path.exists(metrics_path)
+            for model_path, metrics_path in saved.values()
+        )
+    ):
+        # No new rows: the previous models are still current.
+        for name, (model_path, metrics_path) in saved.items():
+            model, metrics = outputs[name]
+            shutil.copyfile(model_path, model.path)
+            model.metadata["estimator"] = name
+            model.metadata["warm_start"] = True
+            with open(metrics_path) as f:
+                for metric, value in json.load(f).items():
+                    metrics.log_metric(metric, value)
+            metrics.log_metric("reused", True)
+        print(f"No new rows: reusing the models in {warm_dir}")
+        profiler.close(*(metrics for _, metrics in outputs.values()))
+        return candidates()
+
+    previous = {}
+    if warm_dir and delta_files is not None:
+        for name in estimators:
+            model_path, _ = saved[name]
+            if name in ("random_forest", "xgboost") and os.path.exists(model_path):
+                previous[name] = model_path
+    if "xgboost" in previous:
+        # Boosted trees correct the ones before them, so the oldest cannot be
+        # dropped as in the forest: past warm_start_max_trees, XGBoost is
+        # refit from scratch instead.
+        booster = joblib.load(previous["xgboost"]).get_booster()
+        if booster.num_boosted_rounds() + warm_start_trees > warm_start_max_trees:
+            del previous["xgboost"]
+
+    cache = None
+    cached_models = {f"{name}_model": outputs[name][0] for name in estimators}
+    cached_metrics = {f"{name}_metrics": outputs[name][1] for name in estimators}
+    if cache_uri and delta_files is None:
+        fingerprint = train_dataset.metadata.get("fingerprint")
+        if fingerprint is None:
+            digest = hashlib.sha256()
+            paths = [train_dataset.path]
+            if os.path.isdir(train_dataset.path):
+                paths = sorted(
+                    os.path.join(train_dataset.path, name)
+                    for name in os.listdir(train_dataset.path)
+                )
+            for path in paths:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+            fingerprint = digest.hexdigest()
+        cache = StepCache(
+            os.path.join(cache_uri, "train_models"),
+            cache_key(
+                data=fingerprint,
+                params={"estimators": estimators, "hist_min_rows": hist_min_rows},
+                source=__file__,
+            ),
+            max_gb=cache_max_gb,
+            max_age_days=cache_max_age_days,
+        )
+        with profiler.phase("cache_lookup"):
+            hit = cache.lookup(cached_models, cached_metrics)
+        if hit:
+            for metrics in cached_metrics.values():
+                metrics.log_metric("cache_hit", True)
+            print(f"Reusing cached models from {cache.entry}")
+            profiler.close(*cached_metrics.values())
+            return candidates()
+        cache.stage(cached_models)
+
+    def load_split(train):
+        # Load and split once; the workers share these arrays read-only
+        # through joblib's memory mapping instead of each receiving a copy.
+        return train_test_split(
+            np.ascontiguousarray(train[feature_names].to_numpy(dtype=np.float32)),
+            train["Class"].to_numpy(),
+            test_size=0.2,
+            random_state=42,
+        )
+
+    splits = {}
+    if previous and delta_files:
+        with profiler.phase("load"):
+            paths = [os.path.join(train_dataset.path, name) for name in delta_files]
+            delta = ds.dataset(paths, format="parquet").to_table().to_pandas()
+        with profiler.phase("preprocess"):
+            feature_names = list(delta.columns.drop("Class"))
+            splits["delta"] = load_split(delta)
+        # Warm starting on a delta that misses a class would change the
+        # estimators' classes_ (and leave the AUC undefined), so such small
+        # deltas fall back to a full refit.
+        n_classes = len(train_dataset.metadata["classes"])
+        _, _, y_delta_train, y_delta_test = splits["delta"]
+        if min(np.unique(y).size for y in (y_delta_train, y_delta_test)) < n_classes:
+            previous = {}
+        del delta
+    else:
+        previous = {}
+    if set(estimators) - set(previous):
+        with profiler.phase("load"):
+            train = read_dataset(train_dataset)
+        with profiler.phase("preprocess"):
+            feature_names = list(train.columns.drop("Class"))
+            splits["full"] = load_split(train)
+        del train
+
+    def warm_start(model, name, threads):
+        # Continues from the previous model; returns the extra fit arguments.
+        if name == "random_forest":
+            # The oldest trees make room for the new ones, so the forest
+            # holds warm_start_max_trees at most.
+            keep = max(0, warm_start_max_trees - warm_start_trees)
+            model.estimators_ = model.estimators_[-keep:] if keep else []
+            model.set_params(
+                warm_start=True,
+                n_jobs=threads,
+                n_estimators=len(model.estimators_) + warm_start_trees,
+            )
+            return {}
+        booster = model.get_booster()
+        model.set_params(n_jobs=threads, n_estimators=warm_start_trees)
+        return {"xgb_model": booster}
+
+    def fit_and_score(
+        name,
+        threads,
+        model_path,
+        previous_path,
+        X_train,
+        X_test,
+        y_train,
+        y_test,
+    ):
+        X_train = pd.DataFrame(X_train, columns=feature_names, copy=False)
+        X_test = pd.DataFrame(X_test, columns=feature_names, copy=False)
+
+        # Runs in a loky worker: its phases go back to the parent with the
+        # results instead of being logged here.
+        worker = StepProfiler(f"train_models.{name}", profile)
+        if previous_path is None:
+            model = build_estimator(name, threads, len(X_train), hist_min_rows)
+            fit_params = {}
+        else:
+            with worker.phase("load"):
+                model = joblib.load(previous_path)
+            fit_params = warm_start(model, name, threads)
+        start = time.perf_counter()
+        with worker.phase("fit"), threadpool_limits(limits=threads):
+            model.fit(X_train, y_train, **fit_params)
+        fit_seconds = time.perf_counter() - start
+
+        with worker.phase("predict"):
+            acc = accuracy_score(y_test, model.predict(X_test))
+            aucRoc = roc_auc_score(
+                y_test,
+                model.predict_proba(X_test),
+                multi_class="ovr",
+            )
+
+        with worker.phase("dump"):
+            joblib.dump(model, model_path)
+        return (
+            name,
+            threads,
+            acc,
+            aucRoc,
+            fit_seconds,
+            len(X_train),
+            worker.records,
+        )
+
+    # The CPU budget is split between the concurrent fits so that the
+    # per-estimator thread pools do not oversubscribe the container.
+    cpus = n_jobs or available_cpus()
+    workers = max(1, min(len(estimators), cpus))
+    threads = max(1, cpus // workers)
+    results = joblib.Parallel(
+        n_jobs=workers,
+        backend="loky",
+        max_nbytes="1M",
+        mmap_mode="r",
+    )(
+        joblib.delayed(fit_and_score)(
+            name,
+            threads,
+            outputs[name][0].path,
+            previous.get(name),
+            # In train_test_split's order: X_train, X_test, y_train, y_test.
+            *splits["delta" if name in previous else "full"],
+        )
+        for name in estimators
+    )
+
+    for name, threads, acc, aucRoc, fit_seconds, fit_rows, records in results:
+        outputs[name][0].metadata["estimator"] = name
+        outputs[name][0].metadata["warm_start"] = name in previous
+        metrics = outputs[name][1]
+        metrics.log_metric("accuracy", (acc))
+        metrics.log_metric("aucRoc", (aucRoc))
+        metrics.log_metric("n_jobs", threads)
+        metrics.log_metric("fit_seconds", fit_seconds)
+        metrics.log_metric("fit_rows", fit_rows)
+        metrics.log_metric("warm_start", name in previous)
+        if cache is not None:
+            metrics.log_metric("cache_hit", False)
+        if records:
+            profiler.log(metrics, records)
+            profiler.records.extend(records)
+            metrics.log_metric(
+                "fit_peak_rss_mb",
+                max(record["peak_rss_bytes"] for record in records) / 2**20,
+            )
+
+        if warm_dir and delta_files is not None:
+            # The next incremental run continues from this model, or reuses
+            # it with these metrics when there are no new rows.
+            os.makedirs(warm_dir, exist_ok=True)
+            model_path, metrics_path = saved[name]
+            shutil.copyfile(outputs[name][0].path, f"{model_path}.tmp")
+            os.replace(f"{model_path}.tmp", model_path)
+            with open(f"{metrics_path}.tmp", "w") as f:
+                json.dump(dict(metrics.metadata), f, default=str)
+            os.replace(f"{metrics_path}.tmp", metrics_path)
+
+    profiler.close(*cached_metrics.values())
+
+    if cache is not None:
+        cache.commit(cached_models, cached_metrics)
+    return candidates()
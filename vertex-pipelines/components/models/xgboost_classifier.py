@@ -20,48 +20,31 @@ from kfp.dsl import Metrics
 from kfp.dsl import Model
 from kfp.dsl import Output
 
+from components.images import BASE_IMAGE
+
 
 @component(
-    base_image="gcr.io/deeplearning-platform-release/tf2-cpu.2-6:latest",
-    packages_to_install=[
-        "xgboost==1.6.2",
-        "pandas==1.3.5",
-        "joblib==1.1.0",
-    ],
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
 )
 def xgboost(
     train_dataset: Input[Dataset],
     metrics: Output[Metrics],
     output_model: Output[Model],
+    n_jobs: int = 0,
+    hist_min_rows: int = 100_000,
+    profile: bool = False,
+    trace_uri: str = "",
 ):
-    import joblib
-    import pandas as pd
-    from xgboost import XGBClassifier
-    from sklearn.metrics import accuracy_score, roc_auc_score
-    from sklearn.model_selection import train_test_split
-
-    train = pd.read_csv(train_dataset.path)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        train.drop("Class", axis=1),
-        train["Class"],
-        test_size=0.2,
-        random_state=42,
+    from components.runtime import train_estimator
+
+    train_estimator(
+        "xgboost",
+        train_dataset,
+        metrics,
+        output_model,
+        n_jobs=n_jobs,
+        hist_min_rows=hist_min_rows,
+        profile=profile,
+        trace_uri=trace_uri,
     )
-
-    model = XGBClassifier()
-    model.fit(X_train, y_train)
-
-    pred = model.predict(X_test)
-
-    acc = accuracy_score(y_test, pred)
-    aucRoc = roc_auc_score(
-        y_test,
-        model.predict_proba(X_test),
-        multi_class="ovr",
-    )
-
-    metrics.log_metric("accuracy", (acc))
-    metrics.log_metric("aucRoc", (aucRoc))
-
-    joblib.dump(model, output_model.path)
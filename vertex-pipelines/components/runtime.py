@@ -0,0 +1,350 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers the components import at run time.
+
+The component image (images/components/Dockerfile) ships this module, and
+the components import it inside their function bodies. The image tag is a
+digest of this file (see components/images.py), so a compiled pipeline
+always runs with the helpers it was compiled against. Third-party packages
+are imported where they are used, so a step only loads what it needs.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import resource
+import shutil
+import time
+import uuid
+from functools import lru_cache
+
+
+def available_cpus():
+    # Honour the container's CPU quota (cgroup v2, then v1) instead of
+    # the host core count that os.cpu_count() reports.
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+def read_dataset(artifact, columns=None):
+    import pandas as pd
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    dataset_format = artifact.metadata.get("format", "csv")
+    if dataset_format == "parquet":
+        table = pq.read_table(artifact.path, columns=columns, memory_map=True)
+        return table.to_pandas()
+    if dataset_format == "arrow":
+        table = feather.read_table(artifact.path, columns=columns, memory_map=True)
+        return table.to_pandas()
+    return pd.read_csv(artifact.path, usecols=columns)
+
+
+@lru_cache(maxsize=4)
+def load_model(path):
+    """joblib.load, once per process: loky workers keep their copy between
+    tasks, since this module is imported in them rather than pickled.
+    """
+    import joblib
+
+    return joblib.load(path)
+
+
+def build_estimator(name, threads, num_rows, hist_min_rows=100_000):
+    if name == "logistic_regression":
+        from sklearn.linear_model import LogisticRegression
+
+        # Threaded through BLAS only, which threadpool_limits sizes;
+        # n_jobs would be ignored by the multinomial lbfgs solver.
+        return LogisticRegression()
+    if name == "decision_tree":
+        from sklearn.tree import DecisionTreeClassifier
+
+        return DecisionTreeClassifier()
+    if name == "random_forest":
+        from sklearn.ensemble import RandomForestClassifier
+
+        return RandomForestClassifier(n_jobs=threads)
+    if name == "xgboost":
+        from xgboost import XGBClassifier
+
+        return XGBClassifier(
+            n_jobs=threads,
+            tree_method="hist" if num_rows >= hist_min_rows else "auto",
+        )
+    raise ValueError(f"Unsupported estimator: {name}")
+
+
+def train_estimator(
+    name,
+    train_dataset,
+    metrics,
+    output_model,
+    n_jobs=0,
+    hist_min_rows=100_000,
+    profile=False,
+    trace_uri="",
+):
+    """The body of the single-estimator trainer components."""
+    import joblib
+    from sklearn.metrics import accuracy_score, roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from threadpoolctl import threadpool_limits
+
+    profiler = StepProfiler(name, profile, trace_uri)
+
+    with profiler.phase("load"):
+        train = read_dataset(train_dataset)
+
+    with profiler.phase("preprocess"):
+        X_train, X_test, y_train, y_test = train_test_split(
+            train.drop("Class", axis=1),
+            train["Class"],
+            test_size=0.2,
+            random_state=42,
+        )
+
+    threads = n_jobs or available_cpus()
+    model = build_estimator(name, threads, len(X_train), hist_min_rows)
+    start = time.perf_counter()
+    with profiler.phase("fit"), threadpool_limits(limits=threads):
+        model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    with profiler.phase("predict"):
+        pred = model.predict(X_test)
+
+        acc = accuracy_score(y_test, pred)
+        aucRoc = roc_auc_score(
+            y_test,
+            model.predict_proba(X_test),
+            multi_class="ovr",
+        )
+
+    metrics.log_metric("accuracy", (acc))
+    metrics.log_metric("aucRoc", (aucRoc))
+    metrics.log_metric("n_jobs", threads)
+    metrics.log_metric("fit_seconds", fit_seconds)
+
+    with profiler.phase("dump"):
+        joblib.dump(model, output_model.path)
+
+    profiler.close(metrics)
+
+
+class StepProfiler:
+    """Wall, CPU, I/O and memory figures of named phases of the step.
+
+    A phase records its wall and CPU seconds, the bytes the process read
+    and wrote meanwhile (rchar/wchar of /proc/self/io, so network reads
+    count too) and the peak RSS so far. close() logs the totals per phase
+    as step metrics and, with trace_uri set, writes every record as a
+    JSON line to a file of its own there. Disabled, phase() returns a
+    null context and close() does nothing.
+    """
+
+    def __init__(self, step, enabled, trace_uri=""):
+        self.step = step
+        self.enabled = enabled
+        self.trace_uri = trace_uri
+        self.records = []
+
+    def counters(self):
+        try:
+            with open("/proc/self/io") as f:
+                io = dict(line.split(": ") for line in f.read().splitlines())
+            read, written = int(io["rchar"]), int(io["wchar"])
+        except (OSError, KeyError, ValueError):
+            read = written = 0
+        return time.perf_counter(), time.process_time(), read, written
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.measure(name)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        started = time.time()
+        before = self.counters()
+        try:
+            yield
+        finally:
+            wall, cpu, read, written = (
+                after - start for after, start in zip(self.counters(), before)
+            )
+            # ru_maxrss is reported in kilobytes on Linux.
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.records.append(
+                {
+                    "step": self.step,
+                    "phase": name,
+                    "started": started,
+                    "wall_seconds": wall,
+                    "cpu_seconds": cpu,
+                    "read_bytes": read,
+                    "written_bytes": written,
+                    "peak_rss_bytes": peak_rss,
+                },
+            )
+
+    def log(self, metrics, records):
+        # Phases entered more than once (per chunk, per shard) are summed.
+        keys = ("wall_seconds", "cpu_seconds", "read_bytes", "written_bytes")
+        totals = {}
+        for record in records:
+            total = totals.setdefault(record["phase"], dict.fromkeys(keys, 0))
+            for key in keys:
+                total[key] += record[key]
+        for phase, total in totals.items():
+            for key, value in total.items():
+                metrics.log_metric(f"{phase}_{key}", value)
+
+    def close(self, *metrics):
+        if not self.enabled:
+            return
+        own = [record for record in self.records if record["step"] == self.step]
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        for artifact in metrics:
+            self.log(artifact, own)
+            artifact.log_metric("peak_rss_mb", peak_rss_mb)
+        if self.trace_uri and metrics:
+            directory = self.trace_uri.replace("gs://", "/gcs/", 1)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.step}-{uuid.uuid4().hex}.jsonl")
+            with open(path, "w") as f:
+                for record in self.records:
+                    # The artifact URI names the pipeline job and task.
+                    f.write(json.dumps({**record, "uri": metrics[0].uri}) + "\n")
+
+
+def cache_key(data, params, source):
+    # The step's source file and this module are part of the key, so a code
+    # change to either invalidates the step's entries.
+    digest = hashlib.sha256()
+    for path in (source, __file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    payload = json.dumps(
+        {"data": data, "source": digest.hexdigest(), "params": params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StepCache:
+    """Step outputs stored under cache_uri, addressed by a content key."""
+
+    def __init__(self, root, key, max_gb=50.0, max_age_days=30):
+        self.root = root.replace("gs://", "/gcs/", 1)
+        self.entry = os.path.join(self.root, key)
+        self.manifest = os.path.join(self.entry, "manifest.json")
+        self.max_gb = max_gb
+        self.max_age_days = max_age_days
+
+    def lookup(self, artifacts, metrics):
+        if not os.path.exists(self.manifest):
+            return False
+        with open(self.manifest) as f:
+            manifest = json.load(f)
+        for name, artifact in artifacts.items():
+            artifact.path = os.path.join(self.entry, name)
+            artifact.metadata.update(manifest["metadata"][name])
+        for name, artifact in metrics.items():
+            for metric, value in manifest["metrics"][name].items():
+                artifact.log_metric(metric, value)
+        # The manifest's mtime records the entry's last use for eviction.
+        os.utime(self.manifest)
+        return True
+
+    def stage(self, artifacts):
+        # Outputs are written straight into the entry, so a miss costs no
+        # copy. Directories are never renamed: gcsfuse cannot rename them
+        # atomically. Until commit() writes the manifest, lookup() ignores
+        # the entry and evict() treats it as a leftover.
+        os.makedirs(self.entry, exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.manifest)
+        for name, artifact in artifacts.items():
+            path = os.path.join(self.entry, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+            artifact.path = path
+
+    def commit(self, artifacts, metrics):
+        manifest = {
+            "metadata": {
+                name: dict(artifact.metadata) for name, artifact in artifacts.items()
+            },
+            "metrics": {
+                name: dict(artifact.metadata) for name, artifact in metrics.items()
+            },
+            "bytes": sum(
+                os.path.getsize(os.path.join(directory, name))
+                for directory, _, names in os.walk(self.entry)
+                for name in names
+            ),
+        }
+        # The manifest is the commit marker, written last so that an entry
+        # is only visible once all of its files are in place. Replacing a
+        # single file is atomic on gcsfuse too.
+        with open(f"{self.manifest}.tmp", "w") as f:
+            json.dump(manifest, f, default=str)
+        os.replace(f"{self.manifest}.tmp", self.manifest)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        max_age = self.max_age_days * 86400
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            manifest = os.path.join(path, "manifest.json")
+            if os.path.exists(manifest):
+                with open(manifest) as f:
+                    size = json.load(f)["bytes"]
+                entries.append((os.path.getmtime(manifest), size, path))
+            elif path != self.entry and now - os.path.getmtime(path) > max_age:
+                # Entry of a failed run, never committed.
+                shutil.rmtree(path, ignore_errors=True)
+
+        # Least recently used first: expired entries go, then as many
+        # more as needed to bring the store under max_gb.
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            expired = now - used > max_age
+            if path != self.entry and (expired or total > self.max_gb * 2**30):
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
@@ -0,0 +1,234 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from kfp.dsl import Artifact
+from kfp.dsl import component
+from kfp.dsl import Dataset
+from kfp.dsl import Input
+from kfp.dsl import Metrics
+from kfp.dsl import Model
+from kfp.dsl import Output
+
+from components.images import BASE_IMAGE
+
+
+@component(
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
+)
+def batch_predict(
+    project_id: str,
+    input_uri: str,
+    model: Input[Model],
+    predictions: Output[Dataset],
+    metrics: Output[Metrics],
+    label_mapping: Input[Artifact] = None,
+    output_uri: str = "",
+    chunk_size: int = 100_000,
+    n_jobs: int = 0,
+    profile: bool = False,
+    trace_uri: str = "",
+):
+    import json
+    import math
+    import os
+    import time
+
+    import joblib
+    import numpy as np
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    from components.runtime import (
+        StepProfiler,
+        available_cpus,
+        cache_key,
+        load_model,
+    )
+
+    profiler = StepProfiler("batch_predict", profile, trace_uri)
+
+    label_column = "Class"
+
+    if not input_uri:
+        raise ValueError("input_uri is required for batch prediction")
+
+    def file_stats(path):
+        # The size and mtime of every file under path stand in for its content.
+        paths = [path]
+        if os.path.isdir(path):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+        stats = [os.stat(name) for name in paths]
+        return [
+            (name, stat.st_size, stat.st_mtime_ns) for name, stat in zip(paths, stats)
+        ]
+
+    if input_uri.startswith("bq://"):
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=project_id)
+        table = client.get_table(input_uri[len("bq://") :])
+        # The table's modification time and size stand in for its content.
+        snapshot = [input_uri, table.modified, table.num_rows, table.num_bytes]
+    else:
+        snapshot = [input_uri, file_stats(input_uri.replace("gs://", "/gcs/", 1))]
+
+    # Shards are written under a stable output_uri when one is given, so a
+    # retried run finds the shards finished before the failure and skips them.
+    # The manifest ties the shards to the model, the input and the chunking
+    # that produced them; shards left by any other run are cleared first.
+    output_dir = output_uri.replace("gs://", "/gcs/", 1) or predictions.path
+    os.makedirs(output_dir, exist_ok=True)
+    run_key = cache_key(
+        data={"model": [model.uri, file_stats(model.path)], "input": snapshot},
+        params={"chunk_size": chunk_size},
+        source=__file__,
+    )
+    manifest_path = os.path.join(output_dir, "_manifest.json")
+    previous_key = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous_key = json.load(f)["key"]
+    if previous_key != run_key:
+        for name in os.listdir(output_dir):
+            if name.startswith("part-"):
+                os.remove(os.path.join(output_dir, name))
+        with open(f"{manifest_path}.tmp", "w") as f:
+            json.dump({"key": run_key, "model": model.uri, "input": input_uri}, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def shard_path(index):
+        return os.path.join(output_dir, f"part-{index:05d}.parquet")
+
+    def rechunk(frames):
+        buffer, buffered = [], 0
+        for frame in frames:
+            buffer.append(frame)
+            buffered += len(frame)
+            while buffered >= chunk_size:
+                merged = pd.concat(buffer, ignore_index=True)
+                yield merged.iloc[:chunk_size]
+                buffer, buffered = [merged.iloc[chunk_size:]], buffered - chunk_size
+        if buffered:
+            yield pd.concat(buffer, ignore_index=True)
+
+    def read_bigquery():
+        num_shards = math.ceil(table.num_rows / chunk_size)
+        for index in range(num_shards):
+            if os.path.exists(shard_path(index)):
+                yield index, None
+                continue
+            # tabledata.list is positional, so every shard maps to the same
+            # rows on every attempt and finished shards are never re-read.
+            with profiler.phase("load"):
+                rows = client.list_rows(
+                    table,
+                    start_index=index * chunk_size,
+                    max_results=chunk_size,
+                ).to_dataframe()
+            yield index, rows
+
+    def read_files(uri):
+        path = uri.replace("gs://", "/gcs/", 1)
+        if path.endswith(".csv"):
+            frames = pd.read_csv(path, chunksize=chunk_size)
+        else:
+            file_format = "ipc" if path.endswith((".arrow", ".feather")) else "parquet"
+            dataset = ds.dataset(path, format=file_format)
+            frames = (
+                batch.to_pandas() for batch in dataset.to_batches(batch_size=chunk_size)
+            )
+        for index, frame in enumerate(rechunk(frames)):
+            yield index, None if os.path.exists(shard_path(index)) else frame
+
+    classes = None
+    if label_mapping is not None:
+        with open(label_mapping.path) as f:
+            classes = np.asarray(json.load(f)["classes"], dtype=object)
+
+    def score_shard(index, frame, model_path, path):
+        # Runs in a loky worker: its phases go back to the parent with the
+        # row count.
+        worker = StepProfiler("batch_predict", profile)
+        with worker.phase("load"):
+            # Cached in the worker process: only its first shard loads it.
+            estimator = load_model(model_path)
+        with worker.phase("preprocess"):
+            feature_names = getattr(estimator, "feature_names_in_", None)
+            if feature_names is None:
+                feature_names = [c for c in frame.columns if c != label_column]
+            features = frame[list(feature_names)].astype(np.float32)
+
+        with worker.phase("predict"):
+            proba = estimator.predict_proba(features)
+            predicted = np.asarray(estimator.classes_)[proba.argmax(axis=1)]
+        output = pd.DataFrame(
+            proba.astype(np.float32),
+            columns=[f"proba_{c}" for c in estimator.classes_],
+        )
+        output.insert(0, "row_id", np.arange(len(frame)) + index * chunk_size)
+        output.insert(1, "predicted_code", predicted)
+        if classes is not None:
+            output.insert(2, "predicted_class", classes[predicted])
+
+        # Written under a temporary name and renamed, so a shard file only
+        # exists once it is complete.
+        with worker.phase("dump"):
+            output.to_parquet(f"{path}.tmp", index=False)
+            os.replace(f"{path}.tmp", path)
+        return len(output), worker.records
+
+    if input_uri.startswith("bq://"):
+        shards = read_bigquery()
+    else:
+        shards = read_files(input_uri)
+
+    skipped = []
+
+    def pending():
+        for index, frame in shards:
+            if frame is None:
+                skipped.append(index)
+                continue
+            yield joblib.delayed(score_shard)(
+                index,
+                frame,
+                model.path,
+                shard_path(index),
+            )
+
+    start = time.perf_counter()
+    scored = joblib.Parallel(
+        n_jobs=n_jobs or available_cpus(),
+        backend="loky",
+        pre_dispatch="2*n_jobs",
+    )(pending())
+    elapsed = time.perf_counter() - start
+    for _, records in scored:
+        profiler.records.extend(records)
+    scored_rows = sum(rows for rows, _ in scored)
+
+    predictions.path = output_dir
+    predictions.metadata["format"] = "parquet"
+
+    metrics.log_metric("scored_rows", scored_rows)
+    metrics.log_metric("scored_shards", len(scored))
+    metrics.log_metric("resumed_shards", len(skipped))
+    metrics.log_metric("rows_per_second", scored_rows / max(elapsed, 1e-9))
+
+    profiler.close(metrics)
@@ -16,18 +16,15 @@ from kfp.dsl import Artifact
 from kfp.dsl import component
 from kfp.dsl import Dataset
 from kfp.dsl import Input
+from kfp.dsl import Metrics
 from kfp.dsl import Output
 
+from components.images import BASE_IMAGE
+
 
 @component(
-    base_image="gcr.io/deeplearning-platform-release/tf2-cpu.2-6:latest",
-    packages_to_install=[
-        "xgboost==1.6.2",
-        "pandas==1.3.5",
-        "joblib==1.1.0",
-        "google-cloud-aiplatform",
-        "google-cloud-bigquery",
-    ],
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
 )
 def split_data(
     project_id: str,
@@ -35,11 +32,209 @@ def split_data(
     dataset: Input[Artifact],
     train_dataset: Output[Dataset],
     test_dataset: Output[Dataset],
+    label_mapping: Output[Artifact],
+    metrics: Output[Metrics],
+    dataset_format: str = "csv",
+    compression: str = "zstd",
+    ingestion_mode: str = "batch",
+    split_key: str = "",
+    split_seed: int = 42,
+    test_size: float = 0.2,
+    read_streams: int = 4,
+    max_workers: int = 0,
+    downcast_features: bool = True,
+    cache_uri: str = "",
+    cache_max_gb: float = 50.0,
+    cache_max_age_days: int = 30,
+    incremental_column: str = "",
+    state_uri: str = "",
+    sample_size: int = 0,
+    sample_fraction: float = 0.0,
+    sample_seed: int = 42,
+    profile: bool = False,
+    trace_uri: str = "",
 ):
+    import json
+    import os
+    import resource
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
     import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     from google.cloud import aiplatform, bigquery
     from sklearn.model_selection import train_test_split
 
+    from components.runtime import StepCache, StepProfiler, cache_key
+
+    # "parquet" and "arrow" (Arrow IPC) keep the pandas schema and can be
+    # memory-mapped by the consumers; "csv" is kept for older pipelines.
+    if dataset_format not in ("csv", "parquet", "arrow"):
+        raise ValueError(f"Unsupported dataset format: {dataset_format}")
+    if ingestion_mode not in ("batch", "streaming", "storage"):
+        raise ValueError(f"Unsupported ingestion mode: {ingestion_mode}")
+    if incremental_column and (dataset_format != "parquet" or not state_uri):
+        raise ValueError("Incremental mode needs parquet splits and a state_uri")
+    if sample_size and sample_fraction:
+        raise ValueError("Set either sample_size or sample_fraction, not both")
+    if not 0.0 <= sample_fraction <= 1.0:
+        raise ValueError(f"sample_fraction must be in [0, 1]: {sample_fraction}")
+    if incremental_column and sample_size:
+        # A size is split between the classes by their counts, which are not
+        # known up front for a delta; a fraction filters row by row.
+        raise ValueError(
+            "sample_size needs the class counts of the whole read; "
+            "use sample_fraction with incremental_column",
+        )
+
+    label_column = "Class"
+
+    class ShardWriter:
+        """Appends DataFrame chunks to a single dataset file."""
+
+        def __init__(self, artifact):
+            self.artifact = artifact
+            self.schema = None
+            self.writer = None
+            self.num_rows = 0
+
+        def write(self, df):
+            if df.empty:
+                return
+            if dataset_format == "csv":
+                df.to_csv(
+                    self.artifact.path,
+                    mode="a",
+                    header=self.num_rows == 0,
+                    index=False,
+                )
+            else:
+                table = pa.Table.from_pandas(
+                    df,
+                    schema=self.schema,
+                    preserve_index=False,
+                )
+                if self.writer is None:
+                    self.schema = table.schema
+                    self.writer = self._open(table.schema)
+                self.writer.write_table(table)
+            self.num_rows += len(df)
+
+        def _open(self, schema):
+            codec = None if compression == "uncompressed" else compression
+            if dataset_format == "parquet":
+                return pq.ParquetWriter(
+                    self.artifact.path,
+                    schema,
+                    compression=codec,
+                )
+            return pa.ipc.new_file(
+                self.artifact.path,
+                schema,
+                options=pa.ipc.IpcWriteOptions(compression=codec),
+            )
+
+        def close(self):
+            if self.writer is not None:
+                self.writer.close()
+            self.artifact.metadata["format"] = dataset_format
+            self.artifact.metadata["num_rows"] = self.num_rows
+
+    class StratifiedSampler:
+        """Rows picked by a seeded hash of their values.
+
+        The hash makes the sample depend on the seed only, not on chunking
+        or read order. With a fraction, add() keeps the rows whose hash falls
+        in that fraction of the hash range: a Bernoulli filter that holds
+        nothing and keeps the class proportions in expectation. With a size,
+        every class keeps its smallest hashes in a reservoir sized to its
+        share of class_counts, and sample() returns exactly that many rows.
+        """
+
+        def __init__(self, fraction=0.0, size=0, class_counts=None):
+            self.hash_key = f"{sample_seed % 10**16:016d}"
+            self.threshold = None
+            if fraction:
+                self.threshold = np.uint64(min(int(fraction * 2**64), 2**64 - 1))
+            self.quotas = self.allocate(size, class_counts or {})
+            self.rows = 0
+            self.reservoirs = {}
+            self.buffered = {}
+            self.cutoffs = {}
+            self.lock = threading.Lock()
+
+        @staticmethod
+        def allocate(size, counts):
+            total = sum(counts.values())
+            size = min(size, total)
+            if not size:
+                return {}
+            # Largest-remainder allocation keeps the class proportions and
+            # sums exactly to the requested size.
+            shares = {label: size * count / total for label, count in counts.items()}
+            quotas = {label: int(share) for label, share in shares.items()}
+            remainders = sorted(
+                shares,
+                key=lambda label: (quotas[label] - shares[label], label),
+            )
+            for label in remainders[: size - sum(quotas.values())]:
+                quotas[label] += 1
+            return quotas
+
+        def add(self, chunk):
+            """Returns the rows of chunk to write now: the kept ones with a
+            fraction, none with a size (they wait for sample()).
+            """
+            priorities = pd.util.hash_pandas_object(
+                chunk,
+                index=False,
+                hash_key=self.hash_key,
+            ).values
+            if self.threshold is not None:
+                with self.lock:
+                    self.rows += len(chunk)
+                return chunk[priorities < self.threshold]
+
+            groups = chunk.groupby(label_column, sort=False).indices
+            with self.lock:
+                self.rows += len(chunk)
+                for label, rows in groups.items():
+                    quota = self.quotas.get(label, 0)
+                    if label in self.cutoffs:
+                        rows = rows[priorities[rows] < self.cutoffs[label]]
+                    if not quota or not len(rows):
+                        continue
+                    candidates = chunk.iloc[rows].assign(_priority=priorities[rows])
+                    self.reservoirs.setdefault(label, []).append(candidates)
+                    self.buffered[label] = self.buffered.get(label, 0) + len(rows)
+                    # Compacted once twice the quota is buffered, so most
+                    # chunks cost a filter and an append, not a sort.
+                    if self.buffered[label] >= 2 * quota:
+                        self.compact(label)
+            return chunk.iloc[:0]
+
+        def compact(self, label):
+            kept = pd.concat(self.reservoirs[label]).nsmallest(
+                self.quotas[label],
+                "_priority",
+            )
+            self.reservoirs[label] = [kept]
+            self.buffered[label] = len(kept)
+            # Rows hashed above the largest kept priority can never get in.
+            self.cutoffs[label] = kept["_priority"].iloc[-1]
+
+        def sample(self):
+            for label in self.reservoirs:
+                self.compact(label)
+            sample = pd.concat(
+                self.reservoirs[label][0] for label in sorted(self.reservoirs)
+            )
+            return sample.drop(columns="_priority").reset_index(drop=True)
+
+    profiler = StepProfiler("split_data", profile, trace_uri)
+
     aiplatform.init(project=project_id, location=location)
 
     data = aiplatform.TabularDataset(
@@ -56,39 +251,337 @@ def split_data(
     dataset_ref = bigquery.DatasetReference(project_id, dataset_id)
     table_ref = dataset_ref.table(table_id)
     table = bigquery.Table(table_ref)
-    iterable_table = client.list_rows(table).to_dataframe_iterable()
-
-    dfs = []
-    for row in iterable_table:
-        dfs.append(row)
-
-    df = pd.concat(dfs, ignore_index=True)
-    del dfs
-
-    df["Class"].replace(
-        {
-            "DERMASON": 0,
-            "SIRA": 1,
-            "SEKER": 2,
-            "HOROZ": 3,
-            "CALI": 4,
-            "BARBUNYA": 5,
-            "BOMBAY": 6,
-        },
-        inplace=True,
-    )
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        df.drop("Class", axis=1),
-        df["Class"],
-        test_size=0.2,
-        random_state=42,
-    )
+    cache = None
+    cached_outputs = {
+        "train_dataset": train_dataset,
+        "test_dataset": test_dataset,
+        "label_mapping": label_mapping,
+    }
+    if cache_uri and not incremental_column:
+        # The table's modification time and size stand in for its content.
+        source = client.get_table(table)
+        cache = StepCache(
+            os.path.join(cache_uri, "split_data"),
+            cache_key(
+                data=[uri, source.modified, source.num_rows, source.num_bytes],
+                params={
+                    "dataset_format": dataset_format,
+                    "compression": compression,
+                    "ingestion_mode": ingestion_mode,
+                    "split_key": split_key,
+                    "split_seed": split_seed,
+                    "test_size": test_size,
+                    "downcast_features": downcast_features,
+                    "sample_size": sample_size,
+                    "sample_fraction": sample_fraction,
+                    "sample_seed": sample_seed,
+                },
+                source=__file__,
+            ),
+            max_gb=cache_max_gb,
+            max_age_days=cache_max_age_days,
+        )
+        with profiler.phase("cache_lookup"):
+            hit = cache.lookup(cached_outputs, {"metrics": metrics})
+        if hit:
+            metrics.log_metric("cache_hit", True)
+            print(f"Reusing cached splits from {cache.entry}")
+            profiler.close(metrics)
+            return
+        cache.stage(cached_outputs)
+
+    def smallest_int_dtype(low, high):
+        for dtype in (np.int8, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return np.dtype(dtype).name
+        return "int64"
+
+    def profile_table():
+        # One aggregate query gives the label vocabulary with the class
+        # counts and the integer ranges up front, so every streamed chunk is
+        # encoded and downcast to the same schema.
+        int_columns = [
+            field.name
+            for field in client.get_table(table).schema
+            if field.field_type in ("INTEGER", "INT64") and field.name != label_column
+        ]
+        source = f"`{project_id}.{dataset_id}.{table_id}`"
+        aggregates = [
+            f"ARRAY(SELECT AS STRUCT `{label_column}` AS label, COUNT(*) AS count "
+            f"FROM {source} GROUP BY 1) AS classes",
+        ] + [
+            f"MIN(`{column}`) AS `min_{column}`, MAX(`{column}`) AS `max_{column}`"
+            for column in int_columns
+        ]
+        query = f"SELECT {', '.join(aggregates)} FROM {source}"
+        profile = list(client.query(query).result())[0]
+        int_dtypes = {
+            column: smallest_int_dtype(
+                profile[f"min_{column}"],
+                profile[f"max_{column}"],
+            )
+            for column in int_columns
+        }
+        class_counts = {row["label"]: row["count"] for row in profile["classes"]}
+        return sorted(class_counts), int_dtypes, class_counts
+
+    def profile_frame(df):
+        features = df.drop(columns=label_column)
+        int_dtypes = {
+            column: smallest_int_dtype(values.min(), values.max())
+            for column, values in features.select_dtypes("integer").items()
+        }
+        return sorted(df[label_column].unique()), int_dtypes
+
+    def preprocess(chunk, classes, int_dtypes):
+        codes = pd.Categorical(chunk[label_column], categories=classes).codes
+        if (codes < 0).any():
+            raise ValueError(f"Unknown {label_column} value in {table_id}")
+        chunk[label_column] = codes
+        if downcast_features:
+            float_columns = chunk.select_dtypes("floating").columns
+            chunk = chunk.astype(
+                {**int_dtypes, **{column: "float32" for column in float_columns}},
+            )
+        return chunk
+
+    train_writer = ShardWriter(train_dataset)
+    test_writer = ShardWriter(test_dataset)
+
+    # Each row is assigned to train or test from a seeded hash of the split
+    # key (or of the whole row), so chunks are written as they arrive and the
+    # same row always lands in the same split, whatever the chunking.
+    hash_key = f"{split_seed % 10**16:016d}"
+    test_buckets = int(test_size * 10_000)
+    write_lock = threading.Lock()
 
-    X_train["Class"] = y_train
-    X_test["Class"] = y_test
+    sampler = None
+    if sample_fraction:
+        sampler = StratifiedSampler(fraction=sample_fraction)
+
+    def size_sampler(classes, class_counts):
+        # Reservoirs are keyed by the encoded label.
+        return StratifiedSampler(
+            size=sample_size,
+            class_counts={
+                code: class_counts[label] for code, label in enumerate(classes)
+            },
+        )
+
+    # In the streaming modes the preprocess and dump phases run inside
+    # "load", on the reader threads, so load's figures include theirs.
+    def write_chunk(chunk):
+        with profiler.phase("preprocess"):
+            chunk = preprocess(chunk, classes, int_dtypes)
+        if sampler is not None:
+            write_split(sampler.add(chunk))
+            return len(chunk)
+        return write_split(chunk)
+
+    def write_split(chunk):
+        hashes = pd.util.hash_pandas_object(
+            chunk[split_key] if split_key else chunk,
+            index=False,
+            hash_key=hash_key,
+        )
+        is_test = (hashes.values % 10_000) < test_buckets
+        with profiler.phase("dump"), write_lock:
+            train_writer.write(chunk[~is_test])
+            test_writer.write(chunk[is_test])
+        return len(chunk)
+
+    if not incremental_column and ingestion_mode != "batch":
+        with profiler.phase("profile"):
+            classes, int_dtypes, class_counts = profile_table()
+        if sample_size:
+            sampler = size_sampler(classes, class_counts)
+
+    if incremental_column:
+        # The splits live in a stable directory next to a state file holding
+        # the high-water mark; each run appends one part file per split with
+        # the rows past the mark only.
+        state_dir = os.path.join(
+            state_uri.replace("gs://", "/gcs/", 1),
+            f"{dataset_id}.{table_id}",
+        )
+        state_path = os.path.join(state_dir, "state.json")
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            classes = state["classes"]
+        else:
+            state = {"high_water_mark": None, "parts": 0, "rows": {}}
+            with profiler.phase("profile"):
+                classes, _, _ = profile_table()
+        # Integer columns keep their BigQuery width so that every part file
+        # shares one schema.
+        int_dtypes = {}
+
+        query = f"SELECT * FROM `{project_id}.{dataset_id}.{table_id}`"
+        job_config = None
+        if state["high_water_mark"] is not None:
+            field_types = {
+                field.name: field.field_type for field in client.get_table(table).schema
+            }
+            query += f" WHERE `{incremental_column}` > @high_water_mark"
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ScalarQueryParameter(
+                        "high_water_mark",
+                        field_types[incremental_column],
+                        state["high_water_mark"],
+                    ),
+                ],
+            )
+
+        part = f"part-{state['parts']:05d}.parquet"
+        for split, artifact in (("train", train_dataset), ("test", test_dataset)):
+            os.makedirs(os.path.join(state_dir, split), exist_ok=True)
+            artifact.path = os.path.join(state_dir, split, part)
+
+        high_water_mark = None
+        with profiler.phase("load"):
+            rows = client.query(query, job_config=job_config).result()
+            for chunk in rows.to_dataframe_iterable():
+                if chunk.empty:
+                    continue
+                latest = chunk[incremental_column].max()
+                if high_water_mark is None or latest > high_water_mark:
+                    high_water_mark = latest
+                # The column only orders the rows; it is not a feature.
+                write_chunk(chunk.drop(columns=incremental_column))
+
+    elif ingestion_mode == "storage":
+        from google.cloud import bigquery_storage
+
+        # Open several Storage Read API streams and decode their Arrow
+        # record batches concurrently; only the writes are serialized.
+        read_client = bigquery_storage.BigQueryReadClient()
+        session = read_client.create_read_session(
+            parent=f"projects/{project_id}",
+            read_session=bigquery_storage.types.ReadSession(
+                table=f"projects/{project_id}/datasets/{dataset_id}/tables/{table_id}",
+                data_format=bigquery_storage.types.DataFormat.ARROW,
+            ),
+            max_stream_count=read_streams,
+        )
+
+        def read_stream(stream):
+            reader = read_client.read_rows(stream.name)
+            return sum(
+                write_chunk(page.to_dataframe()) for page in reader.rows(session).pages
+            )
+
+        workers = max_workers or len(session.streams) or 1
+        with profiler.phase("load"):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(read_stream, session.streams))
+        metrics.log_metric("read_streams", len(session.streams))
+
+    elif ingestion_mode == "streaming":
+        with profiler.phase("load"):
+            for chunk in client.list_rows(table).to_dataframe_iterable():
+                write_chunk(chunk)
+
+    else:
+        with profiler.phase("load"):
+            iterable_table = client.list_rows(table).to_dataframe_iterable()
+
+            dfs = []
+            for row in iterable_table:
+                dfs.append(row)
+
+            df = pd.concat(dfs, ignore_index=True)
+            del dfs
+
+        with profiler.phase("preprocess"):
+            classes, int_dtypes = profile_frame(df)
+            df = preprocess(df, classes, int_dtypes)
+            if sample_size:
+                sampler = size_sampler(
+                    range(len(classes)),
+                    df[label_column].value_counts().to_dict(),
+                )
+            if sampler is not None:
+                df = sampler.add(df)
+            if sample_size:
+                df = sampler.sample()
+
+            X_train, X_test, y_train, y_test = train_test_split(
+                df.drop(label_column, axis=1),
+                df[label_column],
+                test_size=test_size,
+                random_state=split_seed,
+            )
+
+            X_train[label_column] = y_train
+            X_test[label_column] = y_test
+
+        with profiler.phase("dump"):
+            train_writer.write(X_train)
+            test_writer.write(X_test)
+
+    if sampler is not None:
+        if sample_size and ingestion_mode != "batch":
+            write_split(sampler.sample())
+        metrics.log_metric("source_rows", sampler.rows)
+        metrics.log_metric("sample_rows", train_writer.num_rows + test_writer.num_rows)
+
+    with profiler.phase("dump"):
+        train_writer.close()
+        test_writer.close()
+
+    if incremental_column:
+        for split, artifact, writer in (
+            ("train", train_dataset, train_writer),
+            ("test", test_dataset, test_writer),
+        ):
+            total = state["rows"].get(split, 0) + writer.num_rows
+            state["rows"][split] = total
+            artifact.path = os.path.join(state_dir, split)
+            artifact.metadata["num_rows"] = total
+            artifact.metadata["delta_rows"] = writer.num_rows
+            artifact.metadata["delta_files"] = [part] if writer.num_rows else []
+        if high_water_mark is not None:
+            state["high_water_mark"] = str(high_water_mark)
+            state["parts"] += 1
+        state["classes"] = classes
+        # The state is replaced last, so a failed run re-reads the same delta
+        # and overwrites its own part files.
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+        if state["high_water_mark"] is not None:
+            metrics.log_metric("high_water_mark", state["high_water_mark"])
+        metrics.log_metric("delta_rows", train_writer.num_rows + test_writer.num_rows)
+
+    # Persist the code -> class mapping next to the splits so that serving
+    # can decode predictions back to bean names.
+    with open(label_mapping.path, "w") as f:
+        json.dump({"column": label_column, "classes": classes}, f)
+    label_mapping.metadata["classes"] = classes
+    for artifact in (train_dataset, test_dataset):
+        artifact.metadata["label_column"] = label_column
+        artifact.metadata["classes"] = classes
+
+    # ru_maxrss is reported in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    metrics.log_metric(
+        "ingestion_mode",
+        "incremental" if incremental_column else ingestion_mode,
+    )
+    metrics.log_metric("train_rows", train_writer.num_rows)
+    metrics.log_metric("test_rows", test_writer.num_rows)
+    metrics.log_metric("peak_rss_mb", peak_rss_mb)
+    profiler.close(metrics)
 
-    X_train.to_csv(f"{train_dataset.path}", index=False)
-    X_test.to_csv(f"{test_dataset.path}", index=False)
+    if cache is not None:
+        # Downstream steps key their own cache entries on this fingerprint.
+        for artifact in (train_dataset, test_dataset):
+            artifact.metadata["fingerprint"] = os.path.basename(cache.entry)
+        metrics.log_metric("cache_hit", False)
+        cache.commit(cached_outputs, {"metrics": metrics})
 
     print(f"Path: {train_dataset}")
@@ -14,39 +14,155 @@
 
 from kfp.dsl import component
 from kfp.dsl import Input
+from kfp.dsl import Metrics
 from kfp.dsl import Model
+from kfp.dsl import Output
+
+from components.images import BASE_IMAGE
 
 
 @component(
-    base_image="gcr.io/deeplearning-platform-release/tf2-cpu.2-6:latest",
-    packages_to_install=["google-cloud-aiplatform"],
+    base_image=BASE_IMAGE,
+    install_kfp_package=False,
 )
 def deploy_model(
     project_id: str,
     location: str,
     model: Input[Model],
+    metrics: Output[Metrics],
+    deploy_mode: str = "reuse",
+    endpoint_display_name: str = "BeansEndpointv1",
+    model_display_name: str = "BeansModelv1",
+    deployed_model_display_name: str = "BeansDeploymentv1",
+    machine_type: str = "n1-standard-4",
+    min_replica_count: int = 1,
+    max_replica_count: int = 3,
+    traffic_steps: list = [10, 50, 100],
+    step_wait_seconds: int = 300,
+    drain_seconds: int = 60,
+    profile: bool = False,
+    trace_uri: str = "",
 ):
+    import time
     from pathlib import Path
     from google.cloud import aiplatform
 
+    from components.runtime import StepProfiler
+
+    profiler = StepProfiler("deploy_model", profile, trace_uri)
+
+    if deploy_mode not in ("reuse", "create"):
+        raise ValueError(f"Unsupported deploy mode: {deploy_mode}")
+    if not traffic_steps or traffic_steps != sorted(traffic_steps):
+        raise ValueError("traffic_steps must be increasing percentages")
+    if traffic_steps[0] <= 0 or traffic_steps[-1] != 100:
+        raise ValueError("traffic_steps must start above 0 and end at 100")
+    if not 1 <= min_replica_count <= max_replica_count:
+        raise ValueError("Expected 1 <= min_replica_count <= max_replica_count")
+
+    def shifted_split(previous, new_id, percentage):
+        # The previous deployments keep their relative shares of the rest;
+        # the largest remainders get the odd points so the split sums to 100.
+        total = sum(previous.values())
+        shares = {
+            deployed_id: (100 - percentage) * share / total
+            for deployed_id, share in previous.items()
+        }
+        split = {deployed_id: int(share) for deployed_id, share in shares.items()}
+        leftover = 100 - percentage - sum(split.values())
+        for deployed_id in sorted(
+            shares,
+            key=lambda deployed_id: shares[deployed_id] - split[deployed_id],
+            reverse=True,
+        )[:leftover]:
+            split[deployed_id] += 1
+        split[new_id] = percentage
+        return split
+
     aiplatform.init(project=project_id, location=location)
 
-    uploaded_model = aiplatform.Model.upload_scikit_learn_model_file(
-        model_file_path=str(Path(model.path)),
-        display_name="BeansModelv1",
-        project=project_id,
-        location=location,
-    )
+    with profiler.phase("upload"):
+        uploaded_model = aiplatform.Model.upload_scikit_learn_model_file(
+            model_file_path=str(Path(model.path)),
+            display_name=model_display_name,
+            project=project_id,
+            location=location,
+        )
 
-    endpoint = aiplatform.Endpoint.create(
-        display_name="BeansEndpointv1",
-        project=project_id,
-        location=location,
-    )
+    # Reusing the endpoint saves its provisioning and keeps the previous
+    # deployment serving, warm, while the new one takes over.
+    endpoint = None
+    if deploy_mode == "reuse":
+        with profiler.phase("lookup"):
+            endpoints = aiplatform.Endpoint.list(
+                filter=f'display_name="{endpoint_display_name}"',
+                order_by="create_time desc",
+                project=project_id,
+                location=location,
+            )
+        endpoint = endpoints[0] if endpoints else None
+    reused = endpoint is not None
+    if endpoint is None:
+        with profiler.phase("create"):
+            endpoint = aiplatform.Endpoint.create(
+                display_name=endpoint_display_name,
+                project=project_id,
+                location=location,
+            )
+
+    previous = {
+        deployed_id: share
+        for deployed_id, share in (endpoint.traffic_split or {}).items()
+        if share
+    }
+    steps = traffic_steps if previous else [100]
+    existing = {deployed.id for deployed in endpoint.list_models()}
 
-    uploaded_model.deploy(
-        machine_type="n1-standard-4",
-        endpoint=endpoint,
-        traffic_split={"0": 100},
-        deployed_model_display_name="BeansDeploymentv1",
+    with profiler.phase("deploy"):
+        # "0" stands for the model being deployed.
+        uploaded_model.deploy(
+            endpoint=endpoint,
+            deployed_model_display_name=deployed_model_display_name,
+            machine_type=machine_type,
+            min_replica_count=min_replica_count,
+            max_replica_count=max_replica_count,
+            traffic_split=shifted_split(previous, "0", steps[0]),
+        )
+    new_id = next(
+        deployed.id
+        for deployed in endpoint.list_models()
+        if deployed.id not in existing
     )
+
+    # Traffic moves over in stages; if a stage fails, the previous
+    # deployments get all of it back and the new one is removed.
+    with profiler.phase("shift"):
+        try:
+            for percentage in steps[1:]:
+                time.sleep(step_wait_seconds)
+                endpoint.update(
+                    traffic_split=shifted_split(previous, new_id, percentage),
+                )
+        except Exception:
+            endpoint.update(traffic_split=shifted_split(previous, new_id, 0))
+            endpoint.undeploy(deployed_model_id=new_id)
+            raise
+
+    # The previous deployments receive no traffic any more; they are
+    # undeployed once their in-flight requests have had time to finish.
+    undeployed = 0
+    with profiler.phase("undeploy"):
+        if previous:
+            time.sleep(drain_seconds)
+        for deployed in endpoint.list_models():
+            if deployed.id != new_id:
+                endpoint.undeploy(deployed_model_id=deployed.id)
+                undeployed += 1
+
+    metrics.log_metric("endpoint", endpoint.resource_name)
+    metrics.log_metric("endpoint_reused", reused)
+    metrics.log_metric("deployed_model_id", new_id)
+    metrics.log_metric("traffic_steps", len(steps))
+    metrics.log_metric("undeployed_models", undeployed)
+
+    profiler.close(metrics)
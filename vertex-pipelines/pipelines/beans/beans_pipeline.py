@@ -15,10 +15,15 @@
 
 import os
 import sys
+import shutil
+import tempfile
+import hashlib
 import argparse
+from pathlib import Path
 from datetime import datetime
 
 import kfp
+import yaml
 from kfp import compiler, dsl
 from kfp.registry import RegistryClient
 from google_cloud_pipeline_components.v1.vertex_notification_email import (
@@ -31,11 +36,24 @@ TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
 
 PIPELINE_REPO = os.getenv("_PIPELINE_REPO")
 PIPELINE_NAME = f"beans-{ENVIRONMENT}-{TIMESTAMP}"
-PIPELINE_ROOT = f"{BUCKET}/{ENVIRONMENT}/{TIMESTAMP}/pipeline_root"
+# Used by --deterministic, so that the compiled spec only changes with the code.
+STABLE_PIPELINE_NAME = f"beans-{ENVIRONMENT}"
+PIPELINE_ROOT = f"{BUCKET}/{ENVIRONMENT}/pipeline_root"
+CACHE_URI = f"{BUCKET}/{ENVIRONMENT}/step_cache"
+STATE_URI = f"{BUCKET}/{ENVIRONMENT}/incremental"
+PREDICTION_CACHE_URI = f"{BUCKET}/{ENVIRONMENT}/prediction_cache"
+# Dev runs work on a seeded sample of the rows so that iterations stay fast.
+SAMPLE_FRACTION = 0.1 if ENVIRONMENT == "dev" else 0.0
 PACKAGE_PATH = "." if ENVIRONMENT == "dev" else "/workspace"
+SPEC_CACHE_DIR = os.getenv("_SPEC_CACHE_DIR", ".pipeline-cache")
 
 sys.path.append("vertex-pipelines/")
 
+if "--run-local" in sys.argv:
+    # The decorator below builds the graph, which names the component image;
+    # local runs call the components in this process and never pull it.
+    os.environ.setdefault("_COMPONENT_IMAGE", "local")
+
 
 @kfp.dsl.pipeline(name=PIPELINE_NAME, pipeline_root=PIPELINE_ROOT)
 def pipeline(
@@ -44,10 +62,26 @@ def pipeline(
     bq_source: str,
     dataset_name: str,
     email_addresses: list,
+    # "none" keeps the original train-and-evaluate graph; "online" deploys
+    # the best model to an endpoint, "batch" scores batch_input_uri with it.
+    serving_mode: str = "none",
+    batch_input_uri: str = "",
+    batch_output_uri: str = "",
+    cache_uri: str = CACHE_URI,
+    prediction_cache_uri: str = PREDICTION_CACHE_URI,
+    incremental_column: str = "",
+    state_uri: str = STATE_URI,
+    sample_fraction: float = SAMPLE_FRACTION,
+    sample_seed: int = 42,
+    profile: bool = True,
+    trace_uri: str = "",
 ):
     import google_cloud_pipeline_components.v1.dataset as GData
     from components.utils.custom_split import split_data
-    from components.models.logistic_regression import logistic_regression
+    from components.models.multi_model import train_models
+    from components.evaluators.custom_evaluation import custom_evaluation
+    from components.utils.batch_predict import batch_predict
+    from components.utils.deploy_model import deploy_model
 
     notify_email_task = VertexNotificationEmailOp(recipients=email_addresses)
     with dsl.ExitHandler(notify_email_task):
@@ -66,11 +100,271 @@ def pipeline(
             project_id=project_id,
             location=location,
             dataset=dataset_create_op.outputs["dataset"],
+            dataset_format="parquet",
+            cache_uri=cache_uri,
+            incremental_column=incremental_column,
+            state_uri=state_uri,
+            sample_fraction=sample_fraction,
+            sample_seed=sample_seed,
+            profile=profile,
+            trace_uri=trace_uri,
         )
 
-        logistic_regression(
+        models = train_models(
             train_dataset=data.outputs["train_dataset"],
+            cache_uri=cache_uri,
+            warm_start_uri=state_uri,
+            profile=profile,
+            trace_uri=trace_uri,
+        )
+
+        # Each trained model is imported back by URI so that the candidates
+        # reach custom_evaluation as one collected list.
+        with dsl.ParallelFor(models.outputs["candidates"]) as candidate:
+            candidate_model = dsl.importer(
+                artifact_uri=candidate.uri,
+                artifact_class=dsl.Model,
+                reimport=False,
+                metadata={"estimator": candidate.estimator},
+            )
+
+        evaluation = custom_evaluation(
+            test_dataset=data.outputs["test_dataset"],
+            candidate_models=dsl.Collected(candidate_model.output),
+            prediction_cache_uri=prediction_cache_uri,
+            profile=profile,
+            trace_uri=trace_uri,
+        )
+
+        with dsl.If(serving_mode == "online"):
+            deploy_model(
+                project_id=project_id,
+                location=location,
+                model=evaluation.outputs["output_model"],
+                profile=profile,
+                trace_uri=trace_uri,
+            )
+
+        with dsl.If(serving_mode == "batch"):
+            batch_predict(
+                project_id=project_id,
+                input_uri=batch_input_uri,
+                model=evaluation.outputs["output_model"],
+                label_mapping=data.outputs["label_mapping"],
+                output_uri=batch_output_uri,
+                profile=profile,
+                trace_uri=trace_uri,
+            )
+
+
+def source_digest():
+    """Hashes everything the compiled spec depends on: this file, the
+    component sources, the SDK versions and the environment defaults.
+    """
+    from importlib.metadata import version
+
+    from components.images import BASE_IMAGE
+
+    root = Path(__file__).resolve().parents[2]
+    digest = hashlib.sha256()
+    for path in [Path(__file__).resolve()] + sorted(
+        (root / "components").rglob("*.py"),
+    ):
+        digest.update(str(path.relative_to(root)).encode())
+        digest.update(path.read_bytes())
+    for value in (
+        version("kfp"),
+        version("google-cloud-pipeline-components"),
+        BUCKET,
+        ENVIRONMENT,
+        STABLE_PIPELINE_NAME,
+        BASE_IMAGE,
+    ):
+        digest.update(str(value).encode())
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_pipeline(package_path, deterministic):
+    if not deterministic:
+        compiler.Compiler().compile(
+            pipeline_func=pipeline,
+            package_path=package_path,
+        )
+        return
+
+    cached = os.path.join(SPEC_CACHE_DIR, f"{source_digest()}.yaml")
+    if os.path.exists(cached):
+        print(f"Sources unchanged, reusing {cached}")
+    else:
+        os.makedirs(SPEC_CACHE_DIR, exist_ok=True)
+        compiler.Compiler().compile(
+            pipeline_func=pipeline,
+            package_path=f"{cached}.tmp",
+            pipeline_name=STABLE_PIPELINE_NAME,
+        )
+        os.replace(f"{cached}.tmp", cached)
+    shutil.copyfile(cached, package_path)
+
+
+def register_pipeline(package_path):
+    """Uploads the spec unless a version with the same content is already
+    registered; `latest` is moved to that version either way.
+    """
+    with open(package_path) as f:
+        package_name = yaml.safe_load(f)["pipelineInfo"]["name"]
+    content_tag = f"sha-{file_digest(package_path)[:16]}"
+
+    client = RegistryClient(host=PIPELINE_REPO)
+    try:
+        version = client.get_tag(package_name, content_tag)["version"]
+    except Exception:  # kfp raises an HTTPError for an unknown tag
+        version = None
+
+    if version is None:
+        templateName, versionName = client.upload_pipeline(
+            file_name=package_path,
+            tags=["latest", content_tag],
+            extra_headers={
+                "description": "Must set by definition. Comment to test changes. TEST16.",
+            },
         )
+        return
+
+    version_id = version.split("/")[-1]
+    latest = client.get_tag(package_name, "latest")["version"]
+    if latest.split("/")[-1] != version_id:
+        client.update_tag(package_name, version_id, "latest")
+    print(f"{package_name} {content_tag} is already registered, skipping upload.")
+
+
+def run_local(args):
+    """Runs the pipeline graph in this process on synthetic or local data.
+
+    BigQuery and Vertex are replaced by the benchmark fakes, dataset creation
+    by a local stand-in, and the email notification by a summary printed
+    once the graph is done.
+    """
+    root = Path(__file__).resolve().parents[2]
+    sys.path.insert(0, str(root))
+
+    import pandas as pd
+    from benchmarks import fakes
+    from pipelines.local_runner import LocalRunner, default_workdir
+    from components.utils.custom_split import split_data
+    from components.models.multi_model import train_models
+    from components.evaluators.custom_evaluation import custom_evaluation
+    from components.utils.batch_predict import batch_predict
+    from components.utils.deploy_model import deploy_model
+
+    if args.local_data.endswith(".csv"):
+        frame = pd.read_csv(args.local_data)
+    elif args.local_data:
+        frame = pd.read_parquet(args.local_data)
+    else:
+        frame = fakes.make_beans_frame(args.local_rows)
+    incremental, warm_start = {}, {}
+    if args.local_state_dir:
+        # Each run reads the rows past the previous run's last row_id.
+        if "row_id" not in frame:
+            frame.insert(0, "row_id", range(len(frame)))
+        incremental = {
+            "incremental_column": "row_id",
+            "state_uri": args.local_state_dir,
+        }
+        warm_start = {"warm_start_uri": args.local_state_dir}
+    fakes.install_google_cloud(frame)
+
+    workdir = tempfile.mkdtemp(
+        prefix="beans-",
+        dir=args.local_workdir or default_workdir(),
+    )
+    runner = LocalRunner(workdir, args.local_workers)
+
+    def create_dataset(dataset):
+        dataset.metadata.update(fakes.dataset_artifact().metadata)
+
+    def notify(tasks):
+        print(f"{'task':<22} {'state':<10} {'seconds':>8}")
+        for task in tasks:
+            seconds = "" if task.seconds is None else f"{task.seconds:.2f}"
+            print(f"{task.name:<22} {task.state:<10} {seconds:>8}")
+            if task.error:
+                print(task.error)
+        metrics = evaluation.outputs["metrics"].metadata
+        if "best_model_name" in metrics:
+            print(
+                f"Best model: {metrics['best_model_name']} "
+                f"(AUC ROC {metrics['best_auc_roc']:.4f})",
+            )
+        print(f"Artifacts: {workdir}")
+
+    dataset = runner.task("tabular-dataset-create", create_dataset, ["dataset"])
+    # Arrow IPC files are memory-mapped by the consumers without decoding.
+    data = runner.task(
+        "split-data",
+        split_data,
+        project_id=fakes.PROJECT_ID,
+        location="local",
+        dataset=dataset.outputs["dataset"],
+        dataset_format="arrow",
+        sample_fraction=args.local_sample_fraction,
+        profile=True,
+        **incremental,
+    )
+    models = runner.task(
+        "train-models",
+        train_models,
+        train_dataset=data.outputs["train_dataset"],
+        profile=True,
+        **warm_start,
+    )
+    evaluation = runner.task(
+        "custom-evaluation",
+        custom_evaluation,
+        test_dataset=data.outputs["test_dataset"],
+        candidate_models=[
+            models.outputs[f"{name}_model"]
+            for name in (
+                "logistic_regression",
+                "decision_tree",
+                "random_forest",
+                "xgboost",
+            )
+        ],
+        profile=True,
+    )
+    if args.serving_mode == "batch":
+        runner.task(
+            "batch-predict",
+            batch_predict,
+            project_id=fakes.PROJECT_ID,
+            input_uri=args.batch_input_uri,
+            model=evaluation.outputs["output_model"],
+            label_mapping=data.outputs["label_mapping"],
+            profile=True,
+        )
+    elif args.serving_mode == "online":
+        runner.task(
+            "deploy-model",
+            deploy_model,
+            project_id=fakes.PROJECT_ID,
+            location="local",
+            model=evaluation.outputs["output_model"],
+            step_wait_seconds=0,
+            drain_seconds=0,
+            profile=True,
+        )
+    runner.exit_handler(notify)
+
+    succeeded = runner.run()
+    if not args.local_keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return succeeded
 
 
 if __name__ == "__main__":
@@ -91,20 +385,80 @@ if __name__ == "__main__":
         help="Register pipeline",
     )
 
+    parser.add_argument(
+        "--deterministic",
+        action="store_true",
+        help="Compile without the timestamp, reusing the cached spec if the "
+        "sources are unchanged",
+    )
+
+    parser.add_argument(
+        "--run-local",
+        action="store_true",
+        help="Run the pipeline graph in this process instead of on Vertex",
+    )
+
+    parser.add_argument(
+        "--local-data",
+        default="",
+        help="CSV or Parquet file with the beans table; synthetic if unset",
+    )
+
+    parser.add_argument(
+        "--local-rows",
+        type=int,
+        default=20_000,
+        help="Rows of synthetic data for --run-local",
+    )
+
+    parser.add_argument("--local-sample-fraction", type=float, default=0.0)
+
+    parser.add_argument("--local-workers", type=int, default=0)
+
+    parser.add_argument(
+        "--local-state-dir",
+        default="",
+        help="Split incrementally and warm-start the models, keeping their "
+        "state here; rerun with more --local-rows to add rows",
+    )
+
+    parser.add_argument(
+        "--local-workdir",
+        default="",
+        help="Where the run's artifacts go; /dev/shm when available",
+    )
+
+    parser.add_argument(
+        "--local-keep",
+        action="store_true",
+        help="Keep the run's artifacts",
+    )
+
+    parser.add_argument(
+        "--serving-mode",
+        choices=["none", "online", "batch"],
+        default="none",
+        help="What --run-local does with the best model, as in the pipeline",
+    )
+
+    parser.add_argument(
+        "--batch-input-uri",
+        default="",
+        help="The local file --serving-mode batch scores",
+    )
+
     args = parser.parse_args()
 
+    if args.serving_mode == "batch" and not args.batch_input_uri:
+        parser.error("--serving-mode batch requires --batch-input-uri")
+
+    package_path = f"{PACKAGE_PATH}/pipeline.yaml"
+
     if args.compile:
-        compiler.Compiler().compile(
-            pipeline_func=pipeline,
-            package_path=f"{PACKAGE_PATH}/pipeline.yaml",
-        )
+        compile_pipeline(package_path, args.deterministic)
 
-    elif args.register:
-        client = RegistryClient(host=PIPELINE_REPO)
-        templateName, versionName = client.upload_pipeline(
-            file_name=f"{PACKAGE_PATH}/pipeline.yaml",
-            tags=["latest"],
-            extra_headers={
-                "description": "Must set by definition. Comment to test changes. TEST16.",
-            },
-        )
+    if args.register:
+        register_pipeline(package_path)
+
+    if args.run_local and not run_local(args):
+        sys.exit(1)
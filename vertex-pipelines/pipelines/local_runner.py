@@ -0,0 +1,156 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process executor for pipeline graphs, for fast local iterations.
+
+Tasks call the components' python_func directly on a thread pool; a task
+starts as soon as the tasks it depends on have succeeded, so independent
+tasks run concurrently. Artifacts are plain objects handed from producer to
+consumer, and their files live under a work directory that defaults to
+/dev/shm, where the consumers memory-map them.
+"""
+
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from kfp.dsl.types import type_utils
+
+
+def default_workdir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+class LocalArtifact:
+    """The ``name``/``path``/``uri``/``metadata`` surface of a KFP artifact."""
+
+    def __init__(self, name, path, metadata=None):
+        self.name = name
+        self.path = path
+        self.uri = path
+        self.metadata = dict(metadata or {})
+
+    def log_metric(self, metric, value):
+        self.metadata[metric] = value
+
+    def __repr__(self):
+        return f"LocalArtifact({self.path!r})"
+
+
+class LocalTask:
+    def __init__(self, name, func, arguments, outputs, after):
+        self.name = name
+        self.func = func
+        self.arguments = arguments
+        self.outputs = outputs
+        self.after = list(after)
+        self.state = "PENDING"
+        self.seconds = None
+        self.error = None
+
+
+class LocalRunner:
+    """Builds a task graph with task() and executes it with run()."""
+
+    def __init__(self, workdir, max_workers=None):
+        self.workdir = workdir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.tasks = []
+        self.producers = {}
+        self.exit_handlers = []
+
+    def task(self, name, component, outputs=None, after=(), **arguments):
+        """Adds a task; outputs default to the component's output artifacts.
+
+        ``component`` is a KFP component or a plain function standing in for
+        one, in which case its output names are passed as ``outputs``. The
+        values a component returns are not kept: downstream tasks are handed
+        the artifacts themselves.
+        """
+        func = getattr(component, "python_func", component)
+        if outputs is None:
+            outputs = [
+                name
+                for name, spec in (component.component_spec.outputs or {}).items()
+                if not type_utils.is_parameter_type(spec.type)
+            ]
+        task_dir = os.path.join(self.workdir, name)
+        os.makedirs(task_dir, exist_ok=True)
+        task = LocalTask(
+            name,
+            func,
+            arguments,
+            {
+                output: LocalArtifact(output, os.path.join(task_dir, output))
+                for output in outputs
+            },
+            after,
+        )
+        for artifact in task.outputs.values():
+            self.producers[id(artifact)] = task
+        self.tasks.append(task)
+        return task
+
+    def exit_handler(self, handler):
+        """Calls ``handler(tasks)`` once every task has finished or failed."""
+        self.exit_handlers.append(handler)
+
+    def dependencies(self, task):
+        upstream = list(task.after)
+        for value in task.arguments.values():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            upstream += [
+                self.producers[id(v)] for v in values if id(v) in self.producers
+            ]
+        return upstream
+
+    def execute(self, task):
+        start = time.perf_counter()
+        try:
+            task.func(**task.arguments, **task.outputs)
+            task.state = "SUCCEEDED"
+        except Exception:
+            task.error = traceback.format_exc()
+            task.state = "FAILED"
+        task.seconds = time.perf_counter() - start
+        return task
+
+    def run(self):
+        """Runs the graph; returns True when every task succeeded."""
+        pending = {task: self.dependencies(task) for task in self.tasks}
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for task, upstream in list(pending.items()):
+                    states = {dependency.state for dependency in upstream}
+                    if states & {"FAILED", "SKIPPED"}:
+                        # As on Vertex, nothing downstream of a failure runs.
+                        task.state = "SKIPPED"
+                        del pending[task]
+                    elif states <= {"SUCCEEDED"}:
+                        task.state = "RUNNING"
+                        running.add(pool.submit(self.execute, task))
+                        del pending[task]
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = future.result()
+                    print(f"{task.name}: {task.state} in {task.seconds:.2f}s")
+
+        for handler in self.exit_handlers:
+            handler(self.tasks)
+        return all(task.state == "SUCCEEDED" for task in self.tasks)
@@ -0,0 +1,339 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact, memory-mappable file format for the beans models.
+
+The trainers persist fitted estimators with ``joblib.dump``. This module
+converts them into a single flat file that loads without unpickling:
+
+    magic (8 bytes) | header length (uint64) | JSON header | arrays
+
+Every array starts on a 64-byte boundary, so :func:`load` can hand out
+``np.memmap`` views over the file instead of copying it into memory.
+
+Tree ensembles (decision tree, random forest, xgboost) are stored as
+concatenated node arrays: ``feature``, ``threshold``, ``left``, ``right``,
+``default_left`` and ``value``, plus the root node of every tree. Leaves
+have ``left == -1``. For traversal, ``walk_left``, ``walk_right`` and
+``walk_feature`` repeat the children and features as int32 with the leaves
+pointing back at themselves (and reading feature 0), and the header holds
+the deepest tree's ``depth``. Logistic regression is stored as ``coef`` and
+``intercept``.
+
+    python -m serving.compact_model model.joblib model.bmdl
+"""
+
+import argparse
+import json
+import math
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b"BEANMDL2"
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<8sQ")
+
+
+class CompactModel:
+    """A model read from the compact format; its arrays may be memory-mapped."""
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.arrays = arrays
+
+    @property
+    def kind(self):
+        return self.header["kind"]
+
+    @property
+    def classes(self):
+        return np.asarray(self.header["classes"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __repr__(self):
+        return f"CompactModel({self.header['estimator']}, {len(self.arrays)} arrays)"
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _tree_header(model, estimator, output, compare, **extra):
+    return {
+        "kind": "tree_ensemble",
+        "estimator": estimator,
+        "n_features": int(model.n_features_in_),
+        "classes": np.asarray(model.classes_).tolist(),
+        "feature_names": [str(f) for f in getattr(model, "feature_names_in_", [])],
+        "output": output,
+        "compare": compare,
+        **extra,
+    }
+
+
+def _with_traversal(header, arrays):
+    # A fixed number of steps then brings every row of every tree to a leaf,
+    # and the engine indexes these arrays straight from the mapped file.
+    left, right = arrays["left"], arrays["right"]
+    is_leaf = left == -1
+    nodes = np.arange(len(left), dtype=np.int32)
+    arrays["walk_left"] = np.where(is_leaf, nodes, left).astype(np.int32)
+    arrays["walk_right"] = np.where(is_leaf, nodes, right).astype(np.int32)
+    arrays["walk_feature"] = np.where(is_leaf, 0, arrays["feature"]).astype(np.int32)
+
+    depth = 0
+    frontier = arrays["roots"][~is_leaf[arrays["roots"]]]
+    while len(frontier):
+        depth += 1
+        children = np.concatenate([left[frontier], right[frontier]])
+        frontier = children[~is_leaf[children]]
+    header["depth"] = depth
+    return header, arrays
+
+
+def _from_sklearn_trees(model, estimators):
+    n_classes = len(model.classes_)
+    nodes = {name: [] for name in ("feature", "threshold", "left", "right", "value")}
+    roots = []
+    offset = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+
+        # Leaves hold class probabilities, normalized the same way as
+        # DecisionTreeClassifier.predict_proba does it.
+        value = tree.value[:, 0, :n_classes].astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+
+        nodes["feature"].append(np.where(is_leaf, -1, tree.feature))
+        nodes["threshold"].append(tree.threshold)
+        nodes["left"].append(np.where(is_leaf, -1, tree.children_left + offset))
+        nodes["right"].append(np.where(is_leaf, -1, tree.children_right + offset))
+        nodes["value"].append(value / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+
+    arrays = {
+        "feature": np.concatenate(nodes["feature"]).astype(np.int32),
+        "threshold": np.concatenate(nodes["threshold"]).astype(np.float64),
+        "left": np.concatenate(nodes["left"]).astype(np.int32),
+        "right": np.concatenate(nodes["right"]).astype(np.int32),
+        "default_left": np.zeros(offset, dtype=np.uint8),
+        "value": np.concatenate(nodes["value"]),
+        "roots": np.asarray(roots, dtype=np.int64),
+    }
+    header = _tree_header(
+        model,
+        type(model).__name__,
+        output="mean_proba",
+        compare="le",
+    )
+    return _with_traversal(header, arrays)
+
+
+def _from_xgboost(model):
+    booster = model.get_booster()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.json")
+        booster.save_model(path)
+        with open(path) as f:
+            learner = json.load(f)["learner"]
+
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree":
+        raise TypeError(f"Unsupported xgboost booster: {gbm['name']}")
+    trees = gbm["model"]["trees"]
+    tree_info = gbm["model"]["tree_info"]
+    n_groups = max(1, int(learner["learner_model_param"]["num_class"]))
+
+    # predict_proba stops at best_iteration when early stopping was used.
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        parallel = int(gbm["model"]["gbtree_model_param"]["num_parallel_tree"])
+        limit = (int(best_iteration) + 1) * parallel * n_groups
+        trees, tree_info = trees[:limit], tree_info[:limit]
+
+    nodes = {name: [] for name in ("feature", "threshold", "left", "right")}
+    default_left, value, roots = [], [], []
+    offset = 0
+    for tree in trees:
+        left = np.asarray(tree["left_children"], dtype=np.int64)
+        right = np.asarray(tree["right_children"], dtype=np.int64)
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        is_leaf = left == -1
+
+        nodes["feature"].append(
+            np.where(is_leaf, -1, np.asarray(tree["split_indices"])),
+        )
+        nodes["threshold"].append(conditions)
+        nodes["left"].append(np.where(is_leaf, -1, left + offset))
+        nodes["right"].append(np.where(is_leaf, -1, right + offset))
+        default_left.append(np.asarray(tree["default_left"], dtype=np.uint8))
+        # Leaf weights are stored in split_conditions.
+        value.append(np.where(is_leaf, conditions, 0.0).astype(np.float32))
+        roots.append(offset)
+        offset += len(left)
+
+    objective = learner["objective"]["name"]
+    base_score = float(learner["learner_model_param"]["base_score"])
+    if objective.startswith("multi:"):
+        output, base_margin = "softmax_margin", base_score
+    elif objective == "binary:logistic":
+        output, base_margin = "sigmoid_margin", math.log(base_score / (1 - base_score))
+    else:
+        raise TypeError(f"Unsupported xgboost objective: {objective}")
+
+    arrays = {
+        "feature": np.concatenate(nodes["feature"]).astype(np.int32),
+        "threshold": np.concatenate(nodes["threshold"]),
+        "left": np.concatenate(nodes["left"]).astype(np.int32),
+        "right": np.concatenate(nodes["right"]).astype(np.int32),
+        "default_left": np.concatenate(default_left),
+        "value": np.concatenate(value)[:, None],
+        "roots": np.asarray(roots, dtype=np.int64),
+        "tree_group": np.asarray(tree_info, dtype=np.int32),
+    }
+    header = _tree_header(
+        model,
+        type(model).__name__,
+        output=output,
+        compare="lt",
+        n_groups=n_groups,
+        base_margin=base_margin,
+    )
+    return _with_traversal(header, arrays)
+
+
+def _from_linear(model):
+    coef = np.asarray(model.coef_, dtype=np.float64)
+    if coef.shape[0] == 1:
+        output = "binary"
+    else:
+        # Mirrors how LogisticRegression resolves multi_class="auto".
+        multi_class = getattr(model, "multi_class", "auto")
+        liblinear = getattr(model, "solver", "") == "liblinear"
+        if multi_class == "ovr" or (multi_class != "multinomial" and liblinear):
+            output = "ovr"
+        else:
+            output = "softmax"
+
+    header = {
+        "kind": "linear",
+        "estimator": type(model).__name__,
+        "n_features": int(model.n_features_in_),
+        "classes": np.asarray(model.classes_).tolist(),
+        "feature_names": [str(f) for f in getattr(model, "feature_names_in_", [])],
+        "output": output,
+    }
+    arrays = {
+        "coef": coef,
+        "intercept": np.asarray(model.intercept_, dtype=np.float64),
+    }
+    return header, arrays
+
+
+def from_estimator(model):
+    """Converts a fitted estimator into a :class:`CompactModel`."""
+    if hasattr(model, "get_booster"):
+        header, arrays = _from_xgboost(model)
+    elif hasattr(model, "tree_"):
+        header, arrays = _from_sklearn_trees(model, [model])
+    elif hasattr(model, "estimators_") and hasattr(model.estimators_[0], "tree_"):
+        header, arrays = _from_sklearn_trees(model, model.estimators_)
+    elif hasattr(model, "coef_") and hasattr(model, "predict_proba"):
+        header, arrays = _from_linear(model)
+    else:
+        raise TypeError(f"Unsupported model type: {type(model).__name__}")
+    return CompactModel(header, arrays)
+
+
+def save(model, path):
+    """Writes a fitted estimator (or a :class:`CompactModel`) to ``path``."""
+    if not isinstance(model, CompactModel):
+        model = from_estimator(model)
+
+    arrays = {name: np.ascontiguousarray(a) for name, a in model.arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += array.nbytes
+
+    header = json.dumps({**model.header, "arrays": layout}).encode()
+    data_start = _align(_PREFIX.size + len(header))
+    with open(path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+def load(path, mmap=True):
+    """Reads a compact model; with ``mmap`` the arrays are views of the file."""
+    with open(path, "rb") as f:
+        magic, header_size = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compact model file")
+        header = json.loads(f.read(header_size))
+
+    data_start = _align(_PREFIX.size + header_size)
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+
+    arrays = {}
+    for name, spec in header.pop("arrays").items():
+        dtype = np.dtype(spec["dtype"])
+        start = data_start + spec["offset"]
+        stop = start + math.prod(spec["shape"]) * dtype.itemsize
+        arrays[name] = buffer[start:stop].view(dtype).reshape(spec["shape"])
+    return CompactModel(header, arrays)
+
+
+def is_compact(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a joblib model into the compact format.",
+    )
+    parser.add_argument("source", help="Model written with joblib.dump")
+    parser.add_argument("target", help="Compact model file to write")
+    args = parser.parse_args()
+
+    import joblib
+
+    save(joblib.load(args.source), args.target)
+    for path in (args.source, args.target):
+        print(f"{path}: {os.path.getsize(path):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vectorized batch inference for the beans models.
+
+:func:`compile_model` turns a fitted estimator, a compact model file or a
+joblib file into an engine whose ``predict_proba`` evaluates the whole batch
+with NumPy instead of going through sklearn's per-estimator dispatch:
+
+* tree ensembles walk every tree at once, one vectorized step per tree
+  level, over packed node arrays;
+* logistic regression is a single matrix multiply and link function.
+
+Probabilities are accumulated in the same precision as the source
+library and match ``predict_proba`` within floating-point tolerance (xgboost
+to float32 round-off). They are bit-identical only where the summation order
+agrees too: single trees, logistic regression, and forests predicting with
+``n_jobs=1``. A forest with ``n_jobs > 1``, as train_models fits it, adds up
+its trees in a thread-dependent order.
+"""
+
+import os
+
+import numpy as np
+from scipy.special import expit
+
+from serving import compact_model
+
+# Bounds the (rows x trees) index matrices of one traversal block.
+MAX_BLOCK_CELLS = 1 << 20
+
+
+class _Engine:
+    def __init__(self, model):
+        self.model = model
+        self.classes_ = model.classes
+        self.feature_names = model.header.get("feature_names") or None
+
+    def _features(self, X, dtype=None):
+        if self.feature_names is not None and hasattr(X, "columns"):
+            X = X[self.feature_names]
+        X = np.asarray(X, dtype=dtype)
+        if X.ndim == 1:
+            X = X[None, :]
+        return X
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class TreeEnsembleEngine(_Engine):
+    """Evaluates all trees of a compact tree ensemble over a batch at once."""
+
+    def __init__(self, model):
+        super().__init__(model)
+        # Leaves point back at themselves, so a fixed number of steps (the
+        # deepest tree's depth) brings every row of every tree to a leaf.
+        # compact_model stores the arrays ready to index, so the workers
+        # share the file's pages instead of each converting a copy.
+        self.left = np.asarray(model["walk_left"])
+        self.right = np.asarray(model["walk_right"])
+        self.feature = np.asarray(model["walk_feature"])
+        self.threshold = np.asarray(model["threshold"])
+        self.default_left = np.asarray(model["default_left"]).view(bool)
+        self.value = np.asarray(model["value"])
+        self.roots = np.asarray(model["roots"])
+        self.depth = model.header["depth"]
+        self.strict = model.header["compare"] == "lt"
+        self.output = model.header["output"]
+
+        if self.output != "mean_proba":
+            self.tree_group = np.asarray(model["tree_group"])
+            self.n_groups = model.header["n_groups"]
+            self.base_margin = np.float32(model.header["base_margin"])
+
+    def apply(self, X):
+        """Returns the leaf reached in every tree, shape (rows, trees)."""
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            values = X[rows, self.feature[nodes]]
+            if self.strict:
+                go_left = values < self.threshold[nodes]
+            else:
+                go_left = values <= self.threshold[nodes]
+            missing = np.isnan(values)
+            if missing.any():
+                go_left = np.where(missing, self.default_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def _predict_block(self, X):
+        leaves = self.apply(X)
+        if self.output == "mean_proba":
+            # Same accumulation as the forest: tree by tree, then averaged.
+            proba = np.zeros((len(X), self.value.shape[1]), dtype=np.float64)
+            for tree in range(leaves.shape[1]):
+                proba += self.value[leaves[:, tree]]
+            proba /= leaves.shape[1]
+            return proba
+
+        margin = np.full((len(X), self.n_groups), self.base_margin, dtype=np.float32)
+        for tree in range(leaves.shape[1]):
+            margin[:, self.tree_group[tree]] += self.value[leaves[:, tree], 0]
+        if self.output == "sigmoid_margin":
+            positive = 1 / (1 + np.exp(-margin[:, 0]))
+            return np.stack([1 - positive, positive], axis=1)
+        margin = np.exp(margin - margin.max(axis=1, keepdims=True))
+        return margin / margin.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, X):
+        # sklearn and xgboost both compare float32 feature values.
+        X = self._features(X, dtype=np.float32)
+        block = max(1, MAX_BLOCK_CELLS // len(self.roots))
+        if len(X) <= block:
+            return self._predict_block(X)
+        return np.concatenate(
+            [self._predict_block(X[i : i + block]) for i in range(0, len(X), block)],
+        )
+
+
+class LinearEngine(_Engine):
+    """Logistic regression as one matrix multiply plus its link function."""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.coef_t = np.ascontiguousarray(np.asarray(model["coef"]).T)
+        self.intercept = np.asarray(model["intercept"])
+        self.output = model.header["output"]
+
+    def predict_proba(self, X):
+        decision = self._features(X) @ self.coef_t + self.intercept
+        if self.output == "binary":
+            positive = expit(decision[:, 0])
+            return np.vstack([1 - positive, positive]).T
+        if self.output == "ovr":
+            proba = expit(decision)
+            return proba / proba.sum(axis=1).reshape((proba.shape[0], -1))
+        decision -= np.max(decision, axis=1).reshape((-1, 1))
+        np.exp(decision, decision)
+        decision /= np.sum(decision, axis=1).reshape((-1, 1))
+        return decision
+
+
+def compile_model(model):
+    """Builds an engine from an estimator, a CompactModel or a model file."""
+    if isinstance(model, (str, os.PathLike)):
+        if compact_model.is_compact(model):
+            model = compact_model.load(model)
+        else:
+            import joblib
+
+            model = joblib.load(model)
+    if not isinstance(model, compact_model.CompactModel):
+        model = compact_model.from_estimator(model)
+
+    if model.kind == "linear":
+        return LinearEngine(model)
+    return TreeEnsembleEngine(model)
@@ -0,0 +1,183 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays a JSON-lines request file against the prediction server.
+
+Every line is one request: a ``{"instances": [...]}`` body, or an object
+whose ``body`` field holds one. The lines are sent in file order, cycling,
+over ``--concurrency`` keep-alive connections until ``--requests`` have
+completed or ``--duration`` seconds have passed. The report gives QPS,
+rows/s and latency percentiles.
+
+    python -m serving.load_test requests.jsonl --generate 1000 --rows 1
+    python -m serving.load_test requests.jsonl --concurrency 64 --duration 30
+
+Run both against ``--max-batch-size 1`` and the defaults of serving.server
+to see what the micro-batching buys.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+
+def read_requests(path):
+    bodies = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request.get("body", request)
+            if isinstance(body, str):
+                body = json.loads(body)
+            bodies.append(json.dumps(body).encode())
+    if not bodies:
+        raise ValueError(f"No requests in {path}")
+    return bodies
+
+
+def generate_requests(path, count, rows, seed=0):
+    from benchmarks import fakes
+
+    frame = fakes.make_beans_frame(count * rows, seed=seed)
+    features = frame[fakes.BEAN_FEATURES].to_numpy().tolist()
+    with open(path, "w") as f:
+        for i in range(count):
+            body = {"instances": features[i * rows : (i + 1) * rows]}
+            f.write(json.dumps(body) + "\n")
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def post(reader, writer, host, path, body):
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body,
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(args, bodies, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        while time.perf_counter() < deadline:
+            try:
+                body = next(bodies)
+            except StopIteration:
+                break
+            start = time.perf_counter()
+            status = await post(reader, writer, args.host, args.path, body)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(args, bodies):
+    # One shared iterator, so the clients together replay the file in order.
+    requests = itertools.cycle(bodies)
+    if args.requests:
+        requests = itertools.islice(requests, args.requests)
+    deadline = time.perf_counter() + args.duration
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            client(args, requests, deadline, latencies, errors)
+            for _ in range(args.concurrency)
+        ),
+    )
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("requests_file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/predict")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--requests", type=int, help="Stop after this many.")
+    parser.add_argument(
+        "--generate",
+        type=int,
+        metavar="COUNT",
+        help="Write COUNT synthetic requests to requests_file and exit.",
+    )
+    parser.add_argument("--rows", type=int, default=1, help="Rows per request.")
+    parser.add_argument("--output", help="Also write the report as JSON here.")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_requests(args.requests_file, args.generate, args.rows)
+        print(f"{args.generate} requests written to {args.requests_file}")
+        return
+
+    bodies = read_requests(args.requests_file)
+    rows = [len(json.loads(body)["instances"]) for body in bodies]
+    latencies, errors, seconds = asyncio.run(run(args, bodies))
+    if not latencies:
+        raise SystemExit(f"No successful requests ({len(errors)} errors)")
+
+    ordered = sorted(latencies)
+    completed = len(ordered)
+    report = {
+        "requests": completed,
+        "errors": len(errors),
+        "concurrency": args.concurrency,
+        "seconds": seconds,
+        "qps": completed / seconds,
+        # Approximate: assumes the replayed mix matches the file's.
+        "rows_per_second": completed * sum(rows) / len(rows) / seconds,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p90_ms": percentile(ordered, 0.90) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+    print(
+        f"{report['requests']} requests, {report['errors']} errors in "
+        f"{seconds:.1f}s: {report['qps']:,.0f} QPS, "
+        f"{report['rows_per_second']:,.0f} rows/s",
+    )
+    print(
+        f"latency ms: p50 {report['p50_ms']:.2f}  p90 {report['p90_ms']:.2f}  "
+        f"p99 {report['p99_ms']:.2f}  max {report['max_ms']:.2f}",
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
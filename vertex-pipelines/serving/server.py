@@ -0,0 +1,338 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-batching prediction server for the beans models.
+
+Requests go through an asyncio queue, and concurrent requests are scored
+together in one ``predict_proba`` call of up to ``--max-batch-size`` rows,
+waiting at most ``--max-wait-ms`` for a batch to fill (see
+:class:`MicroBatcher`). The model, typically the ``custom_evaluation``
+output, is converted once to the compact format. Every worker process
+memory-maps that file, so the workers share one copy of the arrays through
+the page cache. The workers accept on one shared listening socket.
+
+    python -m serving.server model.joblib --workers 4 --port 8080 \
+        --label-mapping label_mapping.json
+
+``POST /predict`` takes ``{"instances": [[f1, ..., f16], ...]}`` (or one
+object per instance keyed by feature name) and answers
+``{"predictions": [{"class_code": ..., "class": ..., "probabilities": [...]}]}``;
+``GET /health`` reports the worker's batch counters.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from serving import compact_model
+from serving.inference import compile_model
+
+
+class MicroBatcher:
+    """Coalesces queued requests into one model call per batch.
+
+    A batch is scored once it holds max_batch_size rows or max_wait has
+    passed since its first request. It also goes early when the queue is
+    empty and the recent gap between arrivals says the next request is not
+    due before the deadline, so a lone request under light load does not
+    wait for company that will not come.
+    """
+
+    def __init__(self, predict_proba, max_batch_size=256, max_wait=0.005):
+        self.predict_proba = predict_proba
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.carry = None
+        # Exponentially weighted gap between arrivals, in seconds.
+        self.gap = max_wait
+        self.last_arrival = None
+        # Scoring runs off the event loop so that requests keep queueing.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.rows = 0
+
+    async def predict(self, rows):
+        now = time.perf_counter()
+        if self.last_arrival is not None:
+            self.gap = 0.9 * self.gap + 0.1 * (now - self.last_arrival)
+        self.last_arrival = now
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((rows, future))
+        return await future
+
+    async def next_batch(self):
+        if self.carry is not None:
+            batch, self.carry = [self.carry], None
+        else:
+            batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            if self.queue.empty():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.gap > remaining:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self.queue.get_nowait()
+            if size + len(item[0]) > self.max_batch_size:
+                self.carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            try:
+                X = np.concatenate([rows for rows, _ in batch])
+                proba = await loop.run_in_executor(
+                    self.executor,
+                    self.predict_proba,
+                    X,
+                )
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.rows += len(X)
+            offset = 0
+            for rows, future in batch:
+                if not future.done():
+                    future.set_result(proba[offset : offset + len(rows)])
+                offset += len(rows)
+
+
+class PredictionService:
+    def __init__(self, batcher, classes, feature_names, n_features, labels=None):
+        self.batcher = batcher
+        self.classes = classes
+        self.feature_names = feature_names
+        self.n_features = n_features
+        self.labels = labels
+
+    def parse(self, body):
+        instances = json.loads(body)["instances"]
+        if instances and isinstance(instances[0], dict):
+            if self.feature_names is None:
+                raise ValueError("The model has no feature names")
+            instances = [
+                [instance[name] for name in self.feature_names]
+                for instance in instances
+            ]
+        rows = np.asarray(instances, dtype=np.float32)
+        if rows.ndim != 2 or not len(rows):
+            raise ValueError("instances must be a non-empty list of rows")
+        # A row of the wrong width would break the batch it is coalesced into.
+        if rows.shape[1] != self.n_features:
+            raise ValueError(
+                f"instances have {rows.shape[1]} features, "
+                f"the model expects {self.n_features}",
+            )
+        return rows
+
+    async def predict(self, body):
+        try:
+            rows = self.parse(body)
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {"error": str(error)}
+        try:
+            proba = await self.batcher.predict(rows)
+        except Exception as error:
+            return 500, {"error": str(error)}
+        codes = self.classes[proba.argmax(axis=1)]
+        predictions = []
+        for code, probabilities in zip(codes.tolist(), proba.tolist()):
+            prediction = {"class_code": code, "probabilities": probabilities}
+            if self.labels is not None:
+                prediction["class"] = self.labels[code]
+            predictions.append(prediction)
+        return 200, {"predictions": predictions}
+
+    def health(self):
+        return 200, {
+            "status": "ok",
+            "pid": os.getpid(),
+            "batches": self.batcher.batches,
+            "rows": self.batcher.rows,
+        }
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive: enough for load tests and for
+        # callers inside the VPC.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "POST" and path == "/predict":
+                    status, payload = await self.predict(body)
+                elif method == "GET" and path == "/health":
+                    status, payload = self.health()
+                else:
+                    status, payload = 404, {"error": f"No route for {method} {path}"}
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data,
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def load_engine(model_path, engine):
+    """Returns (predict_proba, classes, feature_names, n_features)."""
+    if engine == "compiled":
+        model = compile_model(model_path)
+        return (
+            model.predict_proba,
+            np.asarray(model.classes_),
+            model.feature_names,
+            model.model.header["n_features"],
+        )
+
+    import joblib
+    import pandas as pd
+
+    model = joblib.load(model_path)
+    feature_names = getattr(model, "feature_names_in_", None)
+
+    def predict_proba(X):
+        if feature_names is not None:
+            X = pd.DataFrame(X, columns=feature_names)
+        return model.predict_proba(X)
+
+    if feature_names is not None:
+        feature_names = list(feature_names)
+    classes = np.asarray(model.classes_)
+    return predict_proba, classes, feature_names, int(model.n_features_in_)
+
+
+async def serve(sock, args, model_path):
+    predict_proba, classes, feature_names, n_features = load_engine(
+        model_path,
+        args.engine,
+    )
+    labels = None
+    if args.label_mapping:
+        with open(args.label_mapping) as f:
+            labels = json.load(f)["classes"]
+
+    batcher = MicroBatcher(
+        predict_proba,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000,
+    )
+    service = PredictionService(batcher, classes, feature_names, n_features, labels)
+    batch_task = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(service.handle, sock=sock, backlog=1024)
+    print(f"Worker {os.getpid()} serving on {sock.getsockname()}", flush=True)
+    async with server:
+        await server.serve_forever()
+    batch_task.cancel()
+
+
+def worker(sock, args, model_path):
+    try:
+        asyncio.run(serve(sock, args, model_path))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("model", help="joblib or compact model file")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument(
+        "--engine",
+        choices=["compiled", "sklearn"],
+        default="compiled",
+        help="sklearn loads the joblib model in every worker instead",
+    )
+    parser.add_argument("--label-mapping", help="label_mapping artifact of split_data")
+    args = parser.parse_args()
+
+    model_path = args.model
+    if args.engine == "compiled" and not compact_model.is_compact(model_path):
+        # Converted once here, then memory-mapped by every worker.
+        import joblib
+
+        fd, model_path = tempfile.mkstemp(suffix=".bmdl")
+        os.close(fd)
+        compact_model.save(joblib.load(args.model), model_path)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+
+    # The forked workers inherit the listening socket and accept on it.
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=worker, args=(sock, args, model_path), daemon=True)
+        for _ in range(max(1, args.workers))
+    ]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+    finally:
+        if model_path != args.model:
+            os.remove(model_path)
+
+
+if __name__ == "__main__":
+    main()
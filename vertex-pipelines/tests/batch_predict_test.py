@@ -0,0 +1,112 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""batch_predict resuming into a stable output_uri."""
+
+import os
+import sys
+from pathlib import Path
+
+import joblib
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.utils.batch_predict import batch_predict  # noqa: E402
+
+
+def save_model(path, frame, max_depth):
+    features = frame.drop(columns="Class")
+    model = DecisionTreeClassifier(max_depth=max_depth, random_state=0)
+    joblib.dump(model.fit(features, frame["Class"]), path)
+    return fakes.FakeArtifact(path)
+
+
+def predict(workdir, input_path, model, output_dir):
+    metrics = fakes.output_artifact(workdir, "metrics")
+    batch_predict.python_func(
+        project_id=fakes.PROJECT_ID,
+        input_uri=str(input_path),
+        model=model,
+        predictions=fakes.output_artifact(workdir, "predictions"),
+        metrics=metrics,
+        output_uri=str(output_dir),
+        chunk_size=1000,
+        n_jobs=1,
+    )
+    return metrics.metadata
+
+
+def parts(output_dir):
+    return sorted(name for name in os.listdir(output_dir) if name.startswith("part-"))
+
+
+def test_resume(tmp_path):
+    frame = fakes.make_beans_frame(3500)
+    input_path = tmp_path / "input.parquet"
+    frame.to_parquet(input_path, index=False)
+    model = save_model(tmp_path / "model.joblib", frame, max_depth=3)
+    output_dir = tmp_path / "predictions"
+
+    first = predict(tmp_path / "first", input_path, model, output_dir)
+    assert first["scored_shards"] == 4
+    assert len(pd.read_parquet(output_dir)) == 3500
+
+    # A retry after a failure only scores the shards that are missing.
+    os.remove(output_dir / "part-00002.parquet")
+    retry = predict(tmp_path / "retry", input_path, model, output_dir)
+    assert retry["scored_shards"] == 1
+    assert retry["resumed_shards"] == 3
+    assert len(pd.read_parquet(output_dir)) == 3500
+
+
+def test_new_model_clears_the_shards(tmp_path):
+    frame = fakes.make_beans_frame(3500)
+    input_path = tmp_path / "input.parquet"
+    frame.to_parquet(input_path, index=False)
+    output_dir = tmp_path / "predictions"
+    predict(
+        tmp_path / "first",
+        input_path,
+        save_model(tmp_path / "first.joblib", frame, max_depth=1),
+        output_dir,
+    )
+
+    model = save_model(tmp_path / "second.joblib", frame, max_depth=None)
+    second = predict(tmp_path / "second", input_path, model, output_dir)
+
+    assert second["scored_shards"] == 4
+    assert second["resumed_shards"] == 0
+    expected = joblib.load(model.path).predict(frame.drop(columns="Class"))
+    predicted = pd.read_parquet(output_dir).sort_values("row_id")["predicted_code"]
+    assert (predicted.to_numpy() == expected).all()
+
+
+def test_new_input_clears_the_shards(tmp_path):
+    frame = fakes.make_beans_frame(3500)
+    input_path = tmp_path / "input.parquet"
+    frame.to_parquet(input_path, index=False)
+    model = save_model(tmp_path / "model.joblib", frame, max_depth=3)
+    output_dir = tmp_path / "predictions"
+    predict(tmp_path / "first", input_path, model, output_dir)
+
+    frame.iloc[:1500].to_parquet(input_path, index=False)
+    second = predict(tmp_path / "second", input_path, model, output_dir)
+
+    assert second["resumed_shards"] == 0
+    # The shards past the new input's end are gone too.
+    assert parts(output_dir) == ["part-00000.parquet", "part-00001.parquet"]
+    assert len(pd.read_parquet(output_dir)) == 1500
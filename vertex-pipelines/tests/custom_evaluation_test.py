@@ -0,0 +1,105 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""custom_evaluation over a list of candidate models."""
+
+import sys
+from pathlib import Path
+
+import joblib
+import pandas as pd
+import pytest
+from sklearn.dummy import DummyClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.evaluators.custom_evaluation import custom_evaluation  # noqa: E402
+
+
+@pytest.fixture
+def test_dataset(tmp_path):
+    frame = fakes.make_beans_frame(2000)
+    frame["Class"] = pd.Categorical(
+        frame["Class"],
+        categories=fakes.BEAN_CLASSES,
+    ).codes.astype("int64")
+    path = tmp_path / "test.parquet"
+    frame.to_parquet(path, index=False)
+    return fakes.FakeArtifact(
+        path,
+        {"format": "parquet", "classes": fakes.BEAN_CLASSES},
+    )
+
+
+def candidate(tmp_path, estimator, model, frame):
+    model.fit(frame.drop(columns="Class"), frame["Class"])
+    path = tmp_path / f"{estimator}.joblib"
+    joblib.dump(model, path)
+    return fakes.FakeArtifact(path, {"estimator": estimator})
+
+
+def evaluate(tmp_path, test_dataset, candidate_models, **kwargs):
+    metrics = fakes.output_artifact(tmp_path / "outputs", "metrics")
+    output_model = fakes.output_artifact(tmp_path / "outputs", "output_model")
+    custom_evaluation.python_func(
+        test_dataset=test_dataset,
+        candidate_models=candidate_models,
+        metrics=metrics,
+        output_model=output_model,
+        **kwargs,
+    )
+    return metrics.metadata, output_model
+
+
+@pytest.mark.parametrize("evaluation_mode", ["batch", "streaming"])
+def test_picks_the_best_candidate(tmp_path, test_dataset, evaluation_mode):
+    frame = pd.read_parquet(test_dataset.path)
+    models = [
+        candidate(tmp_path, "dummy", DummyClassifier(), frame),
+        candidate(tmp_path, "decision_tree", DecisionTreeClassifier(), frame),
+    ]
+
+    metrics, output_model = evaluate(
+        tmp_path,
+        test_dataset,
+        models,
+        evaluation_mode=evaluation_mode,
+    )
+
+    assert metrics["best_model_name"] == "decision_tree"
+    assert metrics["dummy (AUC ROC)"] == pytest.approx(0.5)
+    assert output_model.path == models[1].path
+
+
+def test_names_unlabelled_and_repeated_candidates(tmp_path, test_dataset):
+    frame = pd.read_parquet(test_dataset.path)
+    models = [
+        candidate(tmp_path, "dummy", DummyClassifier(), frame),
+        candidate(tmp_path, "dummy_again", DummyClassifier(), frame),
+        candidate(tmp_path, "unlabelled", DummyClassifier(), frame),
+    ]
+    models[1].metadata["estimator"] = "dummy"
+    del models[2].metadata["estimator"]
+
+    metrics, _ = evaluate(tmp_path, test_dataset, models)
+
+    for name in ("dummy", "dummy_1", "model_2"):
+        assert f"{name} (AUC ROC)" in metrics
+
+
+def test_needs_a_candidate(tmp_path, test_dataset):
+    with pytest.raises(ValueError, match="at least one candidate"):
+        evaluate(tmp_path, test_dataset, [])
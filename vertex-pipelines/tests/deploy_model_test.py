@@ -0,0 +1,179 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""deploy_model's staged rollout against the in-memory endpoint."""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.utils.deploy_model import deploy_model  # noqa: E402
+
+STEP_WAIT = 5
+DRAIN = 60
+
+
+@pytest.fixture
+def endpoint_class(monkeypatch):
+    """Installs an endpoint that logs its updates, undeploys and the sleeps."""
+    fakes.install_google_cloud(fakes.make_beans_frame(100))
+    events = []
+
+    class RecordingEndpoint(fakes.FakeEndpoint):
+        endpoints = []
+        # The traffic percentage of the new model whose update fails, as a
+        # failed health check would fail that stage.
+        fail_at = None
+
+        def update(self, traffic_split=None, **kwargs):
+            new_id = max(self.deployed_models, key=int)
+            if traffic_split and traffic_split.get(new_id) == self.fail_at:
+                raise RuntimeError("health check failed")
+            events.append(("update", dict(traffic_split)))
+            return super().update(traffic_split=traffic_split, **kwargs)
+
+        def undeploy(self, deployed_model_id, **kwargs):
+            events.append(("undeploy", deployed_model_id))
+            super().undeploy(deployed_model_id, **kwargs)
+
+    RecordingEndpoint.events = events
+    aiplatform = sys.modules["google.cloud.aiplatform"]
+    monkeypatch.setattr(aiplatform, "Endpoint", RecordingEndpoint)
+
+    def sleep(seconds):
+        events.append(("sleep", seconds))
+
+    monkeypatch.setattr(time, "sleep", sleep)
+    return RecordingEndpoint
+
+
+def deploy(workdir, **kwargs):
+    metrics = fakes.output_artifact(workdir, "metrics")
+    deploy_model.python_func(
+        project_id=fakes.PROJECT_ID,
+        location="local",
+        model=fakes.FakeArtifact(Path(workdir) / "model.joblib"),
+        metrics=metrics,
+        step_wait_seconds=STEP_WAIT,
+        drain_seconds=DRAIN,
+        **kwargs,
+    )
+    return metrics.metadata
+
+
+def test_first_deployment(tmp_path, endpoint_class):
+    metrics = deploy(tmp_path)
+
+    (endpoint,) = endpoint_class.endpoints
+    assert metrics["endpoint_reused"] is False
+    assert metrics["traffic_steps"] == 1
+    assert metrics["undeployed_models"] == 0
+    # Nothing to shift traffic from, or to drain.
+    assert endpoint.history == [{"1": 100}]
+    assert endpoint_class.events == []
+
+
+def test_reuse_shifts_traffic_in_stages(tmp_path, endpoint_class):
+    deploy(tmp_path / "first")
+    endpoint_class.events.clear()
+
+    metrics = deploy(tmp_path / "second")
+
+    (endpoint,) = endpoint_class.endpoints
+    assert metrics["endpoint"] == endpoint.resource_name
+    assert metrics["endpoint_reused"] is True
+    assert metrics["deployed_model_id"] == "2"
+    assert metrics["traffic_steps"] == 3
+    assert endpoint.history == [
+        {"1": 100},
+        {"1": 90, "2": 10},
+        {"1": 50, "2": 50},
+        {"1": 0, "2": 100},
+    ]
+    assert endpoint.traffic_split == {"2": 100}
+    assert list(endpoint.deployed_models) == ["2"]
+
+
+def test_create_mode_ignores_the_existing_endpoint(tmp_path, endpoint_class):
+    deploy(tmp_path / "first")
+
+    metrics = deploy(tmp_path / "second", deploy_mode="create")
+
+    first, second = endpoint_class.endpoints
+    assert metrics["endpoint_reused"] is False
+    assert metrics["endpoint"] == second.resource_name
+    assert first.traffic_split == {"1": 100}
+    assert second.history == [{"1": 100}]
+
+
+def test_previous_deployments_keep_their_shares(tmp_path, endpoint_class):
+    deploy(tmp_path / "first")
+    (endpoint,) = endpoint_class.endpoints
+    fakes.FakeModel("", "canary").deploy(
+        endpoint,
+        "canary",
+        traffic_split={"1": 67, "0": 33},
+    )
+
+    deploy(tmp_path / "second", traffic_steps=[25, 100])
+
+    # The remaining 75 points are split 67:33, the odd point going to the
+    # largest remainder.
+    assert endpoint.history[-2:] == [
+        {"1": 50, "2": 25, "3": 25},
+        {"1": 0, "2": 0, "3": 100},
+    ]
+    assert list(endpoint.deployed_models) == ["3"]
+
+
+def test_failed_stage_rolls_back(tmp_path, endpoint_class):
+    deploy(tmp_path / "first")
+    endpoint_class.events.clear()
+    endpoint_class.fail_at = 50
+
+    with pytest.raises(RuntimeError, match="health check failed"):
+        deploy(tmp_path / "second")
+
+    (endpoint,) = endpoint_class.endpoints
+    # The previous model gets all of its traffic back and the new one is
+    # removed; the previous one is never drained.
+    assert endpoint_class.events == [
+        ("sleep", STEP_WAIT),
+        ("update", {"1": 100, "2": 0}),
+        ("undeploy", "2"),
+    ]
+    assert endpoint.traffic_split == {"1": 100}
+    assert list(endpoint.deployed_models) == ["1"]
+
+
+def test_undeploy_after_the_drain(tmp_path, endpoint_class):
+    deploy(tmp_path / "first")
+    endpoint_class.events.clear()
+
+    metrics = deploy(tmp_path / "second")
+
+    assert metrics["undeployed_models"] == 1
+    assert endpoint_class.events == [
+        ("sleep", STEP_WAIT),
+        ("update", {"1": 50, "2": 50}),
+        ("sleep", STEP_WAIT),
+        ("update", {"1": 0, "2": 100}),
+        ("sleep", DRAIN),
+        ("undeploy", "1"),
+    ]
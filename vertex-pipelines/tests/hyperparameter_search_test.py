@@ -0,0 +1,73 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""hyperparameter_search on the synthetic beans frame."""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.models.hyperparameter_search import (  # noqa: E402
+    hyperparameter_search,
+)
+
+
+def search(tmp_path, **kwargs):
+    frame = fakes.make_beans_frame(2000)
+    frame["Class"] = pd.Categorical(
+        frame["Class"],
+        categories=fakes.BEAN_CLASSES,
+    ).codes.astype("int64")
+    path = tmp_path / "train.parquet"
+    frame.to_parquet(path, index=False)
+    outputs = {
+        name: fakes.output_artifact(tmp_path / "outputs", name)
+        for name in ("metrics", "output_model", "trials")
+    }
+    hyperparameter_search.python_func(
+        train_dataset=fakes.FakeArtifact(path, {"format": "parquet"}),
+        n_jobs=2,
+        **outputs,
+        **kwargs,
+    )
+    return outputs
+
+
+def test_successive_halving(tmp_path):
+    outputs = search(tmp_path, n_candidates=9, eta=3, min_resource=1 / 9)
+
+    trials = pd.read_csv(outputs["trials"].path)
+    # 9 candidates on a ninth of the rows, 3 on a third, 1 on all of them.
+    assert trials.groupby("rung").size().tolist() == [9, 3, 1]
+    assert outputs["metrics"].metadata["aucRoc"] > 0.5
+    best = trials[trials["rung"] == 2].iloc[0]
+    assert outputs["output_model"].metadata["estimator"] == best["estimator"]
+
+
+@pytest.mark.parametrize(
+    "kwargs, message",
+    [
+        ({"min_resource": 0.0}, "min_resource"),
+        ({"min_resource": 2.0}, "min_resource"),
+        ({"eta": 1}, "eta"),
+    ],
+)
+def test_rejects_invalid_budgets(tmp_path, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        search(tmp_path, **kwargs)
@@ -0,0 +1,119 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""StepCache and cache_key on a local directory."""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.runtime import StepCache, cache_key  # noqa: E402
+
+DAY = 86400
+
+
+def run_step(root, key, payload=b"model", **kwargs):
+    """A step that misses, writes its output into the entry and commits."""
+    cache = StepCache(str(root), key, **kwargs)
+    model = fakes.FakeArtifact("")
+    metrics = fakes.FakeArtifact("")
+    assert not cache.lookup({"model": model}, {"metrics": metrics})
+    cache.stage({"model": model})
+    with open(model.path, "wb") as f:
+        f.write(payload)
+    model.metadata["estimator"] = "xgboost"
+    metrics.log_metric("aucRoc", 0.9)
+    cache.commit({"model": model}, {"metrics": metrics})
+    return cache
+
+
+def age(path, days):
+    when = time.time() - days * DAY
+    os.utime(path, (when, when))
+
+
+def test_miss_then_hit(tmp_path):
+    cache = run_step(tmp_path, "key")
+
+    model = fakes.FakeArtifact("")
+    metrics = fakes.FakeArtifact("")
+    assert StepCache(str(tmp_path), "key").lookup(
+        {"model": model}, {"metrics": metrics}
+    )
+    assert model.path == os.path.join(cache.entry, "model")
+    with open(model.path, "rb") as f:
+        assert f.read() == b"model"
+    assert model.metadata == {"estimator": "xgboost"}
+    assert metrics.metadata == {"aucRoc": 0.9}
+
+    assert not StepCache(str(tmp_path), "other").lookup({"model": model}, {})
+
+
+def test_uncommitted_entry(tmp_path):
+    cache = StepCache(str(tmp_path), "failed", max_age_days=30)
+    model = fakes.FakeArtifact("")
+    cache.stage({"model": model})
+    with open(model.path, "wb") as f:
+        f.write(b"partial")
+
+    # A run that died before commit() leaves an entry lookup() ignores.
+    assert not StepCache(str(tmp_path), "failed").lookup({"model": model}, {})
+
+    run_step(tmp_path, "recent", max_age_days=30)
+    assert os.path.exists(cache.entry)
+    age(cache.entry, 31)
+    run_step(tmp_path, "later", max_age_days=30)
+    assert not os.path.exists(cache.entry)
+
+
+def test_lru_eviction(tmp_path):
+    # Room for two 1000-byte entries.
+    max_gb = 2500 / 2**30
+    first = run_step(tmp_path, "first", b"1" * 1000, max_gb=max_gb)
+    second = run_step(tmp_path, "second", b"2" * 1000, max_gb=max_gb)
+    age(first.manifest, 2)
+    age(second.manifest, 1)
+    # Reading the first entry makes the second the least recently used.
+    assert StepCache(str(tmp_path), "first").lookup(
+        {"model": fakes.FakeArtifact("")}, {}
+    )
+
+    third = run_step(tmp_path, "third", b"3" * 1000, max_gb=max_gb)
+
+    assert os.path.exists(first.manifest)
+    assert not os.path.exists(second.entry)
+    assert os.path.exists(third.manifest)
+
+
+def test_expired_entries_are_evicted(tmp_path):
+    old = run_step(tmp_path, "old", max_age_days=30)
+    age(old.manifest, 31)
+    run_step(tmp_path, "new", max_age_days=30)
+    assert not os.path.exists(old.entry)
+
+
+def test_cache_key(tmp_path):
+    source = tmp_path / "step.py"
+    source.write_text("def step(): pass\n")
+    key = cache_key(data="fingerprint", params={"seed": 1}, source=str(source))
+
+    assert cache_key("fingerprint", {"seed": 1}, str(source)) == key
+    assert cache_key("fingerprint", {"seed": 2}, str(source)) != key
+    assert cache_key("other", {"seed": 1}, str(source)) != key
+    source.write_text("def step(): return 1\n")
+    assert cache_key("fingerprint", {"seed": 1}, str(source)) != key
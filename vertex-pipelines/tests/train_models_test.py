@@ -0,0 +1,143 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""train_models end to end on the synthetic beans frame."""
+
+import sys
+from pathlib import Path
+
+import joblib
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks import fakes  # noqa: E402
+from components.models.multi_model import train_models  # noqa: E402
+
+ESTIMATORS = ["logistic_regression", "decision_tree", "random_forest", "xgboost"]
+
+
+def encoded_frame(num_rows):
+    # split_data hands the trainers integer class codes.
+    frame = fakes.make_beans_frame(num_rows)
+    frame["Class"] = pd.Categorical(
+        frame["Class"],
+        categories=fakes.BEAN_CLASSES,
+    ).codes.astype("int64")
+    return frame
+
+
+def run(train_dataset, workdir, **kwargs):
+    outputs = {}
+    for name in ESTIMATORS:
+        outputs[f"{name}_model"] = fakes.output_artifact(workdir, f"{name}_model")
+        outputs[f"{name}_metrics"] = fakes.output_artifact(workdir, f"{name}_metrics")
+    train_models.python_func(train_dataset=train_dataset, n_jobs=2, **outputs, **kwargs)
+    return outputs
+
+
+def incremental_train(splits, delta_files):
+    # split_data's incremental splits: one directory of part files, the
+    # delta_files of them holding the rows this run added.
+    return fakes.FakeArtifact(
+        splits,
+        {
+            "format": "parquet",
+            "classes": fakes.BEAN_CLASSES,
+            "delta_files": delta_files,
+        },
+    )
+
+
+def test_full_fit(tmp_path):
+    path = tmp_path / "train.parquet"
+    encoded_frame(3000).to_parquet(path, index=False)
+    train = fakes.FakeArtifact(path, {"format": "parquet"})
+
+    outputs = run(train, tmp_path / "outputs")
+
+    for name in ESTIMATORS:
+        metrics = outputs[f"{name}_metrics"].metadata
+        assert metrics["aucRoc"] > 0.5
+        assert metrics["fit_rows"] == 2400
+        assert metrics["warm_start"] is False
+        model = joblib.load(outputs[f"{name}_model"].path)
+        assert list(model.feature_names_in_) == fakes.BEAN_FEATURES
+
+
+def test_warm_start(tmp_path):
+    frame = encoded_frame(6000)
+    splits = tmp_path / "incremental" / "train"
+    splits.mkdir(parents=True)
+    options = {"warm_start_uri": str(tmp_path / "state"), "warm_start_trees": 10}
+
+    frame.iloc[:4000].to_parquet(splits / "part-00000.parquet", index=False)
+    train = incremental_train(splits, ["part-00000.parquet"])
+    first = run(train, tmp_path / "first", **options)
+    for name in ESTIMATORS:
+        # Nothing to continue from yet: every estimator is fit from scratch.
+        assert first[f"{name}_metrics"].metadata["warm_start"] is False
+        assert (tmp_path / "state" / f"{name}.joblib").exists()
+
+    frame.iloc[4000:].to_parquet(splits / "part-00001.parquet", index=False)
+    train = incremental_train(splits, ["part-00001.parquet"])
+    second = run(train, tmp_path / "second", **options)
+    for name in ("random_forest", "xgboost"):
+        metrics = second[f"{name}_metrics"].metadata
+        assert metrics["warm_start"] is True
+        assert metrics["fit_rows"] == 1600
+        assert metrics["aucRoc"] > 0.5
+    for name in ("logistic_regression", "decision_tree"):
+        metrics = second[f"{name}_metrics"].metadata
+        assert metrics["warm_start"] is False
+        assert metrics["fit_rows"] == 4800
+    forest = joblib.load(second["random_forest_model"].path)
+    assert len(forest.estimators_) == 110
+    booster = joblib.load(second["xgboost_model"].path).get_booster()
+    assert booster.num_boosted_rounds() == 110
+
+    third = run(incremental_train(splits, []), tmp_path / "third", **options)
+    for name in ESTIMATORS:
+        metrics = third[f"{name}_metrics"].metadata
+        assert metrics["reused"] is True
+        assert metrics["aucRoc"] == second[f"{name}_metrics"].metadata["aucRoc"]
+
+
+def test_warm_start_cap(tmp_path):
+    frame = encoded_frame(6000)
+    splits = tmp_path / "incremental" / "train"
+    splits.mkdir(parents=True)
+    frame.iloc[:4000].to_parquet(splits / "part-00000.parquet", index=False)
+    frame.iloc[4000:].to_parquet(splits / "part-00001.parquet", index=False)
+    options = {
+        "warm_start_uri": str(tmp_path / "state"),
+        "warm_start_trees": 10,
+        "warm_start_max_trees": 105,
+    }
+
+    train = incremental_train(splits, ["part-00000.parquet"])
+    run(train, tmp_path / "first", **options)
+    train = incremental_train(splits, ["part-00001.parquet"])
+    outputs = run(train, tmp_path / "second", **options)
+
+    # The forest drops its oldest trees to stay at the cap.
+    assert outputs["random_forest_metrics"].metadata["warm_start"] is True
+    forest = joblib.load(outputs["random_forest_model"].path)
+    assert len(forest.estimators_) == 105
+    # XGBoost cannot, so it is refit from scratch on every row.
+    metrics = outputs["xgboost_metrics"].metadata
+    assert metrics["warm_start"] is False
+    assert metrics["fit_rows"] == 4800
+    booster = joblib.load(outputs["xgboost_model"].path).get_booster()
+    assert booster.num_boosted_rounds() == 100